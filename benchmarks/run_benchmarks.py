@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+
+# Benchmarks for the hot paths of the examples: the widget formulas
+# (widgets directory) and the vcs plotting helpers (visualization/vcs)
+#
+# Each benchmark runs a scenario several times and keeps the best time
+# (the least disturbed by the other processes running on the machine).
+# Scenarios that depend on a size (number of markers, number of zones,
+# ...) are run for several sizes, and each size is a separate result,
+# named like 'marker_layout[1000]'.
+#
+# * everything runs off-screen (bg=1), on synthetic data, or on the
+#   sample_data files of CDAT when they are available
+# * the vcs benchmarks are skipped when vcs (or cdms2) can not be
+#   imported, so the formula benchmarks can run anywhere
+# * the results are written to a JSON file. When there is a baseline
+#   results file, the times are compared to the baseline, and the
+#   script exits with status 1 if a result is slower than the baseline
+#   by more than the tolerance
+#
+# The times depend on the machine, so no baseline is distributed with
+# the script: generate one on your machine with -o first. By default,
+# the baseline is the baseline.json file next to this script, when it
+# exists (it is ignored by git), so that later runs are compared to it
+# without any option.
+#
+# Usage:
+#   python run_benchmarks.py -o baseline.json  # first run: create the baseline
+#   python run_benchmarks.py                   # compare to baseline.json
+#   python run_benchmarks.py -o results.json -b other_baseline.json
+#   python run_benchmarks.py -k thermo -r 10   # only the thermo benchmarks
+#   cp results.json baseline.json              # accept new times
+
+import sys, os
+import time
+import json
+import shutil
+import platform
+import tempfile
+import argparse
+from os import path
+
+import numpy as np
+
+here = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.join(here, '..', 'widgets'))
+sys.path.insert(0, path.join(here, '..', 'visualization', 'vcs'))
+
+try:
+    import cdms2
+    import vcs
+except ImportError:
+    vcs = None
+
+# The benchmarks: list of (name, function, needs vcs). Each function
+# gets the number of repeats, and returns a dictionary of
+#   result name -> {'time':best time (s), 'size':size, 'unit':unit}
+benchmarks = []
+
+def benchmark(name, needs_vcs=False):
+    def register(func):
+        benchmarks.append((name, func, needs_vcs))
+        return func
+    return register
+
+def best_time(func, repeat, setup=None):
+    # Best time of repeat calls of func (setup is called before each
+    # call, and not timed)
+    times = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        t_start = time.time()
+        func()
+        times.append(time.time() - t_start)
+    return min(times)
+
+def result(t, size, unit):
+    return {'time':t, 'size':size, 'unit':unit}
+
+# Formulas
+
+@benchmark('thermo')
+def bench_thermo(repeat):
+    from thermo_formulas import thermo_calc
+    n = 1000000
+    rng = np.random.RandomState(0)
+    p = rng.uniform(50000., 105000., n) # Pa
+    T = rng.uniform(220., 320., n)
+    RH = rng.uniform(1., 100., n)
+    return {'thermo_calc[1e6]':
+                result(best_time(lambda: thermo_calc(p, T, RH), repeat), n, 'samples')}
+
+@benchmark('geo_gradient')
+def bench_geo_gradient(repeat):
+    from gradient_wind import geo_gradient, grid_gradient_wind
+    n = 1000000
+    rng = np.random.RandomState(0)
+    lat = rng.uniform(10., 80., n)
+    distance = rng.uniform(100., 1000., n)
+    radius = rng.uniform(100., 3000., n)
+    results = {'geo_gradient[1e6]':
+                   result(best_time(lambda: geo_gradient(lat, 60., distance, radius), repeat),
+                          n, 'samples')}
+    # 1 degree global grid of a geopotential height field
+    lats = np.arange(-89.5, 90., 1.)
+    lons = np.arange(0., 360., 1.)
+    lat2, lon2 = np.meshgrid(lats, lons, indexing='ij')
+    zg = 5500. + 200. * np.cos(np.radians(2 * lat2)) + 50. * np.sin(np.radians(3 * lon2))
+    results['grid_gradient_wind[180x360]'] = \
+        result(best_time(lambda: grid_gradient_wind(zg, lats, lons), repeat),
+               zg.size, 'grid points')
+    return results
+
+@benchmark('marker_layout')
+def bench_marker_layout(repeat):
+    from marker_layout import marker_layout
+    results = {}
+    rng = np.random.RandomState(0)
+    for n in (100, 1000, 10000, 100000):
+        lats = rng.uniform(-90., 90., n)
+        lons = rng.uniform(-180., 180., n)
+        values = rng.uniform(0., 100., n)
+        def build():
+            marker_layout(lats, lons, values,
+                          size=lambda lats, lons, values: 3 + (values / 20).astype(int),
+                          color=lambda lats, lons, values: np.where(lats >= 0, 247, 246),
+                          halo=lons < 0)
+        results['marker_layout[%i]' % (n,)] = result(best_time(build, repeat), n, 'markers')
+    return results
+
+# vcs
+
+def sample_variable():
+    # One time step of the sample data, or a synthetic field
+    import bf_marker_proj_easy as bfm
+    data_path = path.join(bfm.data_dir, bfm.data_file)
+    if path.exists(data_path):
+        return bfm.read_data(data_path)
+    lat = cdms2.createAxis(np.arange(-88.75, 90., 2.5), id='latitude')
+    lat.designateLatitude()
+    lon = cdms2.createAxis(np.arange(-180., 180.1, 2.5), id='longitude')
+    lon.designateLongitude()
+    lat2, lon2 = np.meshgrid(lat[:], lon[:], indexing='ij')
+    data = 270. + 30. * np.cos(np.radians(lat2)) + 5. * np.sin(np.radians(2 * lon2))
+    return cdms2.createVariable(data, axes=[lat, lon], id='tas')
+
+@benchmark('marker_render', needs_vcs=True)
+def bench_marker_render(repeat):
+    import bf_marker_proj_easy as bfm
+    from marker_layout import marker_layout, apply_layout
+    x = vcs.init()
+    tpl = bfm.create_template(x)
+    pm = bfm.create_projection(x, 'robinson')
+    marker = x.createmarker('bench_marker')
+    marker.projection = pm
+    marker.worldcoordinate = [-180, 180, -90, 90]
+    marker.viewport = [tpl.data.x1, tpl.data.x2, tpl.data.y1, tpl.data.y2]
+    results = {}
+    rng = np.random.RandomState(0)
+    for n in (100, 1000, 10000):
+        lats = rng.uniform(-90., 90., n)
+        lons = rng.uniform(-180., 180., n)
+        apply_layout(marker, marker_layout(lats, lons, size=5, color=241))
+        results['x.marker[%i]' % (n,)] = \
+            result(best_time(lambda: x.marker(marker, bg=1), repeat, x.clear), n, 'markers')
+    x.close()
+    return results
+
+@benchmark('polargol_setup', needs_vcs=True)
+def bench_polargol_setup(repeat):
+    from polargol import create_gm, create_tpl_land
+    x = vcs.init()
+    results = {}
+    t_tpl = best_time(lambda: create_tpl_land(x, tpl_d={}), 1)
+    results['create_tpl_land'] = result(t_tpl, 1, 'calls')
+    runs = [0]
+    for nb_zones in (2, 8, 32):
+        # Different graphics methods and zone names for each run, so
+        # that each run really creates its graphics methods
+        def setup():
+            runs[0] += 1
+        def run():
+            bf = x.createboxfill('bench_bf_%i' % (runs[0],))
+            lat_step = 180. / nb_zones
+            zones = {}
+            for i in range(nb_zones):
+                lat1 = -90. + i * lat_step
+                zones['z%i_%i' % (runs[0], i)] = (lat1, lat1 + lat_step, -180, 180)
+            create_gm(x, gm_d={'bench_bf_%i' % (runs[0],):bf}, proj_d={},
+                      select_d={}, zones=zones)
+        results['create_gm[%i zones]' % (nb_zones,)] = \
+            result(best_time(run, repeat, setup), nb_zones, 'zones')
+    x.close()
+    return results
+
+@benchmark('projected_cells', needs_vcs=True)
+def bench_projected_cells(repeat):
+    # Plain x.plot of a custom boxfill with a robinson projection, and
+    # the same plot with the cached projected cells (plot_cells with
+    # keep_fills=True, after a first plot that creates the fill areas).
+    # The cached cells are only worth using when the second time is
+    # smaller than the first one
+    import bf_marker_proj_easy as bfm
+    from projected_cells import plot_cells, CellCache
+    x = vcs.init()
+    v = sample_variable()
+    tpl = bfm.create_template(x)
+    pm = bfm.create_projection(x, 'robinson')
+    levels = list(np.linspace(220., 320., 11))
+    colors = [int(c) for c in np.linspace(16, 239, 10)]
+    bf = x.createboxfill('bench_cells')
+    bf.boxfill_type = 'custom'
+    bf.levels = levels
+    bf.fillareacolors = colors
+    bf.projection = pm
+    results = {}
+    results['boxfill_robinson[%ix%i]' % v.shape] = \
+        result(best_time(lambda: x.plot(tpl, pm, bf, v, bg=1), repeat, x.clear),
+               v.size, 'cells')
+    cache = CellCache()
+    x.clear()
+    plot_cells(x, v, 'robinson', levels, colors, tpl, cache=cache, keep_fills=True)
+    results['plot_cells_robinson[%ix%i]' % v.shape] = \
+        result(best_time(lambda: plot_cells(x, v, 'robinson', levels, colors, tpl,
+                                            cache=cache, keep_fills=True),
+                         repeat, x.clear), v.size, 'cells')
+    x.close()
+    return results
+
+@benchmark('export', needs_vcs=True)
+def bench_export(repeat):
+    import bf_marker_proj_easy as bfm
+    x = vcs.init()
+    v = sample_variable()
+    bfm.plot_figure(x, v, 'robinson', bg=1)
+    out_dir = tempfile.mkdtemp(prefix='bench_export_')
+    results = {}
+    try:
+        for out_type in ('png', 'pdf', 'svg'):
+            for resolution in bfm.output_res:
+                name = path.join(out_dir, 'bench')
+                results['%s[%s]' % (out_type, resolution)] = \
+                    result(best_time(lambda: bfm.export_figure(x, name, [out_type], [resolution]),
+                                     repeat), 1, 'files')
+    finally:
+        shutil.rmtree(out_dir)
+        x.close()
+    return results
+
+# Running and comparing
+
+def run_all(repeat=5, keyword=None):
+    results = {}
+    skipped = []
+    for name, func, needs_vcs in benchmarks:
+        if keyword is not None and keyword not in name:
+            continue
+        if needs_vcs and vcs is None:
+            skipped.append(name)
+            continue
+        print('Running %s...' % (name,))
+        results.update(func(repeat))
+    return {'machine':platform.node(),
+            'python':platform.python_version(),
+            'numpy':np.__version__,
+            'date':time.strftime('%Y-%m-%d %H:%M:%S'),
+            'repeat':repeat,
+            'skipped':skipped,
+            'results':results}
+
+def compare(results, baseline, tolerance=1.2):
+    # Return the list of (name, time, baseline time) of the results
+    # that are slower than tolerance * baseline time
+    regressions = []
+    base_results = baseline['results']
+    for name in sorted(results['results']):
+        if name in base_results:
+            t = results['results'][name]['time']
+            t_base = base_results[name]['time']
+            if t > tolerance * t_base:
+                regressions.append((name, t, t_base))
+    return regressions
+
+def report(results, baseline=None):
+    base_results = {} if baseline is None else baseline['results']
+    for name in sorted(results['results']):
+        res = results['results'][name]
+        line = '%-32s %10.4f s  %12.0f %s/s' % (name, res['time'],
+                                                res['size'] / max(res['time'], 1e-9),
+                                                res['unit'])
+        if name in base_results:
+            line += '  (x%.2f)' % (res['time'] / max(base_results[name]['time'], 1e-9),)
+        print(line)
+    if results['skipped']:
+        print('Skipped (no vcs): %s' % (', '.join(results['skipped']),))
+
+# Baseline used when -b is not given (see above)
+default_baseline = path.join(here, 'baseline.json')
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Run the benchmarks of the examples')
+    parser.add_argument('-o', '--output', default='benchmark_results.json',
+                        help='JSON file for the results')
+    parser.add_argument('-b', '--baseline', default=default_baseline,
+                        help='JSON results to compare with (default: %(default)s, if it exists)')
+    parser.add_argument('-t', '--tolerance', type=float, default=1.2,
+                        help='slowdown factor reported as a regression')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of runs of each scenario')
+    parser.add_argument('-k', '--keyword', help='only run the benchmarks with this in their name')
+    options = parser.parse_args(args)
+
+    results = run_all(options.repeat, options.keyword)
+    f = open(options.output, 'w')
+    json.dump(results, f, indent=1, sort_keys=True)
+    f.close()
+
+    baseline = None
+    if options.baseline and (options.baseline != default_baseline or
+                             path.exists(default_baseline)):
+        f = open(options.baseline)
+        baseline = json.load(f)
+        f.close()
+        if baseline.get('machine') != results['machine']:
+            print('Warning: the baseline was made on another machine (%s)'
+                  % (baseline.get('machine'),))
+    else:
+        print('No baseline: run with -o %s first to create one' % (default_baseline,))
+    report(results, baseline)
+    if baseline is not None:
+        regressions = compare(results, baseline, options.tolerance)
+        for name, t, t_base in regressions:
+            print('REGRESSION %s: %.4f s (baseline %.4f s)' % (name, t, t_base))
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# The end
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+# Module for making animations of many time steps of a variable (e.g. a
+# daily tas field for a whole year), with the same template, projection,
+# continents and markers on all the frames
+#
+# x.plot(tpl, pm, bf, v) draws the whole figure: the template
+# decorations (title, legend, tick labels, ...), the data, the
+# continents, and then the markers are drawn with x.marker. In an
+# animation, only the data changes from one frame to the next.
+#
+# A LayerAnimation splits the figure in 3 layers:
+# * the base: the whole figure of the first frame, without continents
+#   and markers. It is drawn only once
+# * the data: only the data area (template based on ASD_dud), drawn for
+#   each frame, and pasted over the data area of the base
+# * the overlay: the continents, the meridians/parallels of the template
+#   (xtic1/ytic1) and the markers, drawn only once on a transparent
+#   image, and pasted over each frame
+# The frames are assembled with PIL, and sent to a 'sink': a sequence of
+# numbered png files (PngSequence), or a video encoder reading the raw
+# frames (FFmpegSink, if the ffmpeg program is available).
+#
+# IMPORTANT! The levels of the graphics method have to be the same for
+# all the frames (e.g. bf.level_1 and bf.level_2 of a boxfill), since
+# the legend of the base is not drawn again
+#
+# Example:
+#   bf.level_1, bf.level_2 = 220, 320
+#   anim = LayerAnimation(x, tpl, pm, bf, v0, markers=marker_test)
+#   f = cdms2.open('tas_day.nc')
+#   anim.animate(time_steps(f, 'tas'), PngSequence('tas_%04i.png'))
+
+import os
+import subprocess
+import tempfile
+
+from vcs_registry import registry
+from async_export import grab_frame
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+def time_steps(f, var_name, chunk_size=10, **selectors):
+    # Generator returning the time steps of the var_name variable of the
+    # f cdms2 file one by one (as variables without the time axis). The
+    # file is read chunk_size time steps at a time
+    nb_times = len(f[var_name].getTime())
+    for start in range(0, nb_times, chunk_size):
+        stop = min(start + chunk_size, nb_times)
+        chunk = f(var_name, time=slice(start, stop), **selectors)
+        for i in range(stop - start):
+            yield chunk[i]
+
+class PngSequence:
+    # Save the frames as numbered png files
+
+    def __init__(self, pattern='frame_%04i.png', compress_level=1):
+        self.pattern = pattern
+        self.compress_level = compress_level
+        self.files = []
+
+    def write(self, image):
+        file_name = self.pattern % (len(self.files),)
+        image.save(file_name, compress_level=self.compress_level)
+        self.files.append(file_name)
+
+    def close(self):
+        return self.files
+
+class FFmpegSink:
+    # Send the frames to ffmpeg, as raw RGB pixels on its standard
+    # input, without writing intermediate files
+
+    def __init__(self, out_file, width, height, fps=25, ffmpeg='ffmpeg',
+                 options=('-pix_fmt', 'yuv420p')):
+        self.out_file = out_file
+        self.size = (width, height)
+        command = [ffmpeg, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                   '-s', '%ix%i' % (width, height), '-r', str(fps),
+                   '-i', '-'] + list(options) + [out_file]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, image):
+        if image.size != self.size:
+            image = image.resize(self.size)
+        self.process.stdin.write(image.convert('RGB').tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise IOError('ffmpeg could not write %s' % (self.out_file,))
+        return [self.out_file]
+
+class LayerAnimation:
+
+    def __init__(self, x, tpl, pm, gm, v0, width=1100, height=850,
+                 markers=None, cont_type=1, cont_color=241):
+        if Image is None:
+            raise ImportError('LayerAnimation needs the PIL (or Pillow) module')
+        self.x = x
+        self.pm = pm
+        self.gm = gm
+        self.size = (width, height)
+        reg = registry(x)
+
+        # Data layer template: only the data area of tpl
+        self.tpl_data, created = reg.get_or_create('template', 'tpl_anim_data', 'ASD_dud')
+        self._copy_data_area(tpl, self.tpl_data)
+        # Pixel box of the data area (the images start at the top left
+        # corner, the template coordinates at the bottom left corner)
+        self.box = (int(round(tpl.data.x1 * width)), int(round((1 - tpl.data.y2) * height)),
+                    int(round(tpl.data.x2 * width)), int(round((1 - tpl.data.y1) * height)))
+
+        # Base layer
+        x.clear()
+        x.plot(tpl, pm, gm, v0, continents=0, bg=1)
+        self.base = self._frame().convert('RGB')
+
+        # Overlay layer: continents, meridians/parallels and markers
+        tpl_over, created = reg.get_or_create('template', 'tpl_anim_over', 'ASD_dud')
+        self._copy_data_area(tpl, tpl_over)
+        for tic in ('xtic1', 'ytic1'):
+            src = getattr(tpl, tic)
+            dst = getattr(tpl_over, tic)
+            dst.priority = src.priority
+            dst.x1, dst.x2, dst.y1, dst.y2 = src.x1, src.x2, src.y1, src.y2
+        cont, created = reg.get_or_create('continents', 'cont_anim')
+        cont.projection = pm
+        cont.datawc(gm.datawc_y1, gm.datawc_y2, gm.datawc_x1, gm.datawc_x2)
+        cont.xticlabels1 = gm.xticlabels1
+        cont.yticlabels1 = gm.yticlabels1
+        cont.type = cont_type
+        cont.linecolor = cont_color
+        x.clear()
+        x.plot(tpl_over, cont, bg=1)
+        if markers is not None:
+            x.marker(markers, bg=1)
+        fd, tmp_file = tempfile.mkstemp(suffix='.png')
+        os.close(fd)
+        try:
+            x.png(tmp_file[:-4], width=width, height=height, units='pixels',
+                  draw_white_background=False)
+            self.overlay = Image.open(tmp_file).convert('RGBA')
+            self.overlay.load()
+        finally:
+            os.remove(tmp_file)
+        if self.overlay.size != self.size:
+            self.overlay = self.overlay.resize(self.size)
+
+    def _copy_data_area(self, tpl, dst):
+        dst.data.x1 = tpl.data.x1
+        dst.data.x2 = tpl.data.x2
+        dst.data.y1 = tpl.data.y1
+        dst.data.y2 = tpl.data.y2
+
+    def _frame(self):
+        # Image of the canvas: the pixels of the render window if
+        # possible, or a png file
+        width, height = self.size
+        pixels = grab_frame(self.x, width, height)
+        if pixels is not None:
+            return Image.fromarray(pixels)
+        fd, tmp_file = tempfile.mkstemp(suffix='.png')
+        os.close(fd)
+        try:
+            self.x.png(tmp_file[:-4], width=width, height=height, units='pixels')
+            image = Image.open(tmp_file)
+            image.load()
+        finally:
+            os.remove(tmp_file)
+        if image.size != self.size:
+            image = image.resize(self.size)
+        return image
+
+    def render_frame(self, v):
+        # Return the frame of the v variable, as a PIL image
+        self.x.clear()
+        self.x.plot(self.tpl_data, self.pm, self.gm, v, continents=0, bg=1)
+        data = self._frame().convert('RGB').crop(self.box)
+        image = self.base.copy()
+        image.paste(data, self.box[:2])
+        return Image.alpha_composite(image.convert('RGBA'), self.overlay).convert('RGB')
+
+    def animate(self, variables, sink):
+        # Render the frames of all the variables (e.g. time_steps(...))
+        # and send them to the sink. Return what sink.close() returns
+        # (the list of the created files)
+        try:
+            for v in variables:
+                sink.write(self.render_frame(v))
+        finally:
+            created = sink.close()
+        return created
+
+# Test the module by running it as a script: animation of the time
+# steps of the sample data, with the figure of bf_marker_proj_easy.py
+if __name__ == '__main__':
+
+    from os import path
+    import cdms2
+    import vcs
+    import bf_marker_proj_easy as bfm
+
+    f = cdms2.open(path.join(bfm.data_dir, bfm.data_file))
+    selectors = {'latitude':(bfm.latmin, bfm.latmax),
+                 'longitude':(bfm.lonmin, bfm.lonmax, 'oo')}
+    steps = time_steps(f, bfm.var_name, **selectors)
+    v0 = next(steps)
+
+    x = vcs.init()
+    x.setcolormap('rainbow')
+    tpl = bfm.create_template(x)
+    pm = bfm.create_projection(x, bfm.proj_type)
+    bf = bfm.create_boxfill(x)
+    # Same levels for all the frames
+    bf.level_1 = 220
+    bf.level_2 = 320
+    marker_test = bfm.create_markers(x, pm, tpl)
+
+    anim = LayerAnimation(x, tpl, pm, bf, v0, markers=marker_test)
+    out_dir = 'animation_out'
+    if not path.exists(out_dir):
+        os.mkdir(out_dir)
+    sink = PngSequence(path.join(out_dir, 'tas_%04i.png'))
+    sink.write(anim.render_frame(v0))
+    created = anim.animate(steps, sink)
+    f.close()
+    print('%i frames in %s' % (len(created), out_dir))
+
+# The end
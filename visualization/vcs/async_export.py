@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+# Module for saving the plots of a canvas in the background, so that
+# the canvas can render the next image while the previous ones are
+# being encoded and written to the disk
+#
+# x.png(...) renders the canvas at the requested size, and then encodes
+# the image and writes the file, before returning. When many images are
+# saved (e.g. the formats and resolutions of bf_marker_proj_easy.py),
+# the canvas waits for each encoding and each disk write.
+#
+# An AsyncExporter splits the png export in 2 stages:
+# * the canvas stage, in the thread that uses the canvas (vcs is not
+#   thread-safe): the canvas is rendered off-screen at the requested
+#   size, and its pixels are copied from the VTK render window (the
+#   'frame')
+# * the encoding stage, in a pool of background threads: the frames are
+#   encoded as png with PIL (which releases the GIL while compressing)
+#   and written to the disk
+# The frames wait in a bounded queue: when max_pending frames are
+# waiting, export() blocks until a thread takes one, so that the frames
+# do not fill the memory.
+#
+# The vector formats (pdf, svg, ...) can not be split this way: they are
+# saved directly by the canvas, while the threads keep encoding the
+# previous frames. The same is done for png if PIL or the VTK render
+# window are not available, and when the canvas is on the screen (not
+# plotted with bg=1): resizing a visible window to the size of the
+# image would resize it on the screen, maybe beyond the display size.
+#
+# join() waits for all the images, stops the threads, and raises an
+# ExportError listing the failed files (if any).
+#
+# Example:
+#   exporter = AsyncExporter(x, nb_threads=2)
+#   for resolution in (1, 2, 4):
+#       exporter.export('plot_%i' % (resolution,), 'png',
+#                       resolution*11, resolution*8)
+#   created = exporter.join()
+
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue # python 2
+
+import numpy as np
+
+try:
+    import vtk
+    from vtk.util.numpy_support import vtk_to_numpy
+except ImportError:
+    vtk = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+class ExportError(Exception):
+
+    def __init__(self, failures):
+        self.failures = failures # list of (file name, error message)
+        Exception.__init__(self, '%i file(s) could not be saved: %s' %
+                           (len(failures), ', '.join([name for name, msg in failures])))
+
+def grab_frame(x, width, height):
+    # Render the x canvas off-screen at width x height pixels, and
+    # return its pixels as a (height, width, 3 or 4) uint8 array, or None
+    # if the canvas does not have an off-screen VTK render window. The
+    # size of the canvas is restored after the grab
+    ren_win = getattr(getattr(x, 'backend', None), 'renWin', None)
+    if vtk is None or ren_win is None or not ren_win.GetOffScreenRendering():
+        return None
+    old_width, old_height = ren_win.GetSize()
+    x.geometry(width, height)
+    try:
+        ren_win.Render()
+        grabber = vtk.vtkWindowToImageFilter()
+        grabber.SetInput(ren_win)
+        grabber.ReadFrontBufferOff()
+        grabber.Update()
+        image = grabber.GetOutput()
+    finally:
+        x.geometry(old_width, old_height)
+    w, h, d = image.GetDimensions()
+    pixels = vtk_to_numpy(image.GetPointData().GetScalars())
+    # VTK images start at the bottom left corner
+    return np.ascontiguousarray(pixels.reshape(h, w, -1)[::-1])
+
+class AsyncExporter:
+
+    def __init__(self, x, nb_threads=2, max_pending=4, dpi=72, compress_level=6):
+        self.x = x
+        self.dpi = dpi
+        self.compress_level = compress_level
+        self.frames = queue.Queue(max_pending)
+        self.created = []
+        self.failures = []
+        self.lock = threading.Lock()
+        self.threads = []
+        for i in range(nb_threads):
+            thread = threading.Thread(target=self._encode_frames)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _encode_frames(self):
+        # Encoding thread: encode and write the frames of the queue,
+        # until it gets None
+        while True:
+            job = self.frames.get()
+            try:
+                if job is None:
+                    break
+                file_name, frame = job
+                try:
+                    mode = 'RGBA' if frame.shape[2] == 4 else 'RGB'
+                    Image.fromarray(frame, mode).save(file_name,
+                                                      compress_level=self.compress_level)
+                    self._done(file_name)
+                except Exception as err:
+                    self._done(file_name, err)
+            finally:
+                self.frames.task_done()
+
+    def _done(self, file_name, err=None):
+        with self.lock:
+            if err is None:
+                self.created.append(file_name)
+            else:
+                self.failures.append((file_name, '%s: %s' % (err.__class__.__name__, err)))
+
+    def export(self, plotname, out_type, width, height):
+        # Save the x canvas in plotname.out_type, with the size given in
+        # inches (as in x.png(plotname, width=..., height=...)), and
+        # return the file name. Png files are encoded in the background
+        file_name = '%s.%s' % (plotname, out_type)
+        frame = None
+        if out_type == 'png' and Image is not None:
+            try:
+                frame = grab_frame(self.x, int(round(width * self.dpi)),
+                                   int(round(height * self.dpi)))
+            except Exception as err:
+                self._done(file_name, err)
+                return file_name
+        if frame is not None:
+            self.frames.put((file_name, frame)) # blocks if the queue is full
+            return file_name
+        # Direct (blocking) export with the canvas
+        try:
+            getattr(self.x, out_type)(plotname, width=width, height=height)
+            self._done(file_name)
+        except Exception as err:
+            self._done(file_name, err)
+        return file_name
+
+    def join(self, raise_errors=True):
+        # Wait for all the images, stop the threads and return the list
+        # of the created files. Raise an ExportError if some files could
+        # not be saved (or return them in self.failures, if raise_errors
+        # is False)
+        for thread in self.threads:
+            self.frames.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.failures and raise_errors:
+            raise ExportError(self.failures)
+        return self.created
+
+# The end
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+# Module for choosing the levels, colors and legend of a graphics
+# method (isofill, boxfill) from the quantiles of the data, instead of
+# hard-coding them (e.g. isof.levels = [220, 240, ...])
+#
+# The quantiles are estimated with a streaming 'sketch' (a simplified
+# KLL sketch), so that the data never has to be in memory all at once:
+# * the values are added chunk by chunk (e.g. a few time steps at a
+#   time, see sketch_variable), and the sketch keeps at most about k
+#   values per 'level', whatever the number of values added. A value of
+#   level h stands for 2**h values of the data
+# * when a level is full, its values are sorted and one value out of 2
+#   is kept (starting at a random position) and moved to the next level
+# * 2 sketches can be merged (e.g. the sketches of several variables
+#   or files, computed by different processes, see sketch_files), which
+#   gives the same kind of sketch as if all the values had been added
+#   to the same sketch
+# The error of the estimated quantiles is about 1/k (in rank), which is
+# much smaller than needed for choosing color levels with the default
+# k. The minimum and maximum are exact.
+#
+# auto_levels then returns the levels at regularly spaced quantiles
+# (rounded to 'nice' values), the matching fillareacolors (spread over
+# the colors of the colormap), the legend labels and the extension
+# arrows to use, in a dictionary that can be applied to a graphics
+# method with apply_levels
+#
+# Example:
+#   f = cdms2.open('tas_day.nc')
+#   sketch = sketch_variable(f, 'tas', latitude=(-90, 90))
+#   spec = auto_levels(sketch, nb_intervals=10)
+#   isof = x.createisofill('tas_auto')
+#   apply_levels(isof, spec)
+
+import math
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+from numpy import ma
+
+class QuantileSketch:
+
+    def __init__(self, k=2048, seed=None):
+        self.k = k
+        self.levels = [] # levels[h]: values that each stand for 2**h values
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._random = np.random.RandomState(seed)
+
+    def update(self, values):
+        # Add values (array, masked array or cdms2 variable) to the
+        # sketch. The masked values and the NaNs are ignored
+        data = ma.masked_invalid(ma.asarray(values, dtype=float)).compressed()
+        if data.size == 0:
+            return self
+        self.count += data.size
+        self.min = min(self.min, data.min())
+        self.max = max(self.max, data.max())
+        self._add(0, data)
+        self._compress()
+        return self
+
+    def merge(self, other):
+        # Add the values of another sketch to this sketch
+        if other.count == 0:
+            return self
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for h, values in enumerate(other.levels):
+            self._add(h, values)
+        self._compress()
+        return self
+
+    def _add(self, h, values):
+        while len(self.levels) <= h:
+            self.levels.append(np.empty(0))
+        self.levels[h] = np.concatenate((self.levels[h], values))
+
+    def _compress(self):
+        # Halve the levels that have more than k values
+        h = 0
+        while h < len(self.levels):
+            values = self.levels[h]
+            if values.size > self.k:
+                values = np.sort(values)
+                if values.size % 2:
+                    # Keep 1 value (the first or the last one) at this
+                    # level, so that the compacted values go by pairs
+                    if self._random.randint(2):
+                        kept, values = values[:1], values[1:]
+                    else:
+                        kept, values = values[-1:], values[:-1]
+                else:
+                    kept = np.empty(0)
+                self.levels[h] = kept
+                self._add(h + 1, values[self._random.randint(2)::2])
+            h += 1
+
+    def __len__(self):
+        return self.count
+
+    def quantiles(self, qs):
+        # Return the estimated values at the qs quantiles (0 <= q <= 1)
+        if self.count == 0:
+            raise ValueError('Can not compute the quantiles of an empty sketch')
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2. ** h)
+                                  for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='mergesort')
+        values = values[order]
+        cum_weights = np.cumsum(weights[order])
+        qs = np.clip(np.asarray(qs, dtype=float), 0., 1.)
+        idx = np.searchsorted(cum_weights, qs * cum_weights[-1], side='left')
+        result = values[np.clip(idx, 0, len(values) - 1)]
+        # Exact extremes
+        result = np.where(qs <= 0., self.min, result)
+        result = np.where(qs >= 1., self.max, result)
+        return result
+
+def sketch_variable(f, var_name, chunk_size=10, sketch=None, **selectors):
+    # Sketch of the values of the var_name variable of the f cdms2 file,
+    # read chunk_size indices of its first axis (usually time) at a
+    # time. Give an existing sketch to add the values to it
+    if sketch is None:
+        sketch = QuantileSketch()
+    first_axis = f[var_name].getAxis(0)
+    for start in range(0, len(first_axis), chunk_size):
+        stop = min(start + chunk_size, len(first_axis))
+        chunk_selectors = dict(selectors)
+        chunk_selectors[first_axis.id] = slice(start, stop)
+        sketch.update(f(var_name, **chunk_selectors))
+    return sketch
+
+def _sketch_file(job):
+    # Sketch of one (file_name, var_name, selectors) job, in a worker
+    # process
+    import cdms2
+    file_name, var_name, selectors = job
+    f = cdms2.open(file_name)
+    try:
+        return sketch_variable(f, var_name, **selectors)
+    finally:
+        f.close()
+
+def sketch_files(jobs, nb_processes=None):
+    # Merged sketch of the variables of several files. jobs is a list of
+    # (file_name, var_name) or (file_name, var_name, selectors) tuples,
+    # that are sketched in parallel by a pool of processes
+    jobs = [tuple(job) + ({},) * (3 - len(job)) for job in jobs]
+    if nb_processes is None:
+        nb_processes = cpu_count()
+    nb_processes = min(nb_processes, len(jobs))
+    if nb_processes <= 1:
+        sketches = [_sketch_file(job) for job in jobs]
+    else:
+        pool = Pool(nb_processes)
+        try:
+            sketches = pool.map(_sketch_file, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    merged = QuantileSketch()
+    for sketch in sketches:
+        merged.merge(sketch)
+    return merged
+
+def _round_levels(levels):
+    # Round the levels to the precision of their smallest difference,
+    # removing the levels that become equal
+    steps = np.diff(levels)
+    steps = steps[steps > 0]
+    if steps.size == 0:
+        return [float(levels[0])]
+    precision = 10. ** math.floor(math.log10(steps.min()))
+    rounded = np.unique(np.round(np.asarray(levels) / precision) * precision)
+    return [float(level) for level in rounded]
+
+def quantile_levels(sketch, nb_intervals=10, low=0.02, high=0.98):
+    # Levels at nb_intervals + 1 regularly spaced quantiles between the
+    # low and high quantiles (the extremes are usually left out, so
+    # that a few outliers do not get colors of their own)
+    return _round_levels(sketch.quantiles(np.linspace(low, high, nb_intervals + 1)))
+
+def level_colors(nb_colors, color_1=16, color_2=239):
+    # nb_colors color indices regularly spread between color_1 and
+    # color_2 (the data colors of the vcs colormaps)
+    if nb_colors == 1:
+        return [color_1]
+    return [int(round(c)) for c in np.linspace(color_1, color_2, nb_colors)]
+
+def legend_labels(levels, fmt='%g'):
+    # Legend dictionary {level: label} of the levels
+    return dict([(level, fmt % (level,)) for level in levels])
+
+def auto_levels(sketch, nb_intervals=10, low=0.02, high=0.98,
+                color_1=16, color_2=239, fmt='%g'):
+    # Return a dictionary with the 'levels', 'fillareacolors', 'legend',
+    # 'ext_1' and 'ext_2' attributes of a graphics method, from the
+    # quantiles of the sketch. The extension arrows are used when some
+    # values are outside of the levels
+    levels = quantile_levels(sketch, nb_intervals, low, high)
+    if len(levels) < 2:
+        # (Almost) constant data
+        delta = abs(levels[0]) / 10. or 1.
+        levels = [levels[0] - delta, levels[0] + delta]
+    return {'levels':levels,
+            'fillareacolors':level_colors(len(levels) - 1, color_1, color_2),
+            'legend':legend_labels(levels, fmt),
+            'ext_1':'y' if sketch.min < levels[0] else 'n',
+            'ext_2':'y' if sketch.max > levels[-1] else 'n'}
+
+def apply_levels(gm, spec):
+    # Set the attributes returned by auto_levels on an isofill or
+    # boxfill graphics method (a boxfill is switched to the 'custom'
+    # type, that uses levels and fillareacolors)
+    if hasattr(gm, 'boxfill_type'):
+        gm.boxfill_type = 'custom'
+    # The values outside of the levels get the first and last colors,
+    # with the extension arrows of the legend
+    gm.levels = spec['levels']
+    gm.fillareacolors = spec['fillareacolors']
+    gm.legend = spec['legend']
+    gm.ext_1 = spec['ext_1']
+    gm.ext_2 = spec['ext_2']
+    return gm
+
+# The end
@@ -20,6 +20,10 @@
 #      + ...
 # * do some operating system related operations with 'path' and 'os'
 #   in an os-independant way
+#
+# The script is organized in functions, so that it can also be imported
+# as a module (see export_engine.py, which uses it to export the same
+# figure for many projections in parallel)
 
 # Notes for NEW CDAT USERS :-)
 #
@@ -51,7 +55,23 @@ from os import path
 # Import what we need from CDAT
 import cdms2
 import vcs
-from numpy import ma
+import numpy as np
+
+# Vectorized building of the marker lists (marker_layout.py)
+from marker_layout import marker_layout, apply_layout
+# Vectorized masking (masking.py)
+from masking import diagonal_mask, apply_mask
+# Quick lookup of the existing vcs elements (vcs_registry.py)
+from vcs_registry import registry
+# Memory-mapped reading of big variables (mmap_reader.py)
+from mmap_reader import read_mapped, MappingError
+# Background encoding of the png files (async_export.py)
+from async_export import AsyncExporter
+# Timing spans, disabled by default (spans.py)
+from spans import span, timed
+import spans
+# Resolution of the data matching the output size (lod.py)
+from lod import Pyramid
 
 # Some data we can plot from the 'sample_data' directory
 # supplied with CDAT
@@ -60,33 +80,51 @@ data_dir = path.join(sys.prefix, 'sample_data')
 data_file = 'tas_mo.nc'
 var_name = 'tas'
 
-# Projection type. You can select any of the follosing
-#   'linear', 'utm', 'state plane', 'albers equal area', 'lambert',
-#   'mercator', 'polar', 'polyconic', 'equid conic a', 'transverse
-#   mercator', 'stereographic', 'lambert azimuthal', 'azimuthal',
-#   'gnomonic', 'orthographic', 'gen. vert. near per', 'sinusoidal',
-#   'equirectangular', 'miller', 'van der grinten', 'hotin',
-#   'robinson', 'space oblique', 'alaska', 'interrupted goode',
-#   'mollweide', 'interrupted mollweide', 'hammer', 'wagner iv',
-#   'wagner vii', 'oblated'
+# Projection type. You can select any of the following
+proj_types = ['linear', 'utm', 'state plane', 'albers equal area', 'lambert',
+              'mercator', 'polar', 'polyconic', 'equid conic a',
+              'transverse mercator', 'stereographic', 'lambert azimuthal',
+              'azimuthal', 'gnomonic', 'orthographic', 'gen. vert. near per',
+              'sinusoidal', 'equirectangular', 'miller', 'van der grinten',
+              'hotin', 'robinson', 'space oblique', 'alaska',
+              'interrupted goode', 'mollweide', 'interrupted mollweide',
+              'hammer', 'wagner iv', 'wagner vii', 'oblated']
 #proj_type = 'linear'
 proj_type = 'robinson'
 #proj_type = 'mollweide'
 #proj_type = 'sinusoidal'
 #proj_type = 'van der grinten'
 
-# Initialize the graphics canvas
-x = vcs.init()
-
-# Output file formats
-#output_types = [x.png, x.pdf, x.svg]
-output_types = [x.png, x.pdf]
+# Output file formats (names of the canvas methods used for saving)
+#output_types = ['png', 'pdf', 'svg']
+output_types = ['png', 'pdf']
 
 # Output 'resolutions'
 # Suggested resolution: use 2 or 3
 # output_res = [1] # What we have by default
 output_res = [0.5, 1, 2, 3, 4]
 
+# Encode and write the png files in background threads, while the
+# canvas renders the next outputs (see async_export.py). This only
+# makes a difference for off-screen plots (bg_type = 1): the png files
+# of on-screen canvases are saved directly by the canvas
+async_export = False
+#async_export = True
+
+# Read the data by memory-mapping the file (see mmap_reader.py),
+# instead of reading it in memory with cdms2. Use this for very big
+# variables: the data is not copied, but the longitudes are used in the
+# order of the file, without the redundant longitude of the 'oo' option
+use_mmap = False
+#use_mmap = True
+
+# Plot each output resolution with the data averaged to the size of
+# the pixels of the data area (see lod.py), instead of always plotting
+# the full resolution data. Use this for high resolution data: the
+# small outputs are then much faster to render
+use_lod = False
+#use_lod = True
+
 # Background mode
 # 0 : everything is plotted directly (on the screen)
 # 1 : plot are made off-screen and only plotted on the screen (if need
@@ -98,29 +136,6 @@ bg_type = 0 # bg mode 'on'
 # Zone that we want to plot
 (latmin, latmax, lonmin, lonmax) = (-90, 90, -180, 180)
 
-# Read one time step (the first one) from the data file
-# and explicitely specify the lat/lon range we need. cdms2
-# will retrieve the data in the order we want, regardless of the way
-# it is stored in the data file
-#
-# WARNING!
-# Should write something about the 'oo' option below... Using a
-# redundant longitude point seems to make it possible to have nice
-# clean edges when you use non linear projections.
-# If you need to work with the variable (not just plot it), YOU SHOULD
-# USE longitude=(-180, 180, 'co')
-f = cdms2.open(path.join(data_dir, data_file))
-v = f(var_name, time=slice(0, 1), latitude=(latmin, latmax),
-      longitude=(lonmin, lonmax, 'oo'), squeeze=1)
-f.close()
-
-# Mask some of the data (by using the 'masked' constant) to see how
-# masked values are plotted with the boxfill graphics method
-for i in range(min(v.shape)):
-    # We mask 2 diagonals in the data matrix
-    v[i, i] = ma.masked
-    v[-1 -i, i] = ma.masked
-
 # Locations of the markers in lat/lon
 # Note: the test markers will be plotted on a regular grid and we only
 # want 0 <= lat <= 90 and 0 <= lon < 180
@@ -131,179 +146,295 @@ marker_list = ['dot', 'diamond', 'diamond_fill', 'square', 'square_fill',
                'triangle_up_fill', 'triangle_down', 'star', 'cross']
 nb_markers = len(marker_list)
 
-# Explicitely select the orientation and colormap
-# Note: choosing the 'landscape' mode and 'rainbow' colormap is what
-# we would be by defauly anyway
-x.landscape()
-x.setcolormap('rainbow')
-
-# Create a specific template to place everything correctly on the
-# canvas (ie in the figure), rather that use the default
-# We use 'normalized coordinates'
-#   lower left corner of the canvas  = (0, 0)
-#   upper right corner of the canvas = (1, 1)
-tpl = x.createtemplate('custom_tpl', 'ASD')
-# * The meridians and parallels are plotted by having the ticmarks
-#   (tpl.xtic1 and tpl.ytic1) extend across the whole data plotting
-#   area (tpl.data). This makes non 'linear' projections look nicer
-#   => The actual location of the meridians/parallels will be
-#      specified with the value of the {x|y}ticlabels1 attribute of
-#      the graphics method
-tpl.xtic1.y1 = tpl.data.y1
-tpl.xtic1.y2 = tpl.data.y2
-tpl.ytic1.x1 = tpl.data.x1
-tpl.ytic1.x2 = tpl.data.x2
-# * The longitude and latitude values will be plotted at the
-#   'center' of the data area
-tpl.ylabel1.x = (tpl.data.x1 + tpl.data.x2)/2 - 0.01
-tpl.xlabel1.y = (tpl.data.y1 + tpl.data.y2)/2 - 0.02
-# Disable the plotting of some stuff on the canvas
-# by setting their priority to 0
-tpl.box1.priority = 0 # No square box around the data area
-tpl.max.priority = 0
-tpl.min.priority = 0
-tpl.mean.priority = 0
-tpl.title.priority = 0
-tpl.xtic2.priority = 0
-tpl.ytic2.priority = 0
-tpl.xlabel2.priority = 0
-tpl.ylabel2.priority = 0
-
-# Create the projection method
-pm = x.createprojection('proj_test')
-pm.type = proj_type
-
-# Create a boxfill graphics method for plotting the data
-bf = x.createboxfill('bf_test')
-# Select the location (in world coordinates) and the annotations
-# of the tick marks
-bf.xticlabels1 = {-180:'', -160:'-160', -140:'-140', -120:'-120', -100:'-100',
-                  -80:'-80', -60:'-60', -40:'-40', -20:'-20', 0:'',
-                  20:'20E', 40:'40E', 60:'60E', 80:'80E',
-                  100:'100E', 120:'120E', 140:'140E', 160:'160E', 180:''}
-bf.yticlabels1 = {-90:'', -80:'-80', -60:'-60', -40:'-40', -20:'-20', 0:'',
-                  20:'20N', 40:'40N', 60:'60N', 80:'80N', 90:''}
-bf.datawc(latmin, latmax, lonmin, lonmax)
-# Use 'light blue' instead of the default 'black' for plotting missing values
-bf.missing = 255
-
-# Plot the variable!
-x.plot(tpl, pm, bf, v, bg=bg_type)
-
-# Create the markers to overlay on the data plot
-lat_list = []
-lon_list = []
-size_list = []
-col_list = []
-type_list = []
-for lat_value in marker_lats:
-    for lon_index, lon_value in enumerate(marker_lons):
-        # Upper right side of the plot (NH, east of lon=0)
-        # Same symbols, increasing size
-        lat_list.append([lat_value])
-        lon_list.append([lon_value])
-        m_size = int(3 + lat_value / 12.)
-        size_list.append(m_size)
-        #col_list.append(241) # black
-        col_list.append(247) # pink
-        type_list.append('dot')
-        
-        # Lower right side of the plot (SH, east of lon=0)
-        # Different symbols, same size
-        if lat_value > 0:
-            lat_list.append([-lat_value])
-            lon_list.append([lon_value])
-            size_list.append(10)
-            col_list.append(246) # cyan (or magenta?)
-            m_type = marker_list[lon_index % nb_markers]
-            type_list.append(m_type)
-
-        # SAME as above WEST of lon=0, except that we plot a
-        # background below the markers
-        
-        # Upper left
-        if lon_value > 0:
-            lat_list.extend(([lat_value], [lat_value]))
-            lon_list.extend(([-lon_value], [-lon_value]))
-            size_list.extend((m_size + 2, m_size))
-            col_list.extend((240, 247)) # pink/247 on white/240
-            type_list.extend(('dot', 'dot'))
-        
-            # Lower right
-            if lat_value > 0:
-                lat_list.extend(([-lat_value], [-lat_value]))
-                lon_list.extend(([-lon_value], [-lon_value]))
-                size_list.extend((m_size + 2, m_size))
-                col_list.extend((241, 246)) # cyan/246 on black/241
-                type_list.extend((m_type, m_type))
-        
-marker_test = x.createmarker('marker_test')
-# IMPORTANT! The markers have to be plotted with the
-# * SAME projection as the graphics method they are overlaid on
-# * SAME coordinates as the graphics method ("worldcoordinate")
-# * SAME position as the data in the window ("viewport")
-marker_test.projection = pm
-marker_test.worldcoordinate = [lonmin, lonmax, latmin, latmax]
-marker_test.viewport = [tpl.data.x1, tpl.data.x2,
-                        tpl.data.y1, tpl.data.y2]
-marker_test.x = lon_list
-marker_test.y = lat_list
-marker_test.size = size_list
-marker_test.color = col_list
-marker_test.type = type_list
-
-# Plot the markers
-x.marker(marker_test, bg=bg_type)
-
-# Create a graphics method for just plotting the continents
-# and plot the markers over it, in a new canvas
-cont_test = x.createcontinents('cont')
-cont_test.projection = pm
-cont_test.xticlabels1 = bf.xticlabels1
-cont_test.yticlabels1 = bf.yticlabels1
-cont_test.datawc(latmin, latmax, lonmin, lonmax)
-cont_test.type = 5 # continents with political borders
-cont_test.linecolor = 242 # Red
-y = vcs.init()
-y.plot(tpl, cont_test, bg=bg_type)
-y.marker(marker_test, bg=bg_type)
-
-# Save the plot in a subdirectory
-script_name = path.splitext(path.basename(sys.argv[0]))[0]
-out_dir = script_name+ '_out'
-if not path.exists(out_dir):
-    # Create the new output directory
-    os.mkdir(out_dir)
-
-# We will be using proj_type in file names. Make sure it does
-# not have any spaces in it
-proj_type = proj_type.replace(' ', '-')
-
-# We could just use a simple and default png and/or pdf plot
-#   plotname = '%s_%s' % (script_name, proj_type)
-#   plotname = path.join(out_dir, plotname)
-#   x.png(plotname)
-#   x.pdf(plotname)
-# Instead, for testing purpose, we will loop on some functions
-# that can be used for creating graphic files from the canvas
-# and loop on different resolutions
-for create_output in output_types: # Loop on functions :-)
+@timed()
+def read_data(data_path=path.join(data_dir, data_file)):
+    # Read one time step (the first one) from the data file
+    # and explicitely specify the lat/lon range we need. cdms2
+    # will retrieve the data in the order we want, regardless of the way
+    # it is stored in the data file
+    #
+    # WARNING!
+    # Should write something about the 'oo' option below... Using a
+    # redundant longitude point seems to make it possible to have nice
+    # clean edges when you use non linear projections.
+    # If you need to work with the variable (not just plot it), YOU SHOULD
+    # USE longitude=(-180, 180, 'co')
+    v = None
+    if use_mmap:
+        try:
+            v = read_mapped(data_path, var_name, time=0)
+        except MappingError as err:
+            print('Can not memory-map %s (%s), reading it normally' % (data_path, err))
+    if v is None:
+        with span('cdms2.open'):
+            f = cdms2.open(data_path)
+        with span('subset'):
+            v = f(var_name, time=slice(0, 1), latitude=(latmin, latmax),
+                  longitude=(lonmin, lonmax, 'oo'), squeeze=1)
+        f.close()
+
+    # Mask some of the data to see how masked values are plotted with
+    # the boxfill graphics method
+    # We mask 2 diagonals in the data matrix. The mask is built with
+    # index arrays and added to the mask of the variable in one
+    # operation (see masking.py), which is much faster than doing
+    #   for i in range(min(v.shape)):
+    #       v[i, i] = ma.masked
+    #       v[-1 -i, i] = ma.masked
+    apply_mask(v, diagonal_mask(v.shape))
+
+    return v
+
+@timed()
+def create_template(x, name='custom_tpl'):
+    # Create a specific template to place everything correctly on the
+    # canvas (ie in the figure), rather that use the default
+    # We use 'normalized coordinates'
+    #   lower left corner of the canvas  = (0, 0)
+    #   upper right corner of the canvas = (1, 1)
+    tpl, created = registry(x).get_or_create('template', name, 'ASD')
+    if not created:
+        return tpl
+    # * The meridians and parallels are plotted by having the ticmarks
+    #   (tpl.xtic1 and tpl.ytic1) extend across the whole data plotting
+    #   area (tpl.data). This makes non 'linear' projections look nicer
+    #   => The actual location of the meridians/parallels will be
+    #      specified with the value of the {x|y}ticlabels1 attribute of
+    #      the graphics method
+    tpl.xtic1.y1 = tpl.data.y1
+    tpl.xtic1.y2 = tpl.data.y2
+    tpl.ytic1.x1 = tpl.data.x1
+    tpl.ytic1.x2 = tpl.data.x2
+    # * The longitude and latitude values will be plotted at the
+    #   'center' of the data area
+    tpl.ylabel1.x = (tpl.data.x1 + tpl.data.x2)/2 - 0.01
+    tpl.xlabel1.y = (tpl.data.y1 + tpl.data.y2)/2 - 0.02
+    # Disable the plotting of some stuff on the canvas
+    # by setting their priority to 0
+    tpl.box1.priority = 0 # No square box around the data area
+    tpl.max.priority = 0
+    tpl.min.priority = 0
+    tpl.mean.priority = 0
+    tpl.title.priority = 0
+    tpl.xtic2.priority = 0
+    tpl.ytic2.priority = 0
+    tpl.xlabel2.priority = 0
+    tpl.ylabel2.priority = 0
+    return tpl
+
+def create_projection(x, proj_type, name='proj_test'):
+    # Create the projection method (or reuse it, and only change
+    # its type, if it already exists)
+    pm, created = registry(x).get_or_create('projection', name)
+    pm.type = proj_type
+    return pm
+
+@timed()
+def create_boxfill(x, name='bf_test'):
+    # Create a boxfill graphics method for plotting the data
+    bf, created = registry(x).get_or_create('boxfill', name)
+    if not created:
+        return bf
+    # Select the location (in world coordinates) and the annotations
+    # of the tick marks
+    bf.xticlabels1 = {-180:'', -160:'-160', -140:'-140', -120:'-120', -100:'-100',
+                      -80:'-80', -60:'-60', -40:'-40', -20:'-20', 0:'',
+                      20:'20E', 40:'40E', 60:'60E', 80:'80E',
+                      100:'100E', 120:'120E', 140:'140E', 160:'160E', 180:''}
+    bf.yticlabels1 = {-90:'', -80:'-80', -60:'-60', -40:'-40', -20:'-20', 0:'',
+                      20:'20N', 40:'40N', 60:'60N', 80:'80N', 90:''}
+    bf.datawc(latmin, latmax, lonmin, lonmax)
+    # Use 'light blue' instead of the default 'black' for plotting missing values
+    bf.missing = 255
+    return bf
+
+@timed()
+def create_markers(x, pm, tpl, name='marker_test'):
+    # Create the markers to overlay on the data plot
+    #
+    # The positions are computed with numpy arrays, and marker_layout
+    # computes the size, color and type of the markers from the 'rules'
+    # below, and groups the markers with the same attributes (see
+    # marker_layout.py)
+    lat_grid, lon_grid = np.meshgrid(marker_lats, marker_lons, indexing='ij')
+    east_sh = lat_grid > 0
+    west_nh = lon_grid > 0
+    west_sh = east_sh & west_nh
+    # * Upper right side of the plot (NH, east of lon=0)
+    # * Lower right side of the plot (SH, east of lon=0)
+    # * SAME as above WEST of lon=0 (upper left and lower left)
+    lats = np.concatenate((lat_grid.ravel(), -lat_grid[east_sh],
+                           lat_grid[west_nh], -lat_grid[west_sh]))
+    lons = np.concatenate((lon_grid.ravel(), lon_grid[east_sh],
+                           -lon_grid[west_nh], -lon_grid[west_sh]))
+
+    def m_type(lats, lons, values):
+        # NH: same symbols. SH: different symbols, depending on the
+        # longitude
+        lon_index = np.searchsorted(marker_lons, np.abs(lons))
+        sh_types = np.array(marker_list)[lon_index % nb_markers]
+        return np.where(lats >= 0, 'dot', sh_types)
+
+    def m_size(lats, lons, values):
+        # Increasing size with latitude, except in the lower right side
+        # of the plot where all the markers have the same size
+        size = (3 + np.abs(lats) / 12.).astype(int)
+        return np.where((lats < 0) & (lons >= 0), 10, size)
+
+    layout = marker_layout(lats, lons, type=m_type, size=m_size,
+                           # pink/247 in the NH, cyan/246 (or magenta?) in the SH
+                           color=lambda lats, lons, values: np.where(lats >= 0, 247, 246),
+                           # West of lon=0, we plot a background below
+                           # the markers: white/240 in the NH, black/241
+                           # in the SH
+                           halo=lons < 0, halo_size=2,
+                           halo_color=lambda lats, lons, values: np.where(lats >= 0, 240, 241))
+
+    marker_test, created = registry(x).get_or_create('marker', name)
+    # IMPORTANT! The markers have to be plotted with the
+    # * SAME projection as the graphics method they are overlaid on
+    # * SAME coordinates as the graphics method ("worldcoordinate")
+    # * SAME position as the data in the window ("viewport")
+    marker_test.projection = pm
+    marker_test.worldcoordinate = [lonmin, lonmax, latmin, latmax]
+    marker_test.viewport = [tpl.data.x1, tpl.data.x2,
+                            tpl.data.y1, tpl.data.y2]
+    apply_layout(marker_test, layout)
+    return marker_test
+
+@timed()
+def plot_figure(x, v, proj_type, bg=bg_type):
+    # Plot the data and the markers for the requested projection
+    # on the x canvas, and return the vcs objects that were used
+    # Explicitely select the orientation and colormap
+    # Note: choosing the 'landscape' mode and 'rainbow' colormap is what
+    # we would be by defauly anyway
+    x.landscape()
+    x.setcolormap('rainbow')
+    tpl = create_template(x)
+    pm = create_projection(x, proj_type)
+    bf = create_boxfill(x)
+
+    # Plot the variable!
+    with span('x.plot'):
+        x.plot(tpl, pm, bf, v, bg=bg)
+
+    # Plot the markers
+    marker_test = create_markers(x, pm, tpl)
+    with span('x.marker'):
+        x.marker(marker_test, bg=bg)
+
+    return tpl, pm, bf, marker_test
+
+@timed()
+def export_figure(x, plotname, output_types=output_types, output_res=output_res,
+                  exporter=None):
+    # Save the figure of the x canvas in all the requested formats and
+    # resolutions, and return the list of the created files
+    #
+    # If exporter is an AsyncExporter, the files are only complete
+    # after exporter.join()
+    #
+    # We could just use a simple and default png and/or pdf plot
+    #   x.png(plotname)
+    #   x.pdf(plotname)
+    # Instead, for testing purpose, we will loop on some functions
+    # that can be used for creating graphic files from the canvas
+    # and loop on different resolutions
+    created = []
+    for out_type in output_types:
+        create_output = getattr(x, out_type) # x.png, x.pdf, ...
+        for resolution in output_res:
+            res_name = '%s_%s' % (plotname, resolution)
+            # Note: 11"x8" is the size of the US Letter paper format
+            with span('x.' + out_type):
+                if exporter is not None:
+                    exporter.export(res_name, out_type,
+                                    resolution*11, resolution*8)
+                else:
+                    create_output(res_name,
+                                  width=resolution*11,
+                                  height=resolution*8)
+            created.append('%s.%s' % (res_name, out_type))
+    return created
+
+@timed()
+def export_lod(x, pyramid, proj_type, plotname, output_types=output_types,
+               output_res=output_res, exporter=None):
+    # Same as export_figure, but each resolution is plotted with the
+    # level of the pyramid (a lod.Pyramid of the variable) that matches
+    # the size of the output in pixels. The figure is only plotted
+    # again when the level changes from one resolution to the next
+    tpl = create_template(x)
+    plotted = None
+    created = []
     for resolution in output_res:
-        plotname = '%s_%s_%s' % (script_name,
-                                    proj_type, resolution)
-        plotname = path.join(out_dir, plotname)
-        # Note: 11"x8" is the size of the US Letter paper format
-        create_output(plotname,
-                      width=resolution*11,
-                      height=resolution*8)
-
-# Display the plots, if they were generated off-screen
-if bg_type == 1:
-    x.showbg()
-    y.showbg()
-
-print 'The %s script has finished running and now\nyou can play with python in interactive mode!' % (script_name,)
-raw_input('Press return to finish')
+        v_lod = pyramid.level_for(tpl, resolution*11, resolution*8)
+        if v_lod is not plotted:
+            x.clear()
+            plot_figure(x, v_lod, proj_type)
+            plotted = v_lod
+        created.extend(export_figure(x, plotname, output_types, [resolution],
+                                     exporter=exporter))
+    return created
+
+# Run the example when the module is executed as a script
+if __name__ == '__main__':
+
+    v = read_data()
+
+    # Initialize the graphics canvas
+    x = vcs.init()
+
+    tpl, pm, bf, marker_test = plot_figure(x, v, proj_type)
+
+    # Create a graphics method for just plotting the continents
+    # and plot the markers over it, in a new canvas
+    cont_test = x.createcontinents('cont')
+    cont_test.projection = pm
+    cont_test.xticlabels1 = bf.xticlabels1
+    cont_test.yticlabels1 = bf.yticlabels1
+    cont_test.datawc(latmin, latmax, lonmin, lonmax)
+    cont_test.type = 5 # continents with political borders
+    cont_test.linecolor = 242 # Red
+    y = vcs.init()
+    y.plot(tpl, cont_test, bg=bg_type)
+    y.marker(marker_test, bg=bg_type)
+
+    # Save the plot in a subdirectory
+    script_name = path.splitext(path.basename(sys.argv[0]))[0]
+    out_dir = script_name+ '_out'
+    if not path.exists(out_dir):
+        # Create the new output directory
+        os.mkdir(out_dir)
+
+    # We will be using proj_type in file names. Make sure it does
+    # not have any spaces in it
+    plotname = '%s_%s' % (script_name, proj_type.replace(' ', '-'))
+    exporter = AsyncExporter(x) if async_export else None
+    if use_lod:
+        export_lod(x, Pyramid(v), proj_type, path.join(out_dir, plotname),
+                   exporter=exporter)
+    else:
+        export_figure(x, path.join(out_dir, plotname), exporter=exporter)
+    if exporter is not None:
+        # Wait for the last files (raises an ExportError listing the
+        # files that could not be saved)
+        with span('join'):
+            exporter.join()
+
+    # Display the plots, if they were generated off-screen
+    if bg_type == 1:
+        x.showbg()
+        y.showbg()
+
+    # Print the time spent in each stage, if the spans are enabled
+    # (e.g. with VCS_SPANS=bf_marker.folded python bf_marker_proj_easy.py)
+    if spans.is_enabled():
+        spans.report()
+
+    print('The %s script has finished running and now\nyou can play with python in interactive mode!' % (script_name,))
+    raw_input('Press return to finish')
 
 # More things that new users  can try in interactive mode once the
 # script has finished running
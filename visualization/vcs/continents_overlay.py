@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# Module for adding black on white continents (see test_fillarea.py) to
+# many png plots, without drawing the continents again for each plot
+#
+# Drawing the continents with a wide white line and then a thin black
+# line reprojects and strokes the same coastlines twice, on each plot.
+# When many plots share the same layout (projection, world coordinates,
+# data area of the template, line styles and image size), the
+# continents look exactly the same on all of them.
+#
+# ContinentsOverlay draws the continents of a layout only once, on a
+# transparent png image (the overlay), and keeps this image in a cache
+# directory. The overlay is then pasted over the png plots of the data,
+# which only takes a few milliseconds.
+#
+# * the overlay is drawn on a separate off-screen canvas, with a
+#   template based on ASD_dud, whose data area is the data area of the
+#   template used for the data
+# * the overlays are kept in memory (by layout) and in the cache
+#   directory (as png files), so that they can be reused by the next
+#   executions of a script
+# * pasting the overlay requires the PIL (or Pillow) module. Without
+#   it, save_png draws the continents over the plot as usual
+#
+# Example:
+#   overlay = ContinentsOverlay()
+#   for v in variables:
+#       x.clear()
+#       x.plot(tpl, isof, v, continents=0, bg=1)
+#       overlay.save_png(x, 'plot_%s' % (v.id,), tpl, isof)
+
+import os
+import hashlib
+from os import path
+
+import vcs
+
+from vcs_registry import registry
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Black on white continents: (line color, line width), in the order
+# they are plotted
+bw_styles = ((240, 6), (241, 2))
+
+class ContinentsOverlay:
+
+    def __init__(self, cache_dir='continents_cache', styles=bw_styles, cont_type=1):
+        self.cache_dir = cache_dir
+        self.styles = tuple([tuple(style) for style in styles])
+        self.cont_type = cont_type
+        self.overlays = {} # layout key -> overlay file
+        self.canvas = None # canvas for drawing the overlays
+        if not path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, tpl, gm, width, height):
+        # Everything that changes the look of the continents
+        proj = gm.projection
+        if not isinstance(proj, str):
+            proj = proj.name
+        pm = vcs.getprojection(proj)
+        layout = (pm.type, list(pm.parameters),
+                  [gm.datawc_x1, gm.datawc_x2, gm.datawc_y1, gm.datawc_y2],
+                  [tpl.data.x1, tpl.data.x2, tpl.data.y1, tpl.data.y2],
+                  self.styles, self.cont_type, width, height)
+        return hashlib.sha1(repr(layout).encode('utf-8')).hexdigest()
+
+    def plot_continents(self, x, tpl, gm, bg=1):
+        # Plot the continents on the x canvas, at the place of the data
+        # area of tpl, with the projection and coordinates of gm
+        reg = registry(x)
+        tpl_cont, created = reg.get_or_create('template', 'tpl_cont_overlay', 'ASD_dud')
+        tpl_cont.data.x1 = tpl.data.x1
+        tpl_cont.data.x2 = tpl.data.x2
+        tpl_cont.data.y1 = tpl.data.y1
+        tpl_cont.data.y2 = tpl.data.y2
+        for i, (color, width) in enumerate(self.styles):
+            cont, created = reg.get_or_create('continents', 'cont_overlay_%i' % (i,))
+            cont.projection = gm.projection
+            cont.datawc(gm.datawc_y1, gm.datawc_y2, gm.datawc_x1, gm.datawc_x2)
+            cont.type = self.cont_type
+            cont.linecolor = color
+            cont.linewidth = width
+            x.plot(tpl_cont, cont, bg=bg)
+
+    def overlay(self, tpl, gm, width=11, height=8):
+        # Return the overlay file for this layout, drawing it the first
+        # time it is needed
+        key = self.key(tpl, gm, width, height)
+        if key in self.overlays:
+            return self.overlays[key]
+        overlay_file = path.join(self.cache_dir, key + '.png')
+        if not path.exists(overlay_file):
+            if self.canvas is None:
+                self.canvas = vcs.init()
+                self.canvas.landscape()
+            y = self.canvas
+            y.clear()
+            self.plot_continents(y, tpl, gm)
+            tmp_file = path.join(self.cache_dir, key + '_tmp.png')
+            y.png(tmp_file, width=width, height=height, draw_white_background=False)
+            os.rename(tmp_file, overlay_file)
+        self.overlays[key] = overlay_file
+        return overlay_file
+
+    def save_png(self, x, plotname, tpl, gm, width=11, height=8):
+        # Save the plot of the x canvas in plotname.png, with the
+        # continents overlay of the (tpl, gm) layout pasted over it
+        png_file = plotname + '.png'
+        if Image is None:
+            # No PIL: draw the continents directly
+            self.plot_continents(x, tpl, gm)
+            x.png(plotname, width=width, height=height)
+            return png_file
+        overlay_file = self.overlay(tpl, gm, width, height)
+        x.png(plotname, width=width, height=height)
+        plot = Image.open(png_file).convert('RGBA')
+        cont = Image.open(overlay_file).convert('RGBA')
+        if cont.size != plot.size:
+            cont = cont.resize(plot.size)
+        Image.alpha_composite(plot, cont).convert('RGB').save(png_file)
+        return png_file
+
+    def clear(self):
+        # Remove the overlays from the memory and the cache directory
+        self.overlays.clear()
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.png'):
+                os.remove(path.join(self.cache_dir, name))
+
+# The end
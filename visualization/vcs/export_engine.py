@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+# Module for exporting the figure of bf_marker_proj_easy.py for many
+# projections, file formats and resolutions, using all the available
+# processors
+#
+# Each (projection, format, resolution) output is a job. The jobs are
+# distributed to a pool of worker processes, each worker having its
+# own off-screen vcs canvas and its own copy of the data. The jobs are
+# sorted by projection, so that a worker only has to plot the figure
+# again when the projection changes, and can export the other formats
+# and resolutions from the same plot.
+#
+# The result is a 'manifest': a list with one dictionary per created
+# file (file name, projection, format, resolution, plot and export
+# times, worker process id), also saved as a JSON file in the output
+# directory. A job that fails (e.g. a projection that needs parameters
+# that are not set) does not stop the other jobs: its dictionary has an
+# 'error' message instead of a file name, and is listed in the 'errors'
+# of the JSON file.
+#
+# Execute this module as a script to export the figure for all the
+# projections listed in bf_marker_proj_easy.py
+
+import sys, os
+import time
+import json
+from os import path
+from multiprocessing import Pool, cpu_count
+
+import bf_marker_proj_easy as bfm
+
+# Worker state: the canvas, the data and the projection currently
+# plotted on the canvas (set by _init_worker in each worker process)
+_worker = {}
+
+def _init_worker(data_path):
+    import vcs
+    _worker['canvas'] = vcs.init()
+    _worker['data'] = bfm.read_data(data_path)
+    _worker['plotted'] = None
+
+def _run_job(job):
+    proj_type, out_type, resolution, out_dir = job
+    x = _worker['canvas']
+    entry = {'projection':proj_type,
+             'format':out_type,
+             'resolution':resolution,
+             'pid':os.getpid()}
+
+    try:
+        # Only plot again if the projection has changed
+        t_start = time.time()
+        if _worker['plotted'] != proj_type:
+            _worker['plotted'] = None
+            x.clear()
+            bfm.plot_figure(x, _worker['data'], proj_type, bg=1)
+            _worker['plotted'] = proj_type
+        t_plot = time.time()
+
+        plotname = '%s_%s' % ('bf_marker_proj_easy', proj_type.replace(' ', '-'))
+        created = bfm.export_figure(x, path.join(out_dir, plotname),
+                                    output_types=[out_type],
+                                    output_res=[resolution])
+        t_export = time.time()
+    except Exception as err:
+        # Record the error, so that the other jobs are still done and
+        # listed (e.g. a projection that needs parameters that are not set)
+        entry['file'] = None
+        entry['error'] = '%s: %s' % (err.__class__.__name__, err)
+        return entry
+
+    entry.update({'file':created[0],
+                  'plot_time':t_plot - t_start,
+                  'export_time':t_export - t_plot})
+    return entry
+
+def export_all(proj_types=bfm.proj_types,
+               output_types=bfm.output_types,
+               output_res=bfm.output_res,
+               out_dir='bf_marker_proj_easy_out',
+               data_path=path.join(bfm.data_dir, bfm.data_file),
+               nb_workers=None):
+    # Export the figure for all the requested projections, formats and
+    # resolutions, and return the manifest of the created files
+    if not path.exists(out_dir):
+        os.makedirs(out_dir)
+    if nb_workers is None:
+        nb_workers = cpu_count()
+
+    # Jobs sorted by projection (see above)
+    jobs = [(proj_type, out_type, resolution, out_dir)
+            for proj_type in proj_types
+            for out_type in output_types
+            for resolution in output_res]
+    # Give each worker all the jobs of one projection at a time
+    chunk_size = len(output_types) * len(output_res)
+
+    t_start = time.time()
+    pool = Pool(nb_workers, _init_worker, (data_path,))
+    try:
+        manifest = list(pool.imap_unordered(_run_job, jobs, chunk_size))
+    finally:
+        pool.close()
+        pool.join()
+    total_time = time.time() - t_start
+
+    manifest.sort(key=lambda item: (item['projection'], item['format'],
+                                    item['resolution']))
+    f = open(path.join(out_dir, 'manifest.json'), 'w')
+    json.dump({'nb_workers':nb_workers,
+               'total_time':total_time,
+               'files':[item for item in manifest if 'error' not in item],
+               'errors':[item for item in manifest if 'error' in item]}, f, indent=1)
+    f.close()
+    return manifest
+
+# Test the module by running it as a script
+if __name__ == '__main__':
+
+    manifest = export_all()
+    errors = [item for item in manifest if 'error' in item]
+    print('%i files created, %i errors' % (len(manifest) - len(errors), len(errors)))
+    for item in manifest:
+        if 'error' in item:
+            print('%(projection)s %(format)s %(resolution)s: %(error)s' % item)
+        else:
+            print('%(file)s: plot %(plot_time).2fs, export %(export_time).2fs' % item)
+
+# The end
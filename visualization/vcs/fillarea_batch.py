@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+# Module for building vcs fill area objects from NumPy arrays, even
+# for tens of thousands of polygons (e.g. choropleth maps)
+#
+# A vcs fill area object plots a list of polygons, each polygon having
+# its own style ('solid', 'hatch' or 'pattern'), index (hatch or
+# pattern number) and color:
+#   fill.x = [[x1, x2, x3, ...], [x1, ...], ...]
+#   fill.y = [[y1, y2, y3, ...], [y1, ...], ...]
+#   fill.style = ['hatch', ...]
+#   ...
+# Appending the vertices and attributes of each polygon to these lists
+# in a Python loop (as in test_fillarea.py) is slow for many polygons.
+#
+# Here, the polygons are given as 'ragged arrays': the x and y arrays
+# of all the vertices, polygon after polygon, and the offsets array of
+# the index of the first vertex of each polygon (optionally followed by
+# the total number of vertices). fillarea_batches computes the lists
+# of all the polygons with array operations, and splits them into
+# batches of at most batch_size polygons, each batch giving one fill
+# area object. The polygons can also be grouped by (style, index,
+# color), so that each batch has a single style, index and color.
+#
+# Example: 2 triangles and a square
+#   x = np.array([0, 1, 0,  2, 3, 2,  4, 5, 5, 4], dtype=float)
+#   y = np.array([0, 0, 1,  0, 0, 1,  0, 0, 1, 1], dtype=float)
+#   offsets = np.array([0, 3, 6])
+#   batches = fillarea_batches(x, y, offsets, color=[243, 243, 248])
+#   fills = create_fillareas(canvas, 'choro', batches)
+#   for fill in fills:
+#       canvas.plot(fill)
+
+import numpy as np
+
+from vcs_registry import registry
+
+def rectangles(x1, y1, x2, y2, shear_x=0.):
+    # Return the (x, y, offsets) ragged arrays of (sheared) rectangles,
+    # given the arrays of their lower left and upper right corners
+    x1, y1, x2, y2 = np.broadcast_arrays(*[np.asarray(a, dtype=float).ravel()
+                                           for a in (x1, y1, x2, y2)])
+    # Note: no need to close the polygons, 4 vertices are enough
+    x = np.stack((x1, x2, x2 + shear_x, x1 + shear_x), axis=1).ravel()
+    y = np.stack((y1, y1, y2, y2), axis=1).ravel()
+    return x, y, np.arange(0, x.size, 4)
+
+def _polygon_bounds(offsets, nb_points):
+    # Return the (starts, ends) arrays of the vertices of each polygon
+    offsets = np.asarray(offsets, dtype=int).ravel()
+    if offsets.size == 0 or offsets[-1] != nb_points:
+        offsets = np.append(offsets, nb_points)
+    return offsets[:-1], offsets[1:]
+
+def fillarea_batches(x, y, offsets, style='solid', index=1, color=241,
+                     batch_size=5000, group=False):
+    # Split the polygons of the (x, y, offsets) ragged arrays into
+    # batches of at most batch_size polygons
+    #
+    # * style, index and color can be a single value, or an array with
+    #   one value per polygon
+    # * if group is True, the polygons are first sorted by (style,
+    #   index, color), so that each batch only has polygons with the
+    #   same attributes. The order of the polygons is kept within each
+    #   (style, index, color) group
+    #
+    # Return a list of dictionaries with the 'x', 'y', 'style', 'index'
+    # and 'color' lists of a fill area object
+    x = np.asarray(x, dtype=float).ravel()
+    y = np.asarray(y, dtype=float).ravel()
+    starts, ends = _polygon_bounds(offsets, x.size)
+    nb_polygons = starts.size
+    if nb_polygons == 0:
+        return []
+    attrs = [np.broadcast_to(np.asarray(attr), (nb_polygons,))
+             for attr in (style, index, color)]
+
+    # Batch limits: every batch_size polygons, and at each change of
+    # (style, index, color) when grouping
+    limits = set(range(0, nb_polygons, batch_size))
+    if group:
+        keys = []
+        sizes = []
+        for attr in attrs:
+            uniq, inverse = np.unique(attr, return_inverse=True)
+            keys.append(inverse.ravel())
+            sizes.append(len(uniq))
+        key = (keys[0] * sizes[1] + keys[1]) * sizes[2] + keys[2]
+        order = np.argsort(key, kind='mergesort')
+        sorted_key = key[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_key[1:] != sorted_key[:-1]])
+        group_ends = np.r_[group_starts[1:], nb_polygons]
+        limits = set()
+        for g_start, g_end in zip(group_starts.tolist(), group_ends.tolist()):
+            limits.update(range(g_start, g_end, batch_size))
+    else:
+        order = np.arange(nb_polygons)
+    limits = sorted(limits) + [nb_polygons]
+
+    # Gather the vertices in the order of the (sorted) polygons
+    lengths = (ends - starts)[order]
+    new_ends = np.cumsum(lengths)
+    new_starts = new_ends - lengths
+    point_idx = np.arange(new_ends[-1]) + np.repeat(starts[order] - new_starts, lengths)
+    x_list = x[point_idx].tolist()
+    y_list = y[point_idx].tolist()
+    new_starts = new_starts.tolist()
+    new_ends = new_ends.tolist()
+    style_list = [str(s) for s in attrs[0][order].tolist()]
+    index_list = attrs[1][order].astype(int).tolist()
+    color_list = attrs[2][order].astype(int).tolist()
+
+    batches = []
+    for b_start, b_end in zip(limits[:-1], limits[1:]):
+        bounds = zip(new_starts[b_start:b_end], new_ends[b_start:b_end])
+        b_x = []
+        b_y = []
+        for start, end in bounds:
+            b_x.append(x_list[start:end])
+            b_y.append(y_list[start:end])
+        batches.append({'x':b_x, 'y':b_y,
+                        'style':style_list[b_start:b_end],
+                        'index':index_list[b_start:b_end],
+                        'color':color_list[b_start:b_end]})
+    return batches
+
+def apply_batch(fill, batch):
+    # Set the polygons and attributes of a vcs fill area object from a
+    # batch returned by fillarea_batches
+    fill.style = batch['style']
+    fill.index = batch['index']
+    fill.color = batch['color']
+    fill.x = batch['x']
+    fill.y = batch['y']
+    return fill
+
+def create_fillareas(x, name, batches):
+    # Create (or reuse) the fill area objects name_0, name_1, ... of the
+    # x canvas for the batches, and return them
+    reg = registry(x)
+    fills = []
+    for i, batch in enumerate(batches):
+        fill, created = reg.get_or_create('fillarea', '%s_%i' % (name, i))
+        fills.append(apply_batch(fill, batch))
+    return fills
+
+# The end
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+# Module for reducing the resolution of a field to the resolution of
+# the image it is plotted in ('level of detail')
+#
+# A 0.1 degree global field has 3600 longitudes. In a 11"x8" png plot
+# at 72 dpi, the data area of the template is less than 800 pixels
+# wide: more than 4 grid cells per pixel, that vcs has to draw anyway.
+#
+# A Pyramid stores the field at decreasing resolutions, each level
+# averaging 2x2 blocks of the previous one. The means are 'mask-aware':
+# each level keeps the sum and the number of the valid (not masked)
+# values of each block, so that
+# * the masked values are ignored in the means, and a block is only
+#   masked if all its values are masked
+# * each level is an exact mean of the original values (and not a mean
+#   of means), even when the blocks have different numbers of valid
+#   values
+# The levels are computed the first time they are needed, and then
+# kept in the Pyramid (a level is 4 times smaller than the previous
+# one, so all the levels together are only 1/3 of the original size).
+#
+# level_for() chooses the coarsest level that still has at least one
+# grid cell per pixel of the data area, for a given template and image
+# size, so the full resolution is only plotted when it can be seen.
+#
+# The last 2 dimensions of the variable have to be latitude and
+# longitude. The new axes are the means of the original axes, with the
+# bounds of the blocks.
+#
+# Example:
+#   pyramid = Pyramid(v)
+#   for resolution in (0.5, 1, 2, 4):
+#       x.clear()
+#       x.plot(tpl, bf, pyramid.level_for(tpl, resolution*11, resolution*8), bg=1)
+#       x.png('plot_%s' % (resolution,), width=resolution*11, height=resolution*8)
+
+import math
+
+import numpy as np
+from numpy import ma
+import cdms2
+
+def _block_sum(a):
+    # Sum of the 2x2 blocks along the 2 last axes (the last block of an
+    # axis with an odd size has only 1 row or column)
+    pad = [(0, 0)] * (a.ndim - 2) + [(0, s % 2) for s in a.shape[-2:]]
+    if any([p[1] for p in pad]):
+        a = np.pad(a, pad, mode='constant')
+    shape = a.shape[:-2] + (a.shape[-2] // 2, 2, a.shape[-1] // 2, 2)
+    return a.reshape(shape).sum(axis=(-3, -1))
+
+def _axis_sum(a):
+    # Same as _block_sum, for a 1-D array
+    if a.shape[0] % 2:
+        a = np.concatenate((a, np.zeros((1,) + a.shape[1:], dtype=a.dtype)))
+    return a.reshape((a.shape[0] // 2, 2) + a.shape[1:]).sum(axis=1)
+
+class Pyramid:
+
+    def __init__(self, v, max_levels=10):
+        self.v = v
+        self.max_levels = max_levels
+        data = ma.getdata(v).astype(float)
+        valid = ~ma.getmaskarray(v)
+        # (sum, count) of the valid values of each level
+        self.sums = [np.where(valid, data, 0.)]
+        self.counts = [valid.astype(np.int32)]
+        lat = v.getAxis(v.ndim - 2)
+        lon = v.getAxis(v.ndim - 1)
+        # (coordinate sums, number of coordinates, bounds) of the axes
+        self.lat_levels = [(np.asarray(lat[:], dtype=float), np.ones(len(lat)),
+                            np.asarray(lat.getBounds(), dtype=float))]
+        self.lon_levels = [(np.asarray(lon[:], dtype=float), np.ones(len(lon)),
+                            np.asarray(lon.getBounds(), dtype=float))]
+        self.variables = {0:v}
+
+    def nb_levels(self):
+        # Number of levels that can be built (a level has at least 2
+        # points along each axis)
+        ny, nx = self.v.shape[-2:]
+        return max(0, min(self.max_levels, int(math.log(max(min(ny, nx), 1), 2)) - 1))
+
+    def _build(self, k):
+        # Compute the sums and counts of the levels up to k
+        while len(self.sums) <= k:
+            self.sums.append(_block_sum(self.sums[-1]))
+            self.counts.append(_block_sum(self.counts[-1]))
+            for levels in (self.lat_levels, self.lon_levels):
+                coord_sum, coord_count, bounds = levels[-1]
+                if bounds.shape[0] % 2:
+                    bounds = np.concatenate((bounds, bounds[-1:]))
+                new_bounds = np.stack((bounds[0::2, 0], bounds[1::2, 1]), axis=1)
+                levels.append((_axis_sum(coord_sum), _axis_sum(coord_count), new_bounds))
+
+    def _axis(self, levels, k, axis):
+        coord_sum, coord_count, bounds = levels[k]
+        new_axis = cdms2.createAxis(coord_sum / coord_count, bounds=bounds, id=axis.id)
+        for name, value in axis.attributes.items():
+            setattr(new_axis, name, value)
+        return new_axis
+
+    def level(self, k):
+        # Return the variable at level k (level 0 is the original
+        # variable, level k has 2**k times fewer points along each axis)
+        k = max(0, min(k, self.nb_levels()))
+        if k not in self.variables:
+            self._build(k)
+            v = self.v
+            count = self.counts[k]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean = self.sums[k] / count
+            data = ma.masked_array(mean, mask=(count == 0))
+            axes = v.getAxisList()[:-2]
+            axes.append(self._axis(self.lat_levels, k, v.getAxis(v.ndim - 2)))
+            axes.append(self._axis(self.lon_levels, k, v.getAxis(v.ndim - 1)))
+            self.variables[k] = cdms2.createVariable(data.astype(v.dtype), axes=axes,
+                                                     id=v.id, attributes=v.attributes)
+        return self.variables[k]
+
+    def level_for(self, tpl, width, height, dpi=72):
+        # Return the coarsest level with at least one grid cell per pixel
+        # of the data area of the tpl template, for an image of width x
+        # height inches (as in x.png(name, width=..., height=...))
+        data_width = abs(tpl.data.x2 - tpl.data.x1) * width * dpi
+        data_height = abs(tpl.data.y2 - tpl.data.y1) * height * dpi
+        ny, nx = self.v.shape[-2:]
+        cells_per_pixel = min(nx / max(data_width, 1.), ny / max(data_height, 1.))
+        if cells_per_pixel < 2:
+            return self.level(0)
+        return self.level(int(math.floor(math.log(cells_per_pixel, 2))))
+
+# The end
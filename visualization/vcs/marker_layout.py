@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# Module for building the lists of a vcs marker object from NumPy
+# arrays of marker positions, even for tens of thousands of markers
+#
+# A vcs marker object can plot several groups of markers, each group
+# having its own size, color and type:
+#   marker.x = [[lon1, lon2, ...], [lon3, ...], ...]
+#   marker.y = [[lat1, lat2, ...], [lat3, ...], ...]
+#   marker.size = [size_group1, size_group2, ...]
+#   ...
+# Building these lists with one group per marker in a Python loop is
+# slow, and so is plotting them. marker_layout computes the size, color
+# and type of all the markers with array operations, and then puts all
+# the markers with the same (type, size, color) in the same group, so
+# that vcs only has a few groups to plot.
+#
+# Markers can also be plotted over a bigger background marker (a
+# 'halo'), to make them easier to see (see bf_marker_proj_easy.py)
+#
+# Example:
+#   layout = marker_layout(lats, lons, values,
+#                          size=lambda lat, lon, val: 3 + val/10,
+#                          color=247, halo=lons < 0)
+#   apply_layout(x.createmarker('stations'), layout)
+
+import numpy as np
+
+def _attribute(rule, lats, lons, values):
+    # Return an array with one value per marker for a rule that can be
+    # a scalar, an array or a function of (lats, lons, values)
+    if callable(rule):
+        rule = rule(lats, lons, values)
+    return np.broadcast_to(np.asarray(rule), lats.shape)
+
+def _groups(lats, lons, sizes, colors, types):
+    # Group the markers by (type, size, color). Return a list of
+    # (type, size, color, lons, lats) tuples
+    if lats.size == 0:
+        return []
+    keys = []
+    uniques = []
+    for attr in (types, sizes, colors):
+        uniq, inverse = np.unique(attr, return_inverse=True)
+        uniques.append(uniq)
+        keys.append(inverse.ravel())
+    key = (keys[0] * len(uniques[1]) + keys[1]) * len(uniques[2]) + keys[2]
+    group_keys, group_idx, counts = np.unique(key, return_index=True,
+                                              return_counts=True)
+    # Sort the markers by group (keeping the original order within each
+    # group), and split the sorted positions
+    order = np.argsort(key, kind='mergesort')
+    bounds = np.cumsum(counts)[:-1]
+    group_lons = np.split(lons.ravel()[order], bounds)
+    group_lats = np.split(lats.ravel()[order], bounds)
+    groups = []
+    for i, first in enumerate(group_idx):
+        groups.append((uniques[0][keys[0][first]],
+                       uniques[1][keys[1][first]],
+                       uniques[2][keys[2][first]],
+                       group_lons[i], group_lats[i]))
+    return groups
+
+def marker_layout(lats, lons, values=None, size=5, color=241, type='dot',
+                  halo=None, halo_size=2, halo_color=240):
+    # Compute the marker groups for markers located at (lats, lons)
+    #
+    # * size, color and type can be a single value, an array with one
+    #   value per marker, or a function returning such an array when
+    #   called with (lats, lons, values)
+    # * halo is None (no background markers), or a boolean array (or a
+    #   function returning one) selecting the markers that are plotted
+    #   over a background marker of the same type, with a size
+    #   increased by halo_size and the halo_color color (halo_size and
+    #   halo_color follow the same rules as size and color)
+    #
+    # Return a dictionary with the 'x', 'y', 'size', 'color' and 'type'
+    # lists of the marker object. The background markers are in the
+    # first groups, so that they are plotted first
+    lats = np.asarray(lats, dtype=float).ravel()
+    lons = np.asarray(lons, dtype=float).ravel()
+    if values is not None:
+        values = np.asarray(values).ravel()
+    sizes = _attribute(size, lats, lons, values)
+    colors = _attribute(color, lats, lons, values)
+    types = _attribute(type, lats, lons, values)
+
+    groups = []
+    if halo is not None:
+        halo = _attribute(halo, lats, lons, values).astype(bool)
+        halo_sizes = sizes + _attribute(halo_size, lats, lons, values)
+        halo_colors = _attribute(halo_color, lats, lons, values)
+        groups.extend(_groups(lats[halo], lons[halo], halo_sizes[halo],
+                              halo_colors[halo], types[halo]))
+    groups.extend(_groups(lats, lons, sizes, colors, types))
+
+    layout = {'x':[], 'y':[], 'size':[], 'color':[], 'type':[]}
+    for m_type, m_size, m_color, g_lons, g_lats in groups:
+        layout['x'].append(g_lons.tolist())
+        layout['y'].append(g_lats.tolist())
+        layout['size'].append(int(m_size))
+        layout['color'].append(int(m_color))
+        layout['type'].append(str(m_type))
+    return layout
+
+def apply_layout(marker, layout):
+    # Set the positions and attributes of a vcs marker object from
+    # a layout returned by marker_layout
+    marker.x = layout['x']
+    marker.y = layout['y']
+    marker.size = layout['size']
+    marker.color = layout['color']
+    marker.type = layout['type']
+    return marker
+
+# The end
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# Module for masking gridded data before plotting it: diagonals (as in
+# bf_marker_proj_easy.py), land or sea points, bad quality control
+# points and regions defined by a polygon
+#
+# The masks are boolean arrays (True = masked) built with array
+# operations (no loop on the grid points), and apply_mask adds them to
+# the mask of a MV2 (or numpy.ma) variable in one operation, without
+# copying the data array.
+#
+# The masks that only depend on the grid (diagonals, polygons) are
+# cached: building the same mask again for the same grid just returns
+# the mask that was built the first time. Use clear_cache() to free
+# the memory used by the cached masks.
+#
+# Example:
+#   mask = polygon_mask(v.getLatitude()[:], v.getLongitude()[:],
+#                       [-10, 40, 40, -10], [35, 35, 70, 70]) # Europe
+#   apply_mask(v, mask | land_mask(sftlf))
+
+import numpy as np
+from numpy import ma
+
+# Cached masks, by (mask type, grid, mask parameters)
+_cache = {}
+
+def clear_cache():
+    _cache.clear()
+
+def _axis_key(axis):
+    # Something small and hashable that identifies a 1-D axis
+    axis = np.ascontiguousarray(axis, dtype=float)
+    return (axis.size, hash(axis.tobytes()))
+
+def _cached(key, build):
+    # Return the cached mask for key, building it the first time.
+    # The cached masks are read-only, so that they can not be modified
+    # by mistake (apply_mask does not modify them)
+    if key not in _cache:
+        mask = build()
+        mask.flags.writeable = False
+        _cache[key] = mask
+    return _cache[key]
+
+def diagonal_mask(shape):
+    # Mask the 2 diagonals of a 2-D array (the first min(shape)
+    # elements of each diagonal, as in bf_marker_proj_easy.py)
+    def build():
+        mask = np.zeros(shape, dtype=bool)
+        idx = np.arange(min(shape))
+        mask[idx, idx] = True
+        mask[shape[0] - 1 - idx, idx] = True
+        return mask
+    return _cached(('diagonal', tuple(shape)), build)
+
+def polygon_mask(lats, lons, poly_lons, poly_lats, inside=True):
+    # Mask the grid points inside (or outside, if inside=False) a
+    # polygon. The grid is defined by the lats and lons 1-D axes, and
+    # the polygon by the coordinates of its vertices (the polygon is
+    # closed automatically)
+    #
+    # Note: a point is inside the polygon if a line going east from
+    # the point crosses an odd number of polygon edges. The crossing
+    # only depends on the latitude of the point, and the crossing
+    # longitude is compared to all the longitudes of the grid at once
+    key = ('polygon', _axis_key(lats), _axis_key(lons),
+           tuple(poly_lons), tuple(poly_lats), inside)
+    def build():
+        lat = np.asarray(lats, dtype=float)[:, np.newaxis]
+        lon = np.asarray(lons, dtype=float)[np.newaxis, :]
+        px = np.asarray(poly_lons, dtype=float)
+        py = np.asarray(poly_lats, dtype=float)
+        mask = np.zeros((lat.shape[0], lon.shape[1]), dtype=bool)
+        for x1, y1, x2, y2 in zip(px, py, np.roll(px, -1), np.roll(py, -1)):
+            crosses = (y1 > lat) != (y2 > lat)
+            if not crosses.any():
+                continue
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+            mask ^= crosses & (lon < x_cross)
+        if not inside:
+            mask = ~mask
+        return mask
+    return _cached(key, build)
+
+def land_mask(sftlf, threshold=50., land=True):
+    # Mask the land (or sea, if land=False) points, using a land area
+    # fraction variable (sftlf, in %)
+    sftlf = ma.filled(sftlf, 0.)
+    if land:
+        return np.asarray(sftlf >= threshold)
+    return np.asarray(sftlf < threshold)
+
+def qc_mask(qc_flags, bad_flags):
+    # Mask the points whose quality control flag is in bad_flags
+    return np.isin(ma.filled(qc_flags, bad_flags[0]), bad_flags)
+
+def apply_mask(v, mask):
+    # Add mask to the mask of the v masked variable (MV2 or numpy.ma),
+    # in place. The mask is broadcast to the shape of v, so a 2-D
+    # (lat, lon) mask can be applied to a (time, lat, lon) variable
+    mask = np.broadcast_to(mask, v.shape)
+    if v.mask is ma.nomask:
+        v.mask = mask
+    else:
+        v.unshare_mask()
+        np.logical_or(v.mask, mask, out=v.mask)
+    return v
+
+# The end
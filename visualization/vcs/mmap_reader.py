@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+# Module for reading big variables from netCDF files without copying
+# them in memory, before plotting them with vcs
+#
+# f(var_name, ...) reads the whole selection in memory, and the 'oo'
+# longitude option (see bf_marker_proj_easy.py) makes one more copy of
+# it, in order to add the redundant longitude. For multi-GB fields,
+# this doubles (or more) the memory used by the script.
+#
+# read_mapped memory-maps the storage of the variable in the file, and
+# returns a cdms2 variable whose data is a view of the memory-mapped
+# array: only the pages that are actually used are read from the disk,
+# and they can be dropped again by the system if memory is needed
+#
+# * a selection is made with indices (integers or slices) on the
+#   dimensions, e.g. time=0, lat=slice(100, 200). Basic indexing always
+#   returns a view, never a copy
+# * the longitudes are NOT reordered and NOT extended with a redundant
+#   longitude: this would copy the data. The longitude axis keeps the
+#   order of the file (e.g. 0 to 357.5), and gets bounds, so that the
+#   cells cover the whole globe. vcs wraps the plotted cells to the
+#   longitude range of the graphics method (e.g. datawc -180 to 180)
+#   when it renders them, which plays the role of the redundant
+#   longitude
+# * the mask is built from the _FillValue (or missing_value) attribute
+#   of the variable. This is a boolean array, 1/4 of the size of float32
+#   data (no mask is built when the variable has no missing value)
+#
+# Which files can be memory-mapped:
+# * netCDF3 (classic and 64-bit offset) files, with scipy.io.netcdf_file
+# * netCDF4 (HDF5) files, with h5py, only for the variables that are
+#   stored contiguously (i.e. not chunked and not compressed). The
+#   variables with an unlimited dimension are always chunked in netCDF4
+#   files
+# For the other files and variables, read_mapped raises a MappingError,
+# and the variable has to be read normally with cdms2
+#
+# Note: classic netCDF files are big-endian. The data is converted to
+#       the native byte order by vcs when it renders it, one plotted
+#       field at a time
+#
+# Example:
+#   try:
+#       v = read_mapped('big_file.nc', 'tas', time=0)
+#   except MappingError:
+#       f = cdms2.open('big_file.nc')
+#       v = f('tas', time=slice(0, 1), squeeze=1)
+#       f.close()
+#   x.plot(v, bf)
+
+import numpy as np
+from numpy import ma
+import cdms2
+
+try:
+    from scipy.io import netcdf_file
+except ImportError:
+    netcdf_file = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+class MappingError(Exception):
+    pass
+
+# Attributes that describe the storage, not the data (they are not
+# copied to the cdms2 variables)
+_storage_attributes = ('_FillValue', 'missing_value', 'DIMENSION_LIST',
+                       'REFERENCE_LIST', 'CLASS', 'NAME', '_Netcdf4Dimid',
+                       '_Netcdf4Coordinates', '_nc3_strict')
+
+# The open files, by file name. The memory-mapped arrays need their file
+# to stay open, and reading several variables from the same file only
+# opens it once
+_open_files = {}
+
+def close_all():
+    # Forget the open files. The memory maps are really closed when the
+    # arrays that use them do not exist anymore
+    _open_files.clear()
+
+def _is_hdf5(file_name):
+    f = open(file_name, 'rb')
+    magic = f.read(8)
+    f.close()
+    return magic == b'\x89HDF\r\n\x1a\n'
+
+def _open(file_name):
+    if file_name not in _open_files:
+        if _is_hdf5(file_name):
+            if h5py is None:
+                raise MappingError('h5py is needed for memory-mapping netCDF4 files')
+            _open_files[file_name] = ('hdf5', h5py.File(file_name, 'r'))
+        else:
+            if netcdf_file is None:
+                raise MappingError('scipy is needed for memory-mapping netCDF3 files')
+            try:
+                f = netcdf_file(file_name, 'r', mmap=True, maskandscale=False)
+            except TypeError as err:
+                raise MappingError('%s is not a netCDF3 file (%s)' % (file_name, err))
+            _open_files[file_name] = ('netcdf3', f)
+    return _open_files[file_name]
+
+def _attributes(attributes):
+    result = {}
+    for name, value in attributes.items():
+        if name in _storage_attributes:
+            continue
+        if isinstance(value, bytes):
+            value = value.decode('utf-8', 'replace')
+        elif isinstance(value, np.ndarray) and value.size == 1:
+            value = value.item()
+        result[name] = value
+    return result
+
+def _missing_value(attributes):
+    for name in ('_FillValue', 'missing_value'):
+        value = attributes.get(name)
+        if value is not None:
+            return np.asarray(value).ravel()[0]
+    return None
+
+def _map_netcdf3(f, var_name):
+    if var_name not in f.variables:
+        raise KeyError(var_name)
+    var = f.variables[var_name]
+    # var.data is a memory-mapped array (or a view of the record array,
+    # for the variables with an unlimited dimension)
+    return var.data, tuple(var.dimensions), dict(var._attributes)
+
+def _map_hdf5(file_name, f, var_name):
+    ds = f[var_name]
+    if ds.chunks is not None or ds.compression is not None:
+        raise MappingError('%s is chunked or compressed in %s' % (var_name, file_name))
+    offset = ds.id.get_offset()
+    if offset is None:
+        raise MappingError('%s has no data in %s' % (var_name, file_name))
+    data = np.memmap(file_name, dtype=ds.dtype, mode='r',
+                     offset=offset, shape=ds.shape)
+    dims = []
+    for i, dim in enumerate(ds.dims):
+        if len(dim):
+            dims.append(dim[0].name.split('/')[-1])
+        else:
+            dims.append('dim%i' % (i,))
+    return data, tuple(dims), dict(ds.attrs)
+
+def map_variable(file_name, var_name):
+    # Return (data, dimensions, attributes) for the var_name variable of
+    # the file_name file, where data is a read-only memory-mapped array
+    # of the whole variable
+    kind, f = _open(file_name)
+    if kind == 'hdf5':
+        return _map_hdf5(file_name, f, var_name)
+    return _map_netcdf3(f, var_name)
+
+def _create_axis(file_name, dim, size, index):
+    # Create the cdms2 axis of a dimension, from its coordinate
+    # variable (if there is one). Only the selected part of the
+    # coordinate variable is used
+    try:
+        values, dims, attributes = map_variable(file_name, dim)
+    except (KeyError, MappingError):
+        values, attributes = np.arange(size, dtype=float), {}
+    values = np.array(values[index], dtype=float, ndmin=1)
+    bounds = None
+    bounds_name = attributes.get('bounds')
+    if isinstance(bounds_name, bytes):
+        bounds_name = bounds_name.decode('utf-8')
+    if bounds_name:
+        try:
+            bounds = np.array(map_variable(file_name, bounds_name)[0][index],
+                              dtype=float, ndmin=2)
+        except (KeyError, MappingError):
+            bounds = None
+    axis = cdms2.createAxis(values, bounds=bounds, id=dim)
+    for name, value in _attributes(attributes).items():
+        if name != 'bounds':
+            setattr(axis, name, value)
+    if axis.isLongitude() and bounds is None and len(values) > 1:
+        # Cells centered on the longitudes, so that a global grid
+        # covers the whole circle without a redundant longitude
+        axis.setBounds(axis.genGenericBounds())
+    return axis
+
+def read_mapped(file_name, var_name, **indices):
+    # Return the var_name variable of the file_name file as a cdms2
+    # variable whose data is a view of the memory-mapped file (see the
+    # top of this module)
+    #
+    # indices selects a part of the variable with integers or slices,
+    # by dimension name (e.g. time=0, lat=slice(100, 200)). The
+    # dimensions selected with an integer are removed
+    data, dims, attributes = map_variable(file_name, var_name)
+    unknown = set(indices) - set(dims)
+    if unknown:
+        raise ValueError('%s has no dimension %s' % (var_name, ', '.join(sorted(unknown))))
+    index = tuple([indices.get(dim, slice(None)) for dim in dims])
+    shape = data.shape
+    data = data[index]
+
+    axes = []
+    for dim, size, dim_index in zip(dims, shape, index):
+        if not isinstance(dim_index, slice):
+            continue
+        axes.append(_create_axis(file_name, dim, size, dim_index))
+
+    missing = _missing_value(attributes)
+    if missing is None:
+        mask = ma.nomask
+    elif np.isnan(missing):
+        mask = np.isnan(data)
+    else:
+        mask = data == missing
+    v = cdms2.createVariable(ma.masked_array(data, mask=mask, copy=False),
+                             axes=axes, id=var_name, copy=0,
+                             attributes=_attributes(attributes))
+    if missing is not None:
+        v.missing_value = missing
+    return v
+
+# The end
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+# Module for generating an 'atlas' of polar plots: N variables x the
+# zones of a zones dictionary (see polargol.py), 2 polar panels (left
+# and right) per landscape page
+#
+# * the zone subsets (e.g. orog_21k(select_dic['NH'])) are extracted
+#   only once per variable and zone, with one set of Selector objects
+# * the pages are plotted off-screen (bg=1) by a pool of worker
+#   processes. Each worker has its own canvas, on which the templates,
+#   projections and graphics methods are created only once (with the
+#   polargol.py functions), and then reused for all its pages
+# * each page is saved as a numbered png file, and the pdf pages are
+#   merged in a single multi-page pdf file, if the pypdf (or the older
+#   PyPDF2) module is available
+#
+# Example:
+#   def gm_setup(x):
+#       bf = x.createboxfill('pol_tst')
+#       bf.level_1 = -1000
+#       bf.level_2 = 5000
+#       return {'pol_tst':bf}
+#   panels = [('Orography 21k', orog_21k, 'pol_tst'),
+#             ('Orography 0k', orog_0k, 'pol_tst')]
+#   pages = render_atlas(panels, gm_setup, zones_dic, 'orog_atlas')
+#
+# Note: gm_setup has to be a function defined at the top level of a
+#       module, so that it can be sent to the worker processes
+
+import os
+from multiprocessing import Pool, cpu_count
+
+from polargol import create_gm, create_tpl_land, create_selectors
+
+try:
+    from pypdf import PdfWriter, PdfReader
+except ImportError:
+    try:
+        from PyPDF2 import PdfWriter, PdfReader # for older versions
+    except ImportError:
+        PdfWriter = None
+
+# Default zones: full hemispheres
+default_zones = {'NH':(0, 90, -180, 180),
+                 'SH':(-90, 0, -180, 180)}
+
+def zone_subsets(panels, zones, select_d=None):
+    # Extract the zone subsets of the panel variables, once per
+    # variable and zone. Return the subsets in a dictionary indexed by
+    # (panel index, zone)
+    select_d = create_selectors(zones, {} if select_d is None else select_d)
+    subsets = {}
+    done = {} # id(variable) -> panel index where it was first used
+    for i, (title, var, gm_name) in enumerate(panels):
+        first = done.setdefault(id(var), i)
+        for zone in sorted(zones.keys()):
+            if first == i:
+                subsets[(i, zone)] = var(select_d[zone])
+            else:
+                subsets[(i, zone)] = subsets[(first, zone)]
+    return subsets
+
+# Worker state (set by _init_worker in each worker process)
+_worker = {}
+
+def _init_worker(gm_setup, zones, out_types):
+    import vcs
+    x = vcs.init()
+    x.landscape()
+    gm_d = gm_setup(x)
+    create_gm(x, gm_d=gm_d, proj_d={}, select_d={}, zones=zones)
+    _worker['canvas'] = x
+    _worker['gm_d'] = gm_d
+    _worker['tpl_d'] = create_tpl_land(x, tpl_d={})
+    _worker['out_types'] = out_types
+
+def _render_page(job):
+    page_name, page_panels = job
+    x = _worker['canvas']
+    x.clear()
+    for tpl_name, (title, zone, gm_name, data) in zip(('tpl_l_left', 'tpl_l_right'),
+                                                      page_panels):
+        x.plot(_worker['tpl_d'][tpl_name],
+               _worker['gm_d']['%s_%s' % (gm_name, zone)],
+               data,
+               comment1=title,
+               comment2=zone,
+               bg=1)
+    created = []
+    for out_type in _worker['out_types']:
+        if out_type == 'pdf':
+            x.pdf(page_name, width=2*11, height=2*8)
+        else:
+            getattr(x, out_type)(page_name)
+        created.append('%s.%s' % (page_name, out_type))
+    return created
+
+def merge_pdf(page_files, out_file):
+    # Merge single page pdf files in a multi-page pdf file. Return
+    # False if there is no pdf module to do it
+    if PdfWriter is None:
+        return False
+    writer = PdfWriter()
+    for page_file in page_files:
+        for page in PdfReader(page_file).pages:
+            writer.add_page(page)
+    f = open(out_file, 'wb')
+    writer.write(f)
+    f.close()
+    return True
+
+def render_atlas(panels, gm_setup, zones=default_zones, out_name='polar_atlas',
+                 out_types=('png', 'pdf'), nb_workers=None):
+    # Plot all the (variable, zone) panels, 2 panels per page
+    #
+    # * panels is a list of (title, variable, gm_name), where gm_name
+    #   is the name of a graphics method of the dictionary returned by
+    #   gm_setup(x) (gm_setup is called once in each worker)
+    # * the pages are saved as out_name_001.png, ... and the pdf pages
+    #   are merged in out_name.pdf (or kept as out_name_001.pdf, ... if
+    #   there is no pdf module)
+    #
+    # Return the list of the created files
+    subsets = zone_subsets(panels, zones)
+    all_panels = []
+    for i, (title, var, gm_name) in enumerate(panels):
+        for zone in sorted(zones.keys()):
+            all_panels.append((title, zone, gm_name, subsets[(i, zone)]))
+    jobs = []
+    for page, first in enumerate(range(0, len(all_panels), 2)):
+        page_name = '%s_%03i' % (out_name, page + 1)
+        jobs.append((page_name, all_panels[first:first + 2]))
+    if not jobs:
+        return [] # nothing to plot (no panels or no zones)
+
+    if nb_workers is None:
+        nb_workers = cpu_count()
+    pool = Pool(min(nb_workers, len(jobs)), _init_worker,
+                (gm_setup, zones, out_types))
+    try:
+        page_files = pool.map(_render_page, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    created = []
+    pdf_pages = []
+    for files in page_files:
+        for page_file in files:
+            if page_file.endswith('.pdf'):
+                pdf_pages.append(page_file)
+            else:
+                created.append(page_file)
+    if pdf_pages:
+        if merge_pdf(pdf_pages, out_name + '.pdf'):
+            for page_file in pdf_pages:
+                os.remove(page_file)
+            created.append(out_name + '.pdf')
+        else:
+            created.extend(pdf_pages)
+    return created
+
+# The end
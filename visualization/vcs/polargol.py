@@ -10,6 +10,13 @@
 
 # from cdms.selectors import Selector # for old versions of CDAT
 from cdms2.selectors import Selector # for up-to-date CDAT
+import vcs
+
+# Quick lookup of the existing vcs elements (see vcs_registry.py)
+from vcs_registry import registry
+# Timing spans, disabled by default (see spans.py)
+from spans import span, timed
+import spans
 
 # Template positionning options
 leg_height_default = 0.02
@@ -17,24 +24,24 @@ shift_left_default = 0.05
 
 # Create templates with "no legend" (basically, only keep the data
 # area and the titles), based on the existing templates
+@timed()
 def create_tpl_nl(x, tpl_d):
-    tpl_exist = tpl_d.keys()
+    reg = registry(x)
+    tpl_exist = list(tpl_d.keys())
     for tpl_name in tpl_exist:
         # Do not do anything, if the current template is already OK
         # (ie already ends with '_nl')
         if tpl_name.endswith('_nl'):
             continue
         name_no_legend = '%s_%s' % (tpl_name, 'nl')
-        if name_no_legend not in x.listelements('template'):
-            tpl_no_legend = x.createtemplate(name_no_legend, tpl_name)
+        tpl_no_legend, created = reg.get_or_create('template', name_no_legend, tpl_name)
+        if created:
             tpl_no_legend.legend.priority = 0
             tpl_no_legend.min.priority = 0
             tpl_no_legend.mean.priority = 0
             tpl_no_legend.max.priority = 0
             tpl_no_legend.units.priority = 0
             tpl_no_legend.title.priority = 0
-        else:
-            tpl_no_legend = x.gettemplate(name_no_legend)
         tpl_d[name_no_legend] = tpl_no_legend
 
 # Create 2 templates suitable for polar plots in landscape
@@ -42,14 +49,17 @@ def create_tpl_nl(x, tpl_d):
 #
 # Notes:
 # * comment1 and comment2 centered above the data area
+@timed()
 def create_tpl_land(x, tpl_d={},
                     leg_height=leg_height_default,
                     shift_left=shift_left_default):
     
+    reg = registry(x)
+
     # Left template
-    if not tpl_d.has_key('tpl_l_left'):
-        if 'tpl_l_left' not in x.listelements('template'):
-            tpl_l_left = x.createtemplate('tpl_l_left', 'polar')
+    if 'tpl_l_left' not in tpl_d:
+        tpl_l_left, created = reg.get_or_create('template', 'tpl_l_left', 'polar')
+        if created:
             tpl_l_left.scale(.5, 'x')
             tpl_l_left.scale(.9)
             tpl_l_left.scale(9.9/11.3, 'y')  # Try to get a really round polar plot!
@@ -70,18 +80,14 @@ def create_tpl_land(x, tpl_d={},
             tpl_l_left.mean.priority = 0
             tpl_l_left.max.priority = 0
             tpl_l_left.units.priority = 0
-        else:
-            tpl_l_left = x.gettemplate('tpl_l_left')
         tpl_d['tpl_l_left'] = tpl_l_left
 
     # The 'right' template is based on the previously created 'left'
     # template shifted a bit right
-    if not  tpl_d.has_key('tpl_l_right'):
-        if 'tpl_l_right' not in x.listelements('template'):
-            tpl_l_right = x.createtemplate('tpl_l_right', 'tpl_l_left')
+    if 'tpl_l_right' not in tpl_d:
+        tpl_l_right, created = reg.get_or_create('template', 'tpl_l_right', 'tpl_l_left')
+        if created:
             tpl_l_right.move(.47, 'x')
-        else:
-            tpl_l_right = x.gettemplate('tpl_l_right')
         tpl_d['tpl_l_right'] = tpl_l_right
 
     # Create the 'no legend' templates
@@ -89,67 +95,72 @@ def create_tpl_land(x, tpl_d={},
 
     return tpl_d
 
+# Define selectors consistent with the requested zones
+@timed()
+def create_selectors(zones, select_d={}):
+    for zone in zones.keys():
+        if zone not in select_d:
+            zll = zones[zone]
+            select_d[zone] = Selector(latitude=(zll[0], zll[1]),
+                                      longitude=(zll[2], zll[3]))
+    return select_d
+
 # Create polar graphic methods for the requested zones
 # based on the supplied dictionary of graphic methods
+@timed()
 def create_gm(x, gm_d={}, proj_d={}, select_d={},
               zones={'NH':(0, 90, -180, 180),
                      'SH':(-90, 0, -180, 180)},
               lat_tics={-90:'', -60:'', -30:'', 0:'', 30:'', 60:'', 90:''},
               lon_tics={-180:'', -120:'', -60:'', 0:'', 60:'', 120:''}):
-    gm_exist = gm_d.keys()
+    reg = registry(x)
+    create_selectors(zones, select_d)
+    gm_exist = list(gm_d.keys())
     for gm_name in gm_exist:
         gm_source = gm_d[gm_name]
         if vcs.isboxfill(gm_source):
-            creategm = x.createboxfill
+            gm_type = 'boxfill'
         elif vcs.isisofill(gm_source):
-            creategm = x.createisofill
+            gm_type = 'isofill'
         elif vcs.isisoline(gm_source):
-            creategm = x.createisoline
+            gm_type = 'isoline'
         elif vcs.isoutline(gm_source):
-            creategm = x.createoutline
+            gm_type = 'outline'
         else:
             raise 'Unsupported graphic method in [%s]' % (gm_name,)
 
         for zone in zones.keys():
             zll = zones[zone]
 
-            # Define selectors consistent with the requested zones
-            if not select_d.has_key(zone):
-                select_d[zone] = Selector(latitude=(zll[0], zll[1]),
-                                            longitude=(zll[2], zll[3]))
-
             # Determine if we need a North or South pole projection,
             # depending on the specified zone
             if zll[1] > 0:
                 # Requested max lat is in the northern hemisphere, so
                 # we assume we want a North pole projection
-                if not proj_d.has_key('p_north'):
-                    if 'p_north' not in x.listelements('projection'):
-                        p_north = x.createprojection('p_north')
+                if 'p_north' not in proj_d:
+                    p_north, created = reg.get_or_create('projection', 'p_north')
+                    if created:
                         p_north.type='orthographic'
                         p_north.centerlongitude = 0.
                         p_north.centerlatitude = 90.
-                    else:
-                        p_north = x.createprojection('p_north')
                     proj_d['p_north'] = p_north
                 zone_proj = proj_d['p_north']
             else:
                 # We need a South pole projection
-                if not proj_d.has_key('p_south'):
-                    if 'p_south' not in x.listelements('projection'):
-                        p_south = x.createprojection('p_south')
+                if 'p_south' not in proj_d:
+                    p_south, created = reg.get_or_create('projection', 'p_south')
+                    if created:
                         p_south.type='orthographic'
                         p_south.centerlongitude = 0.
                         p_south.centerlatitude = -90.
-                    else:
-                        p_south = x.createprojection('p_south')
                     proj_d['p_south'] = p_south
                 zone_proj = proj_d['p_south']
             
             # Create the apropriate graphic method for the current
-            # zone
+            # zone (or reuse it, if it already exists, with the current
+            # settings of the source graphic method)
             name_zone = '%s_%s' % (gm_name, zone)
-            gm_zone = creategm(name_zone, gm_name)
+            gm_zone, created = reg.get_or_copy(gm_type, name_zone, gm_name)
             gm_zone.projection = zone_proj
             gm_zone.datawc(zll[0], zll[1], zll[2], zll[3])
             gm_zone.yticlabels(lat_tics, '')
@@ -162,7 +173,6 @@ def create_gm(x, gm_d={}, proj_d={}, select_d={},
 # Test the module by running it as a script
 if __name__ == '__main__':
 
-    import vcs
     # import cdms # for old versions of CDAT
     import cdms2 as cdms # for up-to-date CDAT
 
@@ -182,10 +192,14 @@ if __name__ == '__main__':
     select_dic={}
 
     # Get some data to plot
-    #f = cdms.open('/home/motifdb/pmip2db/pmip2_21k_oa/atm/fixed/orog/orog_A_FX_pmip2_21k_oa_IPSL-CM4-V1-MR.nc')
-    f = cdms.open('http://www-lscedods.cea.fr/cgi-bin/nph-dods/pmip2_dbext/pmip2_21k_oa/atm/fixed/orog/orog_A_FX_pmip2_21k_oa_IPSL-CM4-V1-MR.nc')
-    orog_21k = f('orog')
-    f.close()
+    # The data is only downloaded the first time the script is
+    # executed, and then read from a local cache (see remote_cache.py)
+    #data_url = '/home/motifdb/pmip2db/pmip2_21k_oa/atm/fixed/orog/orog_A_FX_pmip2_21k_oa_IPSL-CM4-V1-MR.nc'
+    data_url = 'http://www-lscedods.cea.fr/cgi-bin/nph-dods/pmip2_dbext/pmip2_21k_oa/atm/fixed/orog/orog_A_FX_pmip2_21k_oa_IPSL-CM4-V1-MR.nc'
+    from remote_cache import RemoteCache
+    cache = RemoteCache('polargol_cache')
+    with span('read_data'):
+        orog_21k = cache.read(data_url, 'orog')
 
     # Define the zones we want to plot (if not using the default full
     # NH and full SH)
@@ -193,10 +207,11 @@ if __name__ == '__main__':
                'SH':(-90, -30, -180, 180)}
 
     # Initialize vcs
-    x = vcs.init()
-    x.landscape()
-    y = vcs.init()
-    y.landscape()
+    with span('vcs.init'):
+        x = vcs.init()
+        x.landscape()
+        y = vcs.init()
+        y.landscape()
 
     # Change the default continent line
     cont_line = x.getline('continents')
@@ -208,54 +223,72 @@ if __name__ == '__main__':
     bf.level_2 = 5000
     bf.ext_2 = 'y'
     bf.legend = [-1000, 0, 1000, 2000, 3000, 4000, 5000]
+    # Or use levels computed from the quantiles of the data (see
+    # auto_levels.py), instead of the hard-coded ones
+    use_auto_levels = False
+    #use_auto_levels = True
+    if use_auto_levels:
+        from auto_levels import QuantileSketch, auto_levels, apply_levels
+        apply_levels(bf, auto_levels(QuantileSketch().update(orog_21k),
+                                     nb_intervals=6))
     gm_dic['pol_tst'] = bf
 
     # Create the polar graphic and projection methods, and the
     # required selection zones
-    print "User supplied graphic methods:", ', '.join(gm_dic.keys())
-    print "User supplied zones:", ', '.join(zones_dic.keys())
+    print("User supplied graphic methods: %s" % (', '.join(gm_dic.keys()),))
+    print("User supplied zones: %s" % (', '.join(zones_dic.keys()),))
     create_gm(x, zones=zones_dic,
               gm_d=gm_dic, proj_d=proj_dic, select_d=select_dic)
-    print "Created graphic methods:", ', '.join(gm_dic.keys())
-    print "Created polar projections:", ', '.join(proj_dic.keys())
+    print("Created graphic methods: %s" % (', '.join(gm_dic.keys()),))
+    print("Created polar projections: %s" % (', '.join(proj_dic.keys()),))
 
     # Create the templates
     create_tpl_land(x, tpl_d=tpl_dic)
-    print "Created templates", ', '.join(tpl_dic.keys())
+    print("Created templates %s" % (', '.join(tpl_dic.keys()),))
+
+    # Extract the zones we want to plot
+    with span('subset'):
+        orog_nh = orog_21k(select_dic['NH'])
+        orog_sh = orog_21k(select_dic['SH'])
 
     # Create the test plots
-    x.plot(tpl_dic['tpl_l_left'],
-           gm_dic['pol_tst_NH'],
-           orog_21k(select_dic['NH']),
-           comment1='Left plot',
-           comment2='Northern hemisphere...',
-           bg=bg_type)
-    x.plot(tpl_dic['tpl_l_right'],
-           gm_dic['pol_tst_SH'],
-           orog_21k(select_dic['SH']),
-           comment1='Right plot',
-           comment2='Southern hemisphere...',
-           bg=bg_type)
+    with span('x.plot'):
+        x.plot(tpl_dic['tpl_l_left'],
+               gm_dic['pol_tst_NH'],
+               orog_nh,
+               comment1='Left plot',
+               comment2='Northern hemisphere...',
+               bg=bg_type)
+        x.plot(tpl_dic['tpl_l_right'],
+               gm_dic['pol_tst_SH'],
+               orog_sh,
+               comment1='Right plot',
+               comment2='Southern hemisphere...',
+               bg=bg_type)
     if bg_type == 1:
         x.showbg()
-    x.pdf('polargol_a', width=2*11, height=2*8)
-    x.png('polargol_a')
+    with span('x.pdf'):
+        x.pdf('polargol_a', width=2*11, height=2*8)
+    with span('x.png'):
+        x.png('polargol_a')
     
-    y.plot(tpl_dic['tpl_l_left'],
-           gm_dic['pol_tst_NH'],
-           orog_21k(select_dic['NH']),
-           comment1='Left plot',
-           comment2='Notice that right plot is slightly rotated...',
-           bg=bg_type)
+    with span('x.plot'):
+        y.plot(tpl_dic['tpl_l_left'],
+               gm_dic['pol_tst_NH'],
+               orog_nh,
+               comment1='Left plot',
+               comment2='Notice that right plot is slightly rotated...',
+               bg=bg_type)
     # Change the projection a bit before plotting
     # (not very clean, but this is a test)
     proj_dic['p_north'].centerlongitude = -60
-    y.plot(tpl_dic['tpl_l_right_nl'],
-           gm_dic['pol_tst_NH'],
-           orog_21k(select_dic['NH']),
-           comment1='Right plot with no_legend template',
-           comment2='Can be used to overlay isolines, etc...',
-           bg=bg_type)
+    with span('x.plot'):
+        y.plot(tpl_dic['tpl_l_right_nl'],
+               gm_dic['pol_tst_NH'],
+               orog_nh,
+               comment1='Right plot with no_legend template',
+               comment2='Can be used to overlay isolines, etc...',
+               bg=bg_type)
 
     #
     # Also plot a box around a zone, on the RIGHT figure
@@ -286,8 +319,15 @@ if __name__ == '__main__':
     
     if bg_type == 1:
         y.showbg()
-    y.pdf('polargol_b', width=2*11, height=2*8)
-    y.png('polargol_b')
+    with span('x.pdf'):
+        y.pdf('polargol_b', width=2*11, height=2*8)
+    with span('x.png'):
+        y.png('polargol_b')
+
+    # Print the time spent in each stage, if the spans are enabled
+    # (e.g. with VCS_SPANS=polargol.folded python polargol.py)
+    if spans.is_enabled():
+        spans.report()
 
     # Note: checking the created vcs objects after running the script
     # and staying in interactive mode ("python -i my_polar_script.py")
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+# Module for plotting gridded data on a non-linear projection (robinson,
+# mollweide, sinusoidal, ...) as already projected grid cells, so that
+# the projection of the grid is computed only once for all the plots
+# that use the same grid
+#
+# When x.plot draws a boxfill with a non-linear projection, vcs projects
+# all the corners of all the grid cells, for each plot, even if only
+# the values change from one plot to the next (time steps, models, ...).
+#
+# Here, the corners of the cells are projected with NumPy, and the
+# projected cells are kept in a cache, by (projection, grid axes,
+# datawc):
+# * the x and y coordinates of the 4 corners of the cells are float32
+#   arrays of shape (nlat, nlon, 4), with a boolean array of the cells
+#   that are in the datawc zone
+# * the cache is kept in memory, for all the canvases, and optionally
+#   in a cache directory (as .npy files), for the next executions
+#
+# plot_cells plots the cells as fill areas (see fillarea_batch.py) in
+# the projected coordinates, with a linear world coordinate system, and
+# the color of each cell computed from its value (with the levels and
+# colors of a boxfill 'custom' type).
+#
+# With keep_fills=True, the fill area objects (the polygons of the
+# cells, each with its own color) are created the first time a grid is
+# plotted, and kept with the cells in the cache: the next plots of the
+# same grid only set the colors of the fill areas, instead of building
+# the polygon lists again. This is off by default: vcs still has to
+# draw one polygon per cell, and the 'projected_cells' benchmark of
+# benchmarks/run_benchmarks.py has to show that this is faster than a
+# plain x.plot of a boxfill, for your vcs version, grid and projection.
+#
+# Supported projections: 'linear', 'equirectangular', 'sinusoidal',
+# 'mollweide' and 'robinson' (on a unit sphere, with the central
+# longitude of the vcs projection). The robinson table is interpolated
+# linearly between the 5 degree values.
+#
+# Example:
+#   cache = CellCache('cells_cache') # or default_cache (memory only)
+#   for v in variables:
+#       x.clear()
+#       plot_cells(x, v, 'robinson', levels, colors, tpl, cache=cache)
+
+import os
+import hashlib
+from os import path
+
+import numpy as np
+from numpy import ma
+
+from fillarea_batch import fillarea_batches, create_fillareas
+
+# Robinson table: relative length of the parallels and distance to the
+# equator, every 5 degrees of latitude
+_robinson_lat = np.arange(0., 90.1, 5.)
+_robinson_x = np.array([1.0000, 0.9986, 0.9954, 0.9900, 0.9822, 0.9730, 0.9600,
+                        0.9427, 0.9216, 0.8962, 0.8679, 0.8350, 0.7986, 0.7597,
+                        0.7186, 0.6732, 0.6213, 0.5722, 0.5322])
+_robinson_y = np.array([0.0000, 0.0620, 0.1240, 0.1860, 0.2480, 0.3100, 0.3720,
+                        0.4340, 0.4958, 0.5571, 0.6176, 0.6769, 0.7346, 0.7903,
+                        0.8435, 0.8936, 0.9394, 0.9761, 1.0000])
+
+def _robinson(lon, lat):
+    abs_lat = np.abs(lat)
+    x = 0.8487 * np.interp(abs_lat, _robinson_lat, _robinson_x) * np.radians(lon)
+    y = 1.3523 * np.interp(abs_lat, _robinson_lat, _robinson_y) * np.sign(lat)
+    return x, y
+
+def _mollweide(lon, lat):
+    # Solve 2 theta + sin(2 theta) = pi sin(lat) with Newton's method
+    phi = np.radians(lat)
+    theta = phi.copy()
+    target = np.pi * np.sin(phi)
+    for i in range(20):
+        f = 2 * theta + np.sin(2 * theta) - target
+        df = 2 + 2 * np.cos(2 * theta)
+        step = np.where(df > 1e-12, f / np.where(df > 1e-12, df, 1.), 0.)
+        theta -= step
+        if np.abs(step).max() < 1e-10:
+            break
+    x = 2 * np.sqrt(2) / np.pi * np.radians(lon) * np.cos(theta)
+    y = np.sqrt(2) * np.sin(theta)
+    return x, y
+
+def _sinusoidal(lon, lat):
+    return np.radians(lon) * np.cos(np.radians(lat)), np.radians(lat)
+
+def _linear(lon, lat):
+    return lon, lat
+
+projections = {'linear':_linear, 'equirectangular':_linear,
+               'sinusoidal':_sinusoidal, 'mollweide':_mollweide,
+               'robinson':_robinson}
+
+def _bounds(axis, bounds=None, limits=None):
+    # Bounds of the cells of a 1-D axis: the given bounds, or the
+    # middles between the axis values
+    if bounds is not None:
+        bounds = np.asarray(bounds, dtype=float)
+        return bounds[:, 0], bounds[:, 1]
+    axis = np.asarray(axis, dtype=float)
+    if axis.size == 1:
+        return axis - 0.5, axis + 0.5
+    mid = (axis[1:] + axis[:-1]) / 2
+    first = axis[0] - (mid[0] - axis[0])
+    last = axis[-1] + (axis[-1] - mid[-1])
+    edges = np.concatenate(([first], mid, [last]))
+    if limits is not None:
+        edges = np.clip(edges, limits[0], limits[1])
+    return edges[:-1], edges[1:]
+
+def project_cells(proj_type, lats, lons, datawc=(-90, 90, -180, 180),
+                  center_lon=0., lat_bounds=None, lon_bounds=None):
+    # Project the corners of the cells of a lat/lon grid. Return a
+    # dictionary with the 'x' and 'y' (nlat, nlon, 4) float32 arrays of
+    # the projected corners, the 'valid' (nlat, nlon) array of the cells
+    # whose center is in datawc (latmin, latmax, lonmin, lonmax), and
+    # the projected 'extent' (xmin, xmax, ymin, ymax) of datawc
+    if proj_type not in projections:
+        raise ValueError('Unsupported projection %s (use one of: %s)'
+                         % (proj_type, ', '.join(sorted(projections.keys()))))
+    project = projections[proj_type]
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    latmin, latmax, lonmin, lonmax = datawc
+    lat1, lat2 = _bounds(lats, lat_bounds, (-90., 90.))
+    lon1, lon2 = _bounds(lons, lon_bounds)
+
+    # Longitudes relative to the central longitude, in [-180, 180[.
+    # The center of each cell is wrapped, and the corners follow it, so
+    # that the cells crossing the limit are not split
+    lon_c = (lons - center_lon + 180.) % 360. - 180.
+    shift = lon_c - lons
+    corner_lon = np.stack((lon1 + shift, lon2 + shift, lon2 + shift, lon1 + shift), axis=-1)
+    corner_lat = np.stack((lat1, lat1, lat2, lat2), axis=-1)
+    corner_lon = np.clip(corner_lon, -180., 180.)
+    lon_grid = np.broadcast_to(corner_lon[np.newaxis, :, :], (len(lat1), len(lon1), 4))
+    lat_grid = np.broadcast_to(corner_lat[:, np.newaxis, :], (len(lat1), len(lon1), 4))
+    x, y = project(lon_grid, lat_grid)
+
+    lon_in = ((lons - lonmin) % 360. <= (lonmax - lonmin)) | (lonmax - lonmin >= 360.)
+    lat_in = (lats >= min(latmin, latmax)) & (lats <= max(latmin, latmax))
+    valid = lat_in[:, np.newaxis] & lon_in[np.newaxis, :]
+
+    # Projected extent of the datawc zone (along its border)
+    border_lon = np.concatenate((np.linspace(lonmin, lonmax, 181), np.full(91, lonmax),
+                                 np.linspace(lonmin, lonmax, 181), np.full(91, lonmin)))
+    border_lat = np.concatenate((np.full(181, latmin), np.linspace(latmin, latmax, 91),
+                                 np.full(181, latmax), np.linspace(latmin, latmax, 91)))
+    bx, by = project(np.clip(border_lon - center_lon, -180., 180.), border_lat)
+    return {'x':x.astype(np.float32), 'y':y.astype(np.float32), 'valid':valid,
+            'extent':[float(bx.min()), float(bx.max()), float(by.min()), float(by.max())]}
+
+def _axis_bytes(a):
+    return np.ascontiguousarray(a, dtype=float).tobytes() if a is not None else b''
+
+class CellCache:
+    # Cache of projected cells, in memory and optionally on the disk
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.cells = {}
+        if cache_dir is not None and not path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, proj_type, lats, lons, datawc, center_lon, lat_bounds, lon_bounds):
+        h = hashlib.sha1(repr((proj_type, list(datawc), float(center_lon))).encode('utf-8'))
+        for a in (lats, lons, lat_bounds, lon_bounds):
+            h.update(_axis_bytes(a))
+        return h.hexdigest()
+
+    def get(self, proj_type, lats, lons, datawc=(-90, 90, -180, 180), center_lon=0.,
+            lat_bounds=None, lon_bounds=None):
+        # Return the projected cells (see project_cells), computing them
+        # only if they are not in the cache
+        key = self.key(proj_type, lats, lons, datawc, center_lon, lat_bounds, lon_bounds)
+        if key in self.cells:
+            return self.cells[key]
+        cells = None
+        if self.cache_dir is not None:
+            cells = self._load(key)
+        if cells is None:
+            cells = project_cells(proj_type, lats, lons, datawc, center_lon,
+                                  lat_bounds, lon_bounds)
+            if self.cache_dir is not None:
+                self._save(key, cells)
+        cells['key'] = key
+        self.cells[key] = cells
+        return cells
+
+    def _files(self, key):
+        base = path.join(self.cache_dir, key)
+        return [base + '_%s.npy' % (name,) for name in ('x', 'y', 'valid', 'extent')]
+
+    def _load(self, key):
+        files = self._files(key)
+        if not all([path.exists(name) for name in files]):
+            return None
+        try:
+            arrays = [np.load(name, mmap_mode='r') for name in files]
+        except (IOError, OSError, ValueError):
+            return None # damaged entry: compute it again
+        return {'x':arrays[0], 'y':arrays[1], 'valid':arrays[2],
+                'extent':[float(e) for e in arrays[3]]}
+
+    def _save(self, key, cells):
+        for name, array in zip(self._files(key), (cells['x'], cells['y'], cells['valid'],
+                                                  np.array(cells['extent']))):
+            tmp_name = name[:-4] + '_tmp.npy'
+            np.save(tmp_name, array)
+            os.rename(tmp_name, name)
+
+    def clear(self):
+        self.cells.clear()
+
+# Cache shared by all the plots (in memory only)
+default_cache = CellCache()
+
+def cell_colors(values, levels, colors, missing=255):
+    # Color index of each cell: colors[i] for levels[i] <= value <
+    # levels[i+1], and missing for the masked values and the values
+    # outside the levels
+    values = ma.asarray(values)
+    data = ma.getdata(values).astype(float)
+    idx = np.searchsorted(levels, data, side='right') - 1
+    outside = (idx < 0) | (idx >= len(levels) - 1) | ma.getmaskarray(values)
+    colors = np.asarray(colors)
+    return np.where(outside, missing, colors[np.clip(idx, 0, len(colors) - 1)])
+
+def cell_fillareas(x, cells, name='cells', batch_size=5000):
+    # Return the fill area objects of the valid cells and their numbers
+    # of polygons, created the first time and then kept with the cells.
+    # The names of the objects include the cache key of the cells and
+    # the batch size, so that objects with the same name always have
+    # the same polygons
+    fill_name = '%s_%i_%s' % (name, batch_size, cells['key'][:12])
+    fillareas = cells.setdefault('fillareas', {})
+    if fill_name not in fillareas:
+        valid = np.asarray(cells['valid'])
+        nb_cells = int(valid.sum())
+        batches = fillarea_batches(np.asarray(cells['x'])[valid].ravel(),
+                                   np.asarray(cells['y'])[valid].ravel(),
+                                   np.arange(0, 4 * nb_cells, 4),
+                                   batch_size=batch_size)
+        fillareas[fill_name] = (create_fillareas(x, fill_name, batches),
+                                [len(batch['x']) for batch in batches])
+    return fillareas[fill_name]
+
+def plot_cells(x, v, proj_type, levels, colors, tpl, datawc=None, center_lon=0.,
+               missing=255, cache=default_cache, name='cells', bg=1,
+               batch_size=5000, keep_fills=False):
+    # Plot the (lat, lon) cdms2 variable v as projected cells colored
+    # with levels and colors (len(colors) = len(levels) - 1), in the
+    # data area of the tpl template. Return the fill area objects. Use
+    # keep_fills=True to keep the fill areas for the next plots
+    lat_axis = v.getLatitude()
+    lon_axis = v.getLongitude()
+    if datawc is None:
+        datawc = (-90, 90, center_lon - 180, center_lon + 180)
+    cells = cache.get(proj_type, lat_axis[:], lon_axis[:], datawc, center_lon,
+                      lat_axis.getBounds(), lon_axis.getBounds())
+    valid = np.asarray(cells['valid'])
+    color = cell_colors(v, levels, colors, missing)[valid]
+    if keep_fills:
+        # Only the colors change from one plot to the next
+        fills, counts = cell_fillareas(x, cells, name, batch_size)
+        color = color.tolist()
+        start = 0
+        for fill, count in zip(fills, counts):
+            fill.color = color[start:start + count]
+            start += count
+    else:
+        nb_cells = color.size
+        batches = fillarea_batches(np.asarray(cells['x'])[valid].ravel(),
+                                   np.asarray(cells['y'])[valid].ravel(),
+                                   np.arange(0, 4 * nb_cells, 4),
+                                   color=color, batch_size=batch_size)
+        fills = create_fillareas(x, name, batches)
+    for fill in fills:
+        fill.worldcoordinate = cells['extent']
+        fill.viewport = [tpl.data.x1, tpl.data.x2, tpl.data.y1, tpl.data.y2]
+        x.plot(fill, bg=bg)
+    return fills
+
+# The end
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+# Module for caching the variables read from remote (OPeNDAP) data
+# files, so that scripts like polargol.py do not have to download the
+# same data each time they are executed
+#
+# The first read of a (url, variable, selection) downloads the data
+# with cdms2 as usual, and stores it in the cache directory as .npy
+# files (data and mask) and a small .json file (axes and attributes).
+# The next reads load the .npy files as memory-mapped arrays, without
+# any network access.
+#
+# * the total size of the cache is limited: when it is exceeded, the
+#   least recently used entries are removed
+# * freshness: if max_age (in seconds) is not None, an entry older
+#   than max_age is checked against the metadata of the remote file
+#   (global attributes and shape of the variable, or modification time
+#   and size for a local file), and downloaded again if they changed
+#
+# The selection can be given as cdms2 keyword selectors and/or
+# Selector objects (e.g. the selectors of the zones of polargol.py). The
+# entries are keyed on a canonical description of the selection (the
+# components of the Selectors, with the keywords sorted), so that the
+# same selection always gives the same entry
+#
+# Any local file can be used instead of a remote url, e.g. for testing
+#
+# Example:
+#   cache = RemoteCache('polar_cache', max_bytes=500e6)
+#   orog_21k = cache.read(url, 'orog')
+#   orog_nh = cache.read(url, 'orog', latitude=(30, 90))
+#   orog_sh = cache.read(url, 'orog', Selector(latitude=(-90, -30)))
+
+import os
+import time
+import json
+import hashlib
+from os import path
+
+import numpy as np
+from numpy import ma
+import cdms2
+from cdms2.selectors import Selector
+
+# Global attributes used for checking if a remote file has changed
+_signature_attributes = ('history', 'tracking_id', 'creation_date', 'date_created')
+
+class RemoteCache:
+
+    def __init__(self, cache_dir='remote_cache', max_bytes=1e9, max_age=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        if not path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.index_file = path.join(cache_dir, 'index.json')
+        if path.exists(self.index_file):
+            f = open(self.index_file)
+            self.index = json.load(f)
+            f.close()
+        else:
+            self.index = {}
+
+    def _save_index(self):
+        tmp_file = self.index_file + '.tmp'
+        f = open(tmp_file, 'w')
+        json.dump(self.index, f, indent=1)
+        f.close()
+        os.rename(tmp_file, self.index_file)
+
+    def _key(self, url, var_name, selectors, selection):
+        # Name of the cache entry for a (url, variable, selectors,
+        # keyword selection)
+        desc = repr((url, var_name, _canonical(list(selectors)),
+                     _canonical(selection)))
+        return hashlib.sha1(desc.encode('utf-8')).hexdigest()
+
+    def _files(self, key):
+        base = path.join(self.cache_dir, key)
+        return base + '.npy', base + '_mask.npy', base + '.json'
+
+    def signature(self, url, var_name):
+        # Metadata used to decide if the remote data has changed
+        if path.exists(url):
+            st = os.stat(url)
+            return [st.st_mtime, st.st_size]
+        f = cdms2.open(url)
+        sig = [getattr(f, name, None) for name in _signature_attributes]
+        sig.append(list(f[var_name].shape))
+        f.close()
+        return sig
+
+    def _is_fresh(self, entry, url, var_name):
+        if self.max_age is None:
+            return True
+        if time.time() - entry['checked'] < self.max_age:
+            return True
+        if self.signature(url, var_name) != entry['signature']:
+            return False
+        entry['checked'] = time.time()
+        return True
+
+    def read(self, url, var_name, *selectors, **selection):
+        # Return the var_name variable of the url file, with the optional
+        # cdms2 selectors (Selector objects) and selection (e.g.
+        # latitude=(30, 90), time=slice(0, 1)), from the cache if possible
+        key = self._key(url, var_name, selectors, selection)
+        entry = self.index.get(key)
+        if entry is not None and self._is_fresh(entry, url, var_name):
+            try:
+                var = self._load(key)
+            except (IOError, OSError, ValueError):
+                var = None # damaged entry: read it again
+            if var is not None:
+                entry['last_access'] = time.time()
+                self._save_index()
+                return var
+        return self._download(key, url, var_name, selectors, selection)
+
+    def _download(self, key, url, var_name, selectors, selection):
+        f = cdms2.open(url)
+        var = f(var_name, *selectors, **selection)
+        f.close()
+
+        data_file, mask_file, meta_file = self._files(key)
+        np.save(data_file, ma.getdata(var))
+        np.save(mask_file, ma.getmaskarray(var))
+        axes = []
+        for axis in var.getAxisList():
+            axes.append({'id':axis.id,
+                         'values':np.asarray(axis[:]).tolist(),
+                         'attributes':_jsonable(axis.attributes)})
+        meta = {'id':var.id, 'axes':axes,
+                'attributes':_jsonable(var.attributes)}
+        f = open(meta_file, 'w')
+        json.dump(meta, f)
+        f.close()
+
+        now = time.time()
+        size = sum([os.stat(name).st_size for name in self._files(key)])
+        self.index[key] = {'url':url, 'variable':var_name, 'size':size,
+                           'last_access':now, 'checked':now,
+                           'signature':self.signature(url, var_name)}
+        self._evict()
+        self._save_index()
+        return self._load(key)
+
+    def _load(self, key):
+        # Rebuild the variable from the cache files. The data and mask
+        # are memory-mapped, not read in memory
+        data_file, mask_file, meta_file = self._files(key)
+        f = open(meta_file)
+        meta = json.load(f)
+        f.close()
+        data = np.load(data_file, mmap_mode='r')
+        mask = np.load(mask_file, mmap_mode='r')
+        axes = []
+        for axis_meta in meta['axes']:
+            axis = cdms2.createAxis(np.array(axis_meta['values']), id=axis_meta['id'])
+            for name, value in axis_meta['attributes'].items():
+                setattr(axis, name, value)
+            axes.append(axis)
+        return cdms2.createVariable(ma.masked_array(data, mask=mask, copy=False),
+                                    axes=axes, id=meta['id'], copy=0,
+                                    attributes=meta['attributes'])
+
+    def _evict(self):
+        # Remove the least recently used entries, until the cache is
+        # smaller than max_bytes (the newest entry is always kept)
+        total = sum([entry['size'] for entry in self.index.values()])
+        by_age = sorted(self.index.items(), key=lambda item: item[1]['last_access'])
+        for key, entry in by_age[:-1]:
+            if total <= self.max_bytes:
+                break
+            self.remove(key)
+            total -= entry['size']
+
+    def remove(self, key):
+        for name in self._files(key):
+            if path.exists(name):
+                os.remove(name)
+        self.index.pop(key, None)
+
+    def clear(self):
+        for key in list(self.index.keys()):
+            self.remove(key)
+        self._save_index()
+
+def _canonical(value):
+    # Description of a selection that does not depend on the order of
+    # the keywords or on the identity of the objects: a Selector is
+    # described by its components (class name and attributes), with the
+    # positional components kept in order (their order is their axis)
+    if isinstance(value, Selector):
+        components = [_canonical(c) for c in value.components()]
+        positional = [c for c in components if c[0] == 'positionalComponent']
+        others = sorted([c for c in components if c[0] != 'positionalComponent'],
+                        key=repr)
+        return ('Selector', tuple(positional), tuple(others))
+    if isinstance(value, dict):
+        return tuple(sorted([(str(k), _canonical(v)) for k, v in value.items()],
+                            key=lambda item: item[0]))
+    if isinstance(value, (list, tuple)):
+        return tuple([_canonical(v) for v in value])
+    if isinstance(value, slice):
+        return ('slice', value.start, value.stop, value.step)
+    if isinstance(value, np.ndarray):
+        return _canonical(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if hasattr(value, '__dict__'):
+        # Selector components (axis, id, index, ... selections)
+        return (value.__class__.__name__,
+                tuple(sorted([(k, _canonical(v)) for k, v in vars(value).items()],
+                             key=lambda item: item[0])))
+    # Other values (e.g. cdtime times) by their string
+    return (value.__class__.__name__, str(value))
+
+def _jsonable(attributes):
+    # Keep the attributes that can be saved in a json file
+    result = {}
+    for name, value in attributes.items():
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        result[name] = value
+    return result
+
+# The end
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+
+# Local render service: a long-running process that plots vcs figures
+# for other scripts and returns the image files as bytes
+#
+# Starting python, importing vcs, initializing a canvas and creating
+# the templates usually takes much more time than plotting one figure.
+# The service does this only once: it keeps a pool of worker processes,
+# each with its own off-screen canvas where the standard templates are
+# already created
+#   * custom_tpl (see bf_marker_proj_easy.py)
+#   * tpl_l_left, tpl_l_right and their '_nl' versions (see polargol.py)
+#   * tpl_data, based on ASD_dud (only the data area, for overlaying
+#     continents, see test_fillarea.py)
+# The graphics methods and projections used by the jobs are created the
+# first time they are needed by a worker, and reused by the next jobs
+#
+# The clients send jobs over a local socket (multiprocessing.connection)
+# and get the image bytes back. The socket is a Unix-domain socket in a
+# private directory of the user running the service (a TCP socket on
+# localhost on the systems without Unix-domain sockets). The service
+# creates a random authentication key when it starts, and writes it to
+# a file of the same directory that only this user can read: the
+# clients read the key from that file
+#
+# IMPORTANT! The jobs are pickled objects, and unpickling can run any
+# code: the clients have to be trusted (i.e. run by the same user).
+# The key only makes sure of that as long as nobody else can read the
+# key file. The service also only reads the data files that are in its
+# data_dirs directories (the current directory by default)
+#
+# A job is a dictionary:
+#   {'data':('tas_mo.nc', 'tas', {'time':slice(0, 1), 'squeeze':1}),
+#                       # (file, variable, cdms2 selection) read by the
+#                       # worker, or a cdms2 variable
+#    'template':'custom_tpl',
+#    'gm_type':'boxfill', 'gm_source':'default',
+#    'gm_options':{'level_1':220, 'level_2':320},
+#    'projection':'robinson',  # optional
+#    'continents':1,           # optional
+#    'format':'png', 'width':11, 'height':8}
+# Only 'data' is required
+#
+# Example:
+#   Start the service in a terminal:
+#     python render_service.py
+#   and render figures in another script:
+#     from render_service import render
+#     png_bytes = render({'data':(file_name, 'tas', {'time':slice(0, 1)})})
+
+import os
+import sys
+import socket
+import getpass
+import tempfile
+import threading
+from os import path
+from multiprocessing import Pool, cpu_count
+from multiprocessing.connection import Listener, Client
+
+from vcs_registry import registry
+
+# Private directory of the service (socket and key file)
+service_dir = path.join(tempfile.gettempdir(),
+                        'vcs_render_service_%s' % (getpass.getuser(),))
+if hasattr(socket, 'AF_UNIX'):
+    default_address = path.join(service_dir, 'socket')
+else:
+    default_address = ('localhost', 6543)
+default_key_file = path.join(service_dir, 'authkey')
+
+# Default values of the optional job items
+job_defaults = {'template':'custom_tpl',
+                'gm_type':'boxfill',
+                'gm_source':'default',
+                'gm_options':{},
+                'projection':None,
+                'continents':None,
+                'format':'png',
+                'width':11,
+                'height':8}
+
+class RenderError(Exception):
+    pass
+
+def _private_dir(dir_name):
+    # Create the dir_name directory, only accessible by its owner, and
+    # make sure that nobody else can use it
+    if not path.isdir(dir_name):
+        os.makedirs(dir_name, 0o700)
+    if hasattr(os, 'getuid'):
+        st = os.stat(dir_name)
+        if st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise RenderError('%s is not a private directory of the current user'
+                              % (dir_name,))
+
+def create_authkey(key_file=default_key_file):
+    # Create a random authentication key, and write it to key_file,
+    # that only the current user can read
+    _private_dir(path.dirname(key_file))
+    authkey = os.urandom(32)
+    tmp_file = key_file + '_tmp'
+    if path.exists(tmp_file):
+        os.remove(tmp_file)
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        os.write(fd, authkey)
+    finally:
+        os.close(fd)
+    os.rename(tmp_file, key_file)
+    return authkey
+
+def read_authkey(key_file=default_key_file):
+    # Read the authentication key of a running service
+    try:
+        f = open(key_file, 'rb')
+    except (IOError, OSError):
+        raise RenderError('Can not read the key of the render service (%s): '
+                          'is the service running?' % (key_file,))
+    authkey = f.read()
+    f.close()
+    return authkey
+
+def setup_canvas(x):
+    # Create the standard templates on the x canvas, and return them
+    # in a dictionary
+    from bf_marker_proj_easy import create_template
+    from polargol import create_tpl_land
+    tpl_d = create_tpl_land(x, tpl_d={})
+    tpl_d['custom_tpl'] = create_template(x)
+    tpl_d['tpl_data'], created = registry(x).get_or_create('template', 'tpl_data', 'ASD_dud')
+    return tpl_d
+
+# Worker state (set by _init_worker in each worker process)
+_worker = {}
+
+def _init_worker(tmp_dir):
+    import vcs
+    x = vcs.init()
+    x.landscape()
+    _worker['canvas'] = x
+    _worker['tpl_d'] = setup_canvas(x)
+    _worker['gm_d'] = {} # (gm type, source, options) -> graphics method
+    _worker['tmp_dir'] = tmp_dir
+
+def _read_data(data):
+    if not isinstance(data, tuple):
+        return data
+    import cdms2
+    file_name, var_name, selection = data
+    f = cdms2.open(file_name)
+    v = f(var_name, **selection)
+    f.close()
+    return v
+
+def _get_gm(x, gm_type, gm_source, gm_options):
+    # The graphics method for these options, created the first time
+    key = (gm_type, gm_source, repr(sorted(gm_options.items())))
+    gm_d = _worker['gm_d']
+    if key not in gm_d:
+        name = 'svc_%s_%i' % (gm_type, len(gm_d))
+        gm = registry(x).create(gm_type, name, gm_source)
+        for attr, value in gm_options.items():
+            setattr(gm, attr, value)
+        gm_d[key] = gm
+    return gm_d[key]
+
+def _render(job):
+    # Plot the job on the worker canvas and return the image bytes
+    x = _worker['canvas']
+    options = dict(job_defaults)
+    options.update(job)
+    tpl = _worker['tpl_d'][options['template']]
+    gm = _get_gm(x, options['gm_type'], options['gm_source'], options['gm_options'])
+    args = [tpl]
+    if options['projection'] is not None:
+        pm, created = registry(x).get_or_create('projection',
+                                                'svc_%s' % (options['projection'].replace(' ', '-'),))
+        if created:
+            pm.type = options['projection']
+        args.append(pm)
+    args.extend([gm, _read_data(options['data'])])
+    kw = {'bg':1}
+    if options['continents'] is not None:
+        kw['continents'] = options['continents']
+
+    x.clear()
+    x.plot(*args, **kw)
+
+    fd, file_name = tempfile.mkstemp(suffix='.' + options['format'],
+                                     dir=_worker['tmp_dir'])
+    os.close(fd)
+    try:
+        getattr(x, options['format'])(file_name,
+                                      width=options['width'],
+                                      height=options['height'])
+        f = open(file_name, 'rb')
+        image = f.read()
+        f.close()
+    finally:
+        os.remove(file_name)
+    return image
+
+class RenderService:
+
+    def __init__(self, nb_canvases=None, address=default_address,
+                 key_file=default_key_file, data_dirs=None):
+        if nb_canvases is None:
+            nb_canvases = cpu_count()
+        self.address = address
+        self.key_file = key_file
+        self.authkey = create_authkey(key_file)
+        if data_dirs is None:
+            data_dirs = [os.getcwd()]
+        self.data_dirs = [path.realpath(d) for d in data_dirs]
+        self.tmp_dir = tempfile.mkdtemp(prefix='render_service_')
+        self.pool = Pool(nb_canvases, _init_worker, (self.tmp_dir,))
+        self.listener = None
+
+    def submit(self, job):
+        # Render a job in the pool, and return an AsyncResult (use
+        # its get() method to wait for the image bytes)
+        if 'data' not in job:
+            raise RenderError('No data in the job')
+        if isinstance(job['data'], tuple):
+            self._check_file(job['data'][0])
+        return self.pool.apply_async(_render, (job,))
+
+    def _check_file(self, file_name):
+        # Only read the local files of the data directories
+        real_name = path.realpath(file_name)
+        if '://' in file_name or not any([real_name.startswith(d + os.sep)
+                                          for d in self.data_dirs]):
+            raise RenderError('%s is not in the data directories of the service'
+                              % (file_name,))
+
+    def _serve_client(self, conn):
+        # Answer the jobs of one client, until it closes the connection
+        try:
+            while True:
+                try:
+                    job = conn.recv()
+                except EOFError:
+                    break
+                try:
+                    conn.send(('ok', self.submit(job).get()))
+                except Exception as err:
+                    conn.send(('error', '%s: %s' % (err.__class__.__name__, err)))
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        # Accept the clients, each one in its own thread, so that the
+        # jobs of several clients are rendered in parallel
+        if isinstance(self.address, str):
+            # Unix-domain socket, only accessible by the current user
+            _private_dir(path.dirname(self.address))
+            if path.exists(self.address):
+                os.remove(self.address) # left by a service that crashed
+        self.listener = Listener(self.address, authkey=self.authkey)
+        if isinstance(self.address, str):
+            os.chmod(self.address, 0o600)
+        try:
+            while True:
+                conn = self.listener.accept()
+                thread = threading.Thread(target=self._serve_client, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+        if path.exists(self.key_file):
+            os.remove(self.key_file)
+        self.pool.terminate()
+        self.pool.join()
+        if os.path.isdir(self.tmp_dir):
+            for name in os.listdir(self.tmp_dir):
+                os.remove(os.path.join(self.tmp_dir, name))
+            os.rmdir(self.tmp_dir)
+
+class RenderClient:
+    # Connection to a render service, for rendering several jobs
+    # without connecting again for each job
+
+    def __init__(self, address=default_address, key_file=default_key_file):
+        self.conn = Client(address, authkey=read_authkey(key_file))
+
+    def render(self, job):
+        self.conn.send(job)
+        status, result = self.conn.recv()
+        if status != 'ok':
+            raise RenderError(result)
+        return result
+
+    def close(self):
+        self.conn.close()
+
+def render(job, address=default_address, key_file=default_key_file):
+    # Render one job with the render service, and return the image bytes
+    client = RenderClient(address, key_file)
+    try:
+        return client.render(job)
+    finally:
+        client.close()
+
+# Start the service when the module is executed as a script
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        nb_canvases = int(sys.argv[1])
+    else:
+        nb_canvases = None
+    service = RenderService(nb_canvases)
+    print('Render service listening on %s (CTRL-C to stop)' % (default_address,))
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+# The end
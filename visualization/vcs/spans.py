@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+# Module for measuring where the time goes in the plotting scripts:
+# opening and reading the files, creating the templates and graphics
+# methods, plotting, saving the images, ...
+#
+# The stages are wrapped in named 'spans':
+#   with span('x.plot'):
+#       x.plot(tpl, bf, v, bg=1)
+# or, for a whole function:
+#   @timed('create_gm')
+#   def create_gm(...):
+#
+# The spans can be nested. Each span is recorded with its path, the
+# names of the spans it is in (e.g. 'read_data;cdms2.open'), and the
+# spans with the same path are aggregated: number of calls, total time,
+# maximum time and (optionally) memory allocated by python.
+#
+# * when the spans are disabled (the default), span() returns a shared
+#   object that does nothing, and timed() functions only test a flag,
+#   so the spans can be left in the scripts used in production
+# * enable them with enable(), or by setting the VCS_SPANS environment
+#   variable to the name of a file: the spans are then enabled when the
+#   module is imported, and written to this file (in the 'folded' format
+#   below) when python exits. Set VCS_SPANS_MEMORY=1 to also measure the
+#   memory (with tracemalloc, which slows python down)
+# * dump_folded writes one 'path microseconds' line per path, with the
+#   time spent in the span itself (not in its sub-spans): this is the
+#   input format of flamegraph.pl and speedscope
+#
+# Example:
+#   import spans
+#   spans.enable()
+#   ... run the plots ...
+#   spans.report()
+#   spans.dump_folded('plots.folded')
+
+import os
+import time
+import json
+import atexit
+import threading
+from functools import wraps
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None # python 2
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time # python 2
+
+_state = {'enabled':False, 'memory':False}
+_stats = {} # path -> [calls, total time, max time, memory]
+_lock = threading.Lock()
+_local = threading.local() # stack of the current span paths, per thread
+
+class _NullSpan:
+    # What span() returns when the spans are disabled
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_span = _NullSpan()
+
+class _Span:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        if stack:
+            self.path = stack[-1] + ';' + self.name
+        else:
+            self.path = self.name
+        stack.append(self.path)
+        if _state['memory']:
+            self.mem_start = tracemalloc.get_traced_memory()[0]
+        self.t_start = clock()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = clock() - self.t_start
+        memory = 0
+        if _state['memory']:
+            memory = tracemalloc.get_traced_memory()[0] - self.mem_start
+        _local.stack.pop()
+        with _lock:
+            stats = _stats.get(self.path)
+            if stats is None:
+                stats = _stats[self.path] = [0, 0., 0., 0]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            stats[3] += memory
+        return False
+
+def span(name):
+    # Context manager measuring the stage called name
+    if not _state['enabled']:
+        return _null_span
+    return _Span(name)
+
+def timed(name=None):
+    # Decorator measuring each call of a function in a span (named
+    # after the function by default)
+    def decorate(func):
+        span_name = name or func.__name__
+        @wraps(func)
+        def wrapper(*args, **kw):
+            if not _state['enabled']:
+                return func(*args, **kw)
+            with _Span(span_name):
+                return func(*args, **kw)
+        return wrapper
+    return decorate
+
+def enable(memory=False):
+    _state['enabled'] = True
+    if memory and tracemalloc is not None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _state['memory'] = True
+
+def disable():
+    _state['enabled'] = False
+    if _state['memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state['memory'] = False
+
+def is_enabled():
+    return _state['enabled']
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+def stats():
+    # Return the aggregated spans: a dictionary of
+    #   path -> {'calls', 'total', 'max', 'self', 'memory'}
+    # where 'self' is the total time minus the time of the sub-spans
+    with _lock:
+        result = {}
+        for path, (calls, total, t_max, memory) in _stats.items():
+            result[path] = {'calls':calls, 'total':total, 'max':t_max,
+                            'self':total, 'memory':memory}
+    for path, item in result.items():
+        parent = path.rpartition(';')[0]
+        if parent in result:
+            result[parent]['self'] -= item['total']
+    return result
+
+def report(out=None):
+    # Print the spans, sorted by path, with an indentation showing
+    # the nesting
+    lines = ['%-40s %7s %10s %10s %10s' % ('span', 'calls', 'total (s)', 'self (s)', 'max (s)')]
+    result = stats()
+    for path in sorted(result):
+        item = result[path]
+        depth = path.count(';')
+        name = '  ' * depth + path.rpartition(';')[2]
+        line = '%-40s %7i %10.4f %10.4f %10.4f' % (name, item['calls'], item['total'],
+                                                  item['self'], item['max'])
+        if _state['memory'] or item['memory']:
+            line += ' %10.1f MB' % (item['memory'] / 1e6,)
+        lines.append(line)
+    text = '\n'.join(lines)
+    if out is None:
+        print(text)
+    else:
+        out.write(text + '\n')
+    return text
+
+def dump_folded(file_name):
+    # Write the spans in the folded format (self time in microseconds)
+    f = open(file_name, 'w')
+    for path, item in sorted(stats().items()):
+        f.write('%s %i\n' % (path, max(0, int(round(item['self'] * 1e6)))))
+    f.close()
+
+def dump_json(file_name):
+    f = open(file_name, 'w')
+    json.dump(stats(), f, indent=1, sort_keys=True)
+    f.close()
+
+# Enable the spans from the environment (see the top of this module)
+_env_file = os.environ.get('VCS_SPANS')
+if _env_file:
+    enable(memory=os.environ.get('VCS_SPANS_MEMORY', '0') not in ('', '0'))
+    atexit.register(dump_folded, _env_file)
+
+# The end
@@ -12,6 +12,12 @@ from os import path
 # Import what we need from CDAT
 import cdms2
 import vcs
+import numpy as np
+
+# Cached continents overlays (continents_overlay.py)
+from continents_overlay import ContinentsOverlay, Image
+# Fill areas built from arrays (fillarea_batch.py)
+from fillarea_batch import rectangles, fillarea_batches, create_fillareas
 
 # Some data we can plot from the 'sample_data' directory
 # supplied with CDAT
@@ -33,6 +39,16 @@ var_name = 'tas'
 #bw_cont = False
 bw_cont = True
 
+# Paste a cached image of the black on white continents over the png
+# plot (see continents_overlay.py), instead of drawing the continents
+# again. The continents are still drawn for the pdf plot
+#cont_overlay = False
+cont_overlay = True
+if Image is None:
+    # The overlay needs PIL: without it, save_png draws the continents
+    # on the canvas, and the pdf would get them twice
+    cont_overlay = False
+
 # Read one time step (the first one) from the data file
 # and explicitely specify the lat/lon range we need. cdms2
 # will retrieve the data in the order we want, regardless of the way
@@ -78,56 +94,47 @@ else:
 # the canvas is set to zero)
 tpl = x.createtemplate('tpl', 'ASD')
 x.plot(tpl, isof, v, continents=cont_type)
+if bw_cont and cont_overlay:
+    # Save the png plot now, before drawing the continents for the pdf
+    overlay = ContinentsOverlay(styles=[(cont_white.linecolor, cont_white.linewidth),
+                                        (cont_black.linecolor, cont_black.linewidth)])
+    overlay.save_png(x, 'test_fillarea', tpl, isof)
 if bw_cont:
     tpl_data = x.createtemplate('tpl_data', 'ASD_dud') # plots only data area
     x.plot(tpl_data, cont_white)
     x.plot(tpl_data, cont_black)
 
 # Create a test plot for listing all the hatches and patterns
-style_list = []
-index_list = []
+#
+# One (sheared) rectangle per (style, index). The positions, indices
+# and colors of all the rectangles are computed with arrays, and the
+# rectangles are put in fill area objects by fillarea_batches (see
+# fillarea_batch.py), instead of appending them one by one to lists
 col_cycle = [243, 248, 254, 241, 255]
 nb_cols = len(col_cycle)
-color_list = []
-x_list = []
-y_list = []
-txt_x_list = []
-txt_y_list = []
-txt_str_list = []
+styles = np.array(['hatch', 'pattern'])
+j, i = np.meshgrid(np.arange(len(styles)), np.arange(20), indexing='ij')
+j = j.ravel()
+i = i.ravel()
 
 shear_x = .05
-for j, style in enumerate(['hatch', 'pattern']):
-    slide_y = j * .4
-    for i in range(20):
-        slide_x = i * 0.04
-        x1, y1 = (.05 + slide_x, .25 + slide_y)
-        x2, y2 = (.08 + slide_x, .45 + slide_y)
-
-        # Add (sheared) rectangles to the list of positions
-        # NOTE: no need to close the fill area. Giving 4 vertices
-        #       for getting a filled rectangle is enough
-        x_list.append([x1, x2, x2 + shear_x, x1 + shear_x])
-        y_list.append([y1, y1, y2, y2])
-
-        style_list.append(style)
-        # Hatches/Patterns indices have to be in 1-20 range
-        index_list.append(i+1)
-        col_idx = col_cycle[i % nb_cols]
-        color_list.append(col_idx)
-
-        # Annotations
-        txt_x_list.append(x1 + 0.015)
-        txt_y_list.append(y1 - 0.015)
-        txt_str_list.append('%s = %i  -  Color = %i' %
-                             (style, i+1, col_idx))
-
-# Create the fill area and the text annotations
-fill_test = x.createfillarea('fill_test')
-fill_test.style = style_list
-fill_test.index = index_list
-fill_test.color = color_list
-fill_test.x = x_list
-fill_test.y = y_list
+x1 = .05 + i * 0.04
+y1 = .25 + j * .4
+x_arr, y_arr, offsets = rectangles(x1, y1, x1 + .03, y1 + .2, shear_x)
+style_arr = styles[j]
+# Hatches/Patterns indices have to be in 1-20 range
+index_arr = i + 1
+color_arr = np.array(col_cycle)[i % nb_cols]
+
+# Create the fill areas and the text annotations
+fill_tests = create_fillareas(x, 'fill_test',
+                              fillarea_batches(x_arr, y_arr, offsets,
+                                               style_arr, index_arr, color_arr))
+
+txt_x_list = (x1 + 0.015).tolist()
+txt_y_list = (y1 - 0.015).tolist()
+txt_str_list = ['%s = %i  -  Color = %i' % item
+                for item in zip(style_arr, index_arr, color_arr)]
 
 fill_info = x.createtext('fill_info')
 fill_info.angle = 45
@@ -147,12 +154,14 @@ plot_title.y = [.9]
 # Initialize and use a second graphics canvas
 y = vcs.init()
 y.plot(plot_title)
-y.plot(fill_test)
+for fill_test in fill_tests:
+    y.plot(fill_test)
 y.plot(fill_info)
 
 # Save the plots
 x.pdf('test_fillarea')
-x.png('test_fillarea')
+if not (bw_cont and cont_overlay):
+    x.png('test_fillarea')
 y.pdf('test_fillarea_list')
 y.png('test_fillarea_list')
 
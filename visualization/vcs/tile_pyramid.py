@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+# Module for saving a map as a pyramid of small png tiles (z/x/y.png),
+# that a web viewer (e.g. Leaflet or OpenLayers) can load when the user
+# pans and zooms, instead of one huge png file
+#
+# At zoom level z, the map is split in square tiles of tile_size pixels.
+# A tile is only rendered the first time it is needed, and then kept
+# in the cache directory (cache_dir/<state>/z/x/y.png), so that the
+# tiles that are never looked at are never rendered. <state> is a hash
+# of the data, of the settings of the graphics method and projection,
+# and of the markers: the tiles of a map that has changed are never
+# taken for the tiles of the new map.
+#
+# Each tile is rendered with the projection and graphics method that
+# are used for the whole map (e.g. the ones created in
+# bf_marker_proj_easy.py): a copy of the graphics method gets the lon/lat
+# range of the tile as world coordinates, and the data is plotted with
+# a template whose data area covers the whole canvas (based on ASD_dud).
+# This only gives tiles that fit together when the tile borders are
+# lines of constant longitude and latitude in the projection, i.e. for
+# the projections where x only depends on the longitude and y only on
+# the latitude:
+# * 'mercator': the usual 'slippy map' tiles of the web viewers
+#   (2**z x 2**z tiles, between -85.05 and 85.05 degrees)
+# * 'linear': 'geodetic' tiles (2**(z+1) x 2**z tiles, each covering
+#   180/2**z degrees)
+# TileRenderer raises a ValueError for the other projections
+#
+# Example:
+#   tpl, pm, bf, marker_test = bfm.plot_figure(x, v, 'mercator', bg=1)
+#   tiles = TileRenderer(x, v, bf, pm, markers=marker_test)
+#   tiles.render_view(3, -20, 40, 30, 70) # the tiles showing Europe
+#   tiles.tile(5, 16, 10)                 # one tile, rendered if needed
+
+import os
+import math
+import hashlib
+from os import path
+
+import numpy as np
+from numpy import ma
+
+from vcs_registry import registry, copy_attributes
+
+# Tile schemes of the supported projections
+tile_schemes = {'mercator':'xyz', 'linear':'geodetic'}
+
+# Settings of the projection that change the tiles
+projection_attributes = ('type', 'centerlongitude', 'centerlatitude', 'parameters')
+
+# Latitude limit of the mercator tiles (square world at z = 0)
+max_mercator_lat = math.degrees(math.atan(math.sinh(math.pi)))
+
+class TileRenderer:
+
+    def __init__(self, x, v, gm, pm, cache_dir='tiles', tile_size=256,
+                 markers=None, gm_type='boxfill'):
+        proj_type = pm.type
+        if proj_type not in tile_schemes:
+            raise ValueError('Can not make tiles with the %s projection (use one of: %s)'
+                             % (proj_type, ', '.join(sorted(tile_schemes.keys()))))
+        self.x = x
+        self.v = v
+        self.pm = pm
+        self.scheme = tile_schemes[proj_type]
+        self.tile_size = tile_size
+
+        reg = registry(x)
+        # Copy of the markers, whose coordinates are changed for each
+        # tile (the markers of the caller are not modified)
+        if markers is not None:
+            markers, created = reg.get_or_copy('marker', '%s_tile' % (markers.name,),
+                                               markers.name)
+            markers.projection = pm
+        self.markers = markers
+        # Template: only the data area, covering the whole canvas
+        self.tpl, created = reg.get_or_create('template', 'tpl_tile', 'ASD_dud')
+        self.tpl.data.x1 = 0.
+        self.tpl.data.x2 = 1.
+        self.tpl.data.y1 = 0.
+        self.tpl.data.y2 = 1.
+        # Copy of the graphics method, whose world coordinates are
+        # changed for each tile
+        self.gm, created = reg.get_or_copy(gm_type, '%s_tile' % (gm.name,), gm.name)
+        self.gm.projection = pm
+        self.cache_dir = path.join(cache_dir, self.state_key())
+
+    def state_key(self):
+        # Hash of everything that changes the tiles
+        h = hashlib.sha1(repr((self.tile_size, self.scheme, self.v.shape,
+                               str(self.v.dtype))).encode('utf-8'))
+        h.update(np.ascontiguousarray(ma.getdata(self.v)).tobytes())
+        h.update(np.ascontiguousarray(ma.getmaskarray(self.v)).tobytes())
+        for axis in (self.v.getLatitude(), self.v.getLongitude()):
+            h.update(np.ascontiguousarray(axis[:], dtype=float).tobytes())
+        elements = [(self.gm, copy_attributes), (self.pm, projection_attributes)]
+        if self.markers is not None:
+            elements.append((self.markers, copy_attributes))
+        for elt, attrs in elements:
+            settings = [(attr, getattr(elt, attr)) for attr in attrs if hasattr(elt, attr)]
+            h.update(repr(settings).encode('utf-8'))
+        return h.hexdigest()[:16]
+
+    def nb_tiles(self, z):
+        # Number of tiles (along x, along y) at zoom level z
+        if self.scheme == 'geodetic':
+            return 2 ** (z + 1), 2 ** z
+        return 2 ** z, 2 ** z
+
+    def tile_bounds(self, z, tx, ty):
+        # Return the (lonmin, lonmax, latmin, latmax) of a tile. The
+        # tiles are numbered from the upper left corner of the map
+        nx, ny = self.nb_tiles(z)
+        lonmin = -180. + 360. * tx / nx
+        lonmax = -180. + 360. * (tx + 1) / nx
+        if self.scheme == 'geodetic':
+            latmax = 90. - 180. * ty / ny
+            latmin = 90. - 180. * (ty + 1) / ny
+        else:
+            latmax = _mercator_lat(ty, ny)
+            latmin = _mercator_lat(ty + 1, ny)
+        return lonmin, lonmax, latmin, latmax
+
+    def tiles_for_view(self, z, lonmin, lonmax, latmin, latmax):
+        # Return the (tx, ty) of the tiles showing a lon/lat region
+        nx, ny = self.nb_tiles(z)
+        tx1 = int(math.floor((lonmin + 180.) / 360. * nx))
+        tx2 = int(math.ceil((lonmax + 180.) / 360. * nx)) - 1
+        if self.scheme == 'geodetic':
+            ty1 = int(math.floor((90. - latmax) / 180. * ny))
+            ty2 = int(math.ceil((90. - latmin) / 180. * ny)) - 1
+        else:
+            ty1 = int(math.floor(_mercator_y(latmax) * ny))
+            ty2 = int(math.ceil(_mercator_y(latmin) * ny)) - 1
+        tx1, tx2 = max(tx1, 0), min(tx2, nx - 1)
+        ty1, ty2 = max(ty1, 0), min(ty2, ny - 1)
+        return [(tx, ty) for ty in range(ty1, ty2 + 1) for tx in range(tx1, tx2 + 1)]
+
+    def tile_file(self, z, tx, ty):
+        return path.join(self.cache_dir, str(z), str(tx), '%i.png' % (ty,))
+
+    def tile(self, z, tx, ty):
+        # Return the file of a tile, rendering it if it is not in the
+        # cache yet
+        tile_file = self.tile_file(z, tx, ty)
+        if not path.exists(tile_file):
+            self.render_tile(z, tx, ty, tile_file)
+        return tile_file
+
+    def render_tile(self, z, tx, ty, tile_file):
+        lonmin, lonmax, latmin, latmax = self.tile_bounds(z, tx, ty)
+        x = self.x
+        x.clear()
+        self.gm.datawc(latmin, latmax, lonmin, lonmax)
+        x.plot(self.tpl, self.pm, self.gm, self.v, bg=1)
+        if self.markers is not None:
+            self.markers.worldcoordinate = [lonmin, lonmax, latmin, latmax]
+            self.markers.viewport = [0., 1., 0., 1.]
+            x.marker(self.markers, bg=1)
+        tile_dir = path.dirname(tile_file)
+        if not path.exists(tile_dir):
+            os.makedirs(tile_dir)
+        # Write to a temporary file first, so that a viewer never gets
+        # a partly written tile
+        tmp_name = tile_file[:-4] + '_tmp'
+        x.png(tmp_name, width=self.tile_size, height=self.tile_size, units='pixels')
+        os.rename(tmp_name + '.png', tile_file)
+
+    def render_view(self, z, lonmin, lonmax, latmin, latmax):
+        # Make sure that the tiles showing a lon/lat region exist, and
+        # return their files
+        return [self.tile(z, tx, ty)
+                for tx, ty in self.tiles_for_view(z, lonmin, lonmax, latmin, latmax)]
+
+    def render_levels(self, z_max, z_min=0):
+        # Render all the tiles of the zoom levels z_min to z_max (only
+        # for the levels that are always looked at: the number of tiles
+        # is multiplied by 4 at each level)
+        created = []
+        for z in range(z_min, z_max + 1):
+            nx, ny = self.nb_tiles(z)
+            for ty in range(ny):
+                for tx in range(nx):
+                    created.append(self.tile(z, tx, ty))
+        return created
+
+def _mercator_lat(ty, ny):
+    # Latitude of the upper border of the ty-th mercator tile row
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2. * ty / ny))))
+
+def _mercator_y(lat):
+    # Position of a latitude in the mercator tiles (0 at the top, 1 at
+    # the bottom)
+    lat = max(min(lat, max_mercator_lat), -max_mercator_lat)
+    phi = math.radians(lat)
+    return (1 - math.log(math.tan(phi) + 1 / math.cos(phi)) / math.pi) / 2
+
+# Test the module by running it as a script: the first 3 levels of
+# the map of bf_marker_proj_easy.py, with a mercator projection
+if __name__ == '__main__':
+
+    import vcs
+    import bf_marker_proj_easy as bfm
+
+    v = bfm.read_data()
+    x = vcs.init()
+    tpl, pm, bf, marker_test = bfm.plot_figure(x, v, 'mercator', bg=1)
+    tiles = TileRenderer(x, v, bf, pm, cache_dir='bf_marker_tiles',
+                         markers=marker_test)
+    created = tiles.render_levels(2)
+    print('%i tiles in %s' % (len(created), tiles.cache_dir))
+
+# The end
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# Module for finding existing vcs elements (templates, projections,
+# graphics methods, ...) quickly
+#
+# x.listelements('template') builds and returns the list of all the
+# existing templates, and testing if a name is in this list scans the
+# whole list. Doing this for each template, zone and graphics method
+# becomes very slow when many plots are prepared.
+#
+# A Registry lists the existing elements of a given type only once, the
+# first time they are needed, and keeps the names in a set, which is
+# updated when elements are created with the registry. Use refresh()
+# if elements have been created or removed without the registry.
+#
+# The names of the vcs elements are global (an element created on a
+# canvas also exists for all the other canvases): the sets of names are
+# shared by the registries of all the canvases. If an element could not
+# be created because it already exists (e.g. created without the
+# registry), its type is listed again and the existing element is used.
+#
+# get_or_copy is get_or_create for copies of a source element (e.g. the
+# copy of a graphics method for each zone of a plot): an existing copy
+# is updated from its source (levels, colors, legend, ...), so that it
+# does not keep the settings of an older version of the source.
+#
+# Example:
+#   reg = registry(x) # always the same registry for the x canvas
+#   tpl, created = reg.get_or_create('template', 'my_tpl', 'ASD')
+#   if created:
+#       tpl.legend.priority = 0 # only set up new templates
+
+import weakref
+
+# Attributes that get_or_copy copies from the source to an existing
+# copy, when the element type has them (graphics methods and markers).
+# The world coordinates and projection are not copied: they are usually
+# what is specific to the copy
+copy_attributes = ('boxfill_type', 'level_1', 'level_2', 'color_1', 'color_2',
+                   'levels', 'fillareacolors', 'fillareastyle', 'fillareaindices',
+                   'fillareaopacity', 'legend', 'ext_1', 'ext_2', 'missing',
+                   'linecolors', 'linetypes', 'linewidths', 'label',
+                   'xticlabels1', 'yticlabels1', 'xticlabels2', 'yticlabels2',
+                   'xmtics1', 'ymtics1', 'xmtics2', 'ymtics2',
+                   'type', 'size', 'color', 'x', 'y')
+
+class Registry:
+
+    def __init__(self, x):
+        # Proxy, so that the registry does not keep the canvas alive
+        self.x = weakref.proxy(x)
+        self.names_d = _names_d # element type -> set of element names
+
+    def names(self, elt_type):
+        # Return the set of the names of the existing elements of
+        # the elt_type type ('template', 'projection', 'boxfill', ...)
+        if elt_type not in self.names_d:
+            self.names_d[elt_type] = set(self.x.listelements(elt_type))
+        return self.names_d[elt_type]
+
+    def refresh(self, elt_type=None):
+        # Forget the names of the elements of type elt_type (or of all
+        # types), so that they will be listed again when needed
+        if elt_type is None:
+            self.names_d.clear()
+        else:
+            self.names_d.pop(elt_type, None)
+
+    def exists(self, elt_type, name):
+        return name in self.names(elt_type)
+
+    def get(self, elt_type, name):
+        # x.gettemplate(name), x.getprojection(name), ...
+        return getattr(self.x, 'get' + elt_type)(name)
+
+    def create(self, elt_type, name, source=None):
+        # x.createtemplate(name, source), x.createprojection(name, source), ...
+        create_elt = getattr(self.x, 'create' + elt_type)
+        if source is None:
+            elt = create_elt(name)
+        else:
+            elt = create_elt(name, source)
+        self.names(elt_type).add(name)
+        return elt
+
+    def get_or_create(self, elt_type, name, source=None):
+        # Return (element, created), where created is True if the
+        # element did not exist and has just been created
+        if self.exists(elt_type, name):
+            return self.get(elt_type, name), False
+        try:
+            return self.create(elt_type, name, source), True
+        except Exception:
+            # Maybe created without the registry: list the elements again
+            self.refresh(elt_type)
+            if not self.exists(elt_type, name):
+                raise
+            return self.get(elt_type, name), False
+
+    def get_or_copy(self, elt_type, name, source, attrs=copy_attributes):
+        # Same as get_or_create(elt_type, name, source), but an existing
+        # copy is updated from the source element (given by its name)
+        elt, created = self.get_or_create(elt_type, name, source)
+        if not created:
+            src = self.get(elt_type, source)
+            for attr in attrs:
+                if hasattr(src, attr) and hasattr(elt, attr):
+                    setattr(elt, attr, getattr(src, attr))
+        return elt, created
+
+# Names of the existing elements, shared by all the registries (the
+# names of the vcs elements are the same for all the canvases)
+_names_d = {}
+
+# Registries of the canvases (a registry is forgotten when its canvas
+# does not exist anymore)
+_registries = weakref.WeakKeyDictionary()
+
+def registry(x):
+    # Return the registry of the x canvas, creating it the first time
+    if x not in _registries:
+        _registries[x] = Registry(x)
+    return _registries[x]
+
+# The end
@@ -8,14 +8,8 @@ if sys.version_info[0] != 3:
 else:
     from tkinter import *    # if Python 3.X
     
-import math
-
-# Some physical constants as global variables
-g = 9.80665  #  gravity m/s
-Rd = 287.1 # Specific gas contant for dry air, J kg-1 K-1
-Rv = 461.5 # Specific gas constant for water vapor, J kg-1 K-1
-Lv = 2.5e6 # Latent heat of vaporization, J kg-1
-cp = 1007.0 # Specific heat at constant pressure, J kg-1 K-1
+from thermo_formulas import thermo_calc
+from pressure_reduction import to_station
 
 class ThermoCalc:
     '''This application is a thermodynamic calculator for air under normal atmospheric conditions.
@@ -39,6 +33,15 @@ class ThermoCalc:
         self.h_template = '{0:.1f} %' # format for relative humidity string
         self.mix_template = '{0:.2f}  /  {1:.2f}  g/kg'
         self.slider_xpad = 60  # padding for all sliders
+
+        # Recompute scheduler: the slider callbacks only record what has to
+        # be updated, and the work is done once per idle loop by recompute()
+        self.master = master
+        self.todo = set()  # pending tasks: 'reduction', 'p_label', 'calc'
+        self.after_id = None
+        self.last_inputs = None  # (p, T, RH) used for the last calculation
+        self.results = None  # results of the last calculation
+        self.texts = {}  # last text set in each StringVar
         
         master.title('ThermoCalc')
 
@@ -245,98 +248,138 @@ For Educational Use Only.  Accuracy Not Guaranteed.  No Warranty Implied'''
             self.mslp_scale['state'] = 'disabled'
             self.p_scale['state'] = 'active'
 
+    # A unit change only reformats the labels and results: the values
+    # of the sliders do not change, so there is nothing to recompute
+
     def p_unit_change(self, val=0):  #val is dummy
-        self.update_mslp_label()
-        self.update_p_label()
+        if self.use_slp.get():
+            self.set_mslp_text()
+        self.schedule('p_label', 'calc')
 
     def a_unit_change(self, val=0):  #val is dummy
-        self.update_a_label()            
+        if self.use_slp.get():
+            self.set_a_text()
 
     def t_unit_change(self, val=0):  # val is dummy
-        self.update_t_label()
-        self.calculate()
+        self.set_t_text()
+        self.schedule('calc')
 
-    def update_mslp_label(self, val=0):   # val is dummy
+    def set_mslp_text(self):
         i = self.p_choice.get()
+        self.set_text(self.mslp_string, self.p_template[i].format(self.mslp_scale.get()*self.p_conv[i],
+                                        self.p_units[i]))
+
+    def set_a_text(self):
+        i = self.a_choice.get()
+        self.set_text(self.a_string, self.a_template[i].format(self.a_scale.get()*self.a_conv[i], self.a_units[i]))
+
+    def set_t_text(self):
+        self.set_text(self.t_string, self.t_template.format(self.t_scale.get()*self.t_conv[self.t_choice.get()][0]+
+                         self.t_conv[self.t_choice.get()][1], self.t_units[self.t_choice.get()]))
+
+    def update_mslp_label(self, val=0):   # val is dummy
         if self.use_slp.get():
-            self.pressure_reduction()
-            self.mslp_string.set(self.p_template[i].format(self.mslp_scale.get()*self.p_conv[i],
-                                            self.p_units[i]))
-            self.calculate()
+            self.set_mslp_text()
+            self.schedule('reduction')
         else:
             self.mslp_scale.set(101320)
-            self.mslp_string.set('')
+            self.set_text(self.mslp_string, '')
         
     def update_p_label(self, val=0):  # val is dummy
-        i = self.p_choice.get()
-        self.p_string.set(self.p_template[i].format(self.p_scale.get()*self.p_conv[i],
-                                            self.p_units[i]))
-        self.calculate()
+        self.schedule('p_label', 'calc')
 
     def update_h_label(self, val=0):  # val is dummy
-        self.h_string.set(self.h_template.format(self.h_scale.get()))
-        self.calculate()
+        self.set_text(self.h_string, self.h_template.format(self.h_scale.get()))
+        self.schedule('calc')
 
     def update_a_label(self, val=0):   # val is dummy
-        i = self.a_choice.get()
         if self.use_slp.get():
-            self.a_string.set(self.a_template[i].format(self.a_scale.get()*self.a_conv[i], self.a_units[i]))
-            self.pressure_reduction()
+            self.set_a_text()
+            self.schedule('reduction')
         else:
             self.a_scale.set(0)
-            self.a_string.set('')
+            self.set_text(self.a_string, '')
 
     def update_t_label(self, val=0):   # val is dummy 
-        self.t_string.set(self.t_template.format(self.t_scale.get()*self.t_conv[self.t_choice.get()][0]+
-                         self.t_conv[self.t_choice.get()][1], self.t_units[self.t_choice.get()]))
+        self.set_t_text()
         if self.use_slp.get():
+            self.schedule('reduction')
+        self.schedule('calc')
+
+    def set_text(self, var, text):
+        '''Sets the text of a StringVar, only if it has changed.'''
+        if self.texts.get(str(var)) != text:
+            var.set(text)
+            self.texts[str(var)] = text
+
+    def schedule(self, *tasks):
+        '''Records the tasks to do, and makes sure recompute() will be
+        called (only once) when Tk is idle.  All the slider events of a
+        frame are thus coalesced in a single update.'''
+        self.todo.update(tasks)
+        if self.after_id is None:
+            self.after_id = self.master.after_idle(self.recompute)
+
+    def recompute(self):
+        '''Does the pending tasks.'''
+        self.after_id = None
+        todo = self.todo
+        self.todo = set()
+        if 'reduction' in todo and self.use_slp.get():
             self.pressure_reduction()
-        self.calculate()
+            todo.update(('p_label', 'calc'))
+        if 'p_label' in todo:
+            i = self.p_choice.get()
+            self.set_text(self.p_string, self.p_template[i].format(self.p_scale.get()*self.p_conv[i],
+                                            self.p_units[i]))
+        if 'calc' in todo:
+            self.calculate()
 
     def pressure_reduction(self):
-        i = self.p_choice.get()
-        H = Rd*self.t_scale.get()/g  # Scale height
-        term = math.exp(-self.a_scale.get()/H)
-        p = self.mslp_scale.get()*term
+        # Isothermal reduction with the scale height Rd*T/g (see
+        # pressure_reduction.py for the array version)
+        p = to_station(self.mslp_scale.get(), self.a_scale.get(),
+                       self.t_scale.get(), nb_threads=1)
         self.p_scale['state'] = 'normal'
         self.p_scale.set(p)
-        self.p_string.set(self.p_template[i].format(self.p_scale.get()*self.p_conv[i],
-                                                self.p_units[i]))
         self.p_scale['state'] = 'disabled'
 
     def calculate(self):
-        '''Calculates thermodynamic variables from p, T, and RH.'''
+        '''Calculates thermodynamic variables from p, T, and RH.
+        The formulas themselves are in thermo_formulas.py, and they are
+        only evaluated again if p, T or RH have changed (a change of
+        units only changes the formatting).'''
         i = self.p_choice.get()  # index for pressure units
         T = self.t_scale.get()
         p = self.p_scale.get()
-        RH = self.h_scale.get()/100.0
-        term=Lv/Rv
-        sat_vapor = 611.0*math.exp(term*(1.0/273.15 - 1.0/T))
-        vapor = sat_vapor*RH
+        inputs = (p, T, self.h_scale.get())
+        if inputs != self.last_inputs:
+            self.results = thermo_calc(*inputs)
+            self.last_inputs = inputs
+        res = self.results
+        t_conv = self.t_conv[self.t_choice.get()]
+        t_units = self.t_units[self.t_choice.get()]
+        vapor = res['vapor']
+        sat_vapor = res['sat_vapor']
         e = (vapor*self.p_conv[i], sat_vapor*self.p_conv[i])
         s = self.vap_template[i].format(e[0], e[1], self.p_units[i])
-        self.vapor_string.set(s)
+        self.set_text(self.vapor_string, s)
         if vapor == 0:
-            Td = float('-inf')
-            self.td_string.set('dry')
+            self.set_text(self.td_string, 'dry')
         else:
-            Td_recip = 1.0/T - math.log(vapor/sat_vapor)/term
-            Td = 1.0/Td_recip
-            self.td_string.set(self.t_template.format(Td*self.t_conv[self.t_choice.get()][0]+
-                         self.t_conv[self.t_choice.get()][1], self.t_units[self.t_choice.get()]))
-        abs_hum = vapor/Rv/T
-        self.abs_string.set("{0:.2f} g/m^3".format(abs_hum*1000.0))        
-        mix_ratio = (Rd/Rv)*vapor/(p-vapor)
-        spec_hum = mix_ratio/(1 + mix_ratio)
-        self.mix_string.set(self.mix_template.format(mix_ratio*1000, spec_hum*1000))
-        Tv = T*(1 + 0.61*spec_hum)
-        self.virt_string.set(self.t_template.format(Tv*self.t_conv[self.t_choice.get()][0]+
-                         self.t_conv[self.t_choice.get()][1], self.t_units[self.t_choice.get()]))
-        rho = p/Rd/Tv
-        self.rho_string.set("{0:.2f} kg/m^3".format(rho))
-        theta = T*(100000.0/p)**(Rd/cp)
-        self.theta_string.set(self.t_template.format(theta*self.t_conv[self.t_choice.get()][0]+
-                         self.t_conv[self.t_choice.get()][1], self.t_units[self.t_choice.get()]))
+            Td = res['Td']
+            self.set_text(self.td_string, self.t_template.format(Td*t_conv[0]+t_conv[1], t_units))
+        abs_hum = res['abs_hum']
+        self.set_text(self.abs_string, "{0:.2f} g/m^3".format(abs_hum*1000.0))
+        mix_ratio = res['mix_ratio']
+        spec_hum = res['spec_hum']
+        self.set_text(self.mix_string, self.mix_template.format(mix_ratio*1000, spec_hum*1000))
+        Tv = res['Tv']
+        self.set_text(self.virt_string, self.t_template.format(Tv*t_conv[0]+t_conv[1], t_units))
+        rho = res['rho']
+        self.set_text(self.rho_string, "{0:.2f} kg/m^3".format(rho))
+        theta = res['theta']
+        self.set_text(self.theta_string, self.t_template.format(theta*t_conv[0]+t_conv[1], t_units))
         
 
 # ------------- END OF APP DEFINITION -----------------------------------
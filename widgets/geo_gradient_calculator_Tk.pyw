@@ -16,6 +16,8 @@ else:
     
 import math
 
+import gradient_wind
+
 class Geo_Gradient:
 
     def __init__(self, master):
@@ -167,34 +169,10 @@ No Warranty Implied'''
         Input is latitude (deg), contour interval, distance (km), and radius (km).
         Set pressure = True for pressure.  Default is height.
         Set anomalous = True to return both normal and anomalous values.  Default is normal only.
-        Pressure in hPa, distances in kilometers.'''
-        import math
-        omega = 7.292e-5  #  angular velocity of Earth, rad per second
-        g = 9.80665  #  standard gravity
-        f = 2*omega*math.sin(lat*math.pi/180.0) # Coriolis parameter
-        distance *= 1000.0  #  Convert to meters
-        radius *= 1000.0    #  Convert to meters
-        if pressure:
-            v_geo = interval*100.0/1.23/f/distance
-        else:
-            v_geo = g*interval/f/distance
-
-        fr = f*radius
-
-        # Calculate anticyclonic gradient wind
-        term = fr**2 - 4*fr*v_geo
-        v_grad_anti = float('nan') if term < 0 else (fr - math.sqrt(term))/2.0
-        v_grad_anti_anom = float('nan') if term < 0 else (fr + math.sqrt(term))/2.0
-
-        # Calculate cyclonic gradient wind
-        term = fr**2 + 4*fr*v_geo
-        v_grad_cyc = (-fr + math.sqrt(term))/2.0
-        v_grad_cyc_anom = (fr + math.sqrt(term))/2.0
-
-        if anomalous:
-            return v_geo, v_grad_cyc, v_grad_anti, v_grad_cyc_anom, v_grad_anti_anom
-        else:
-            return v_geo, v_grad_cyc, v_grad_anti
+        Pressure in hPa, distances in kilometers.
+        The formulas are in gradient_wind.py, which also works on whole arrays.'''
+        return gradient_wind.geo_gradient(lat, interval, distance, radius,
+                                          pressure=pressure, anomalous=anomalous)
 
 # ------------ END OF APP DEFINITION -------------------------------------------------------
 
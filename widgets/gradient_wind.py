@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# File: gradient_wind.py
+
+'''Array version of the geostrophic and gradient wind calculation of the
+GeoGradient widget (geo_gradient_calculator_Tk.pyw).
+
+geo_gradient() takes whole arrays (e.g. 2-D or 3-D fields from a
+reanalysis level) of latitude, contour interval, contour spacing and
+curvature radius, and returns all the wind speeds in one call.  The
+inputs are broadcast against each other, so a 1-D latitude array can be
+combined with 2-D spacing and radius fields.
+
+grid_gradient_wind() is a front end for gridded geopotential height or
+sea-level pressure fields (e.g. cdms2 variables): the contour spacing and
+the curvature radius of the isohypses/isobars are computed with finite
+differences on the lat/lon grid, and then fed to geo_gradient().
+
+Example:
+    >>> import numpy as np
+    >>> from gradient_wind import geo_gradient
+    >>> v_geo, v_cyc, v_anti = geo_gradient(np.array([40., 40.]), 60.,
+    ...                                     np.array([400., 100.]), 1500.)
+    >>> v_anti   # no anticyclonic gradient wind for the tight gradient
+    array([17.9943065,        nan])
+'''
+
+# Created from the GeoGradient widget written by Alex DeCaria
+
+import numpy as np
+
+omega = 7.292e-5  #  angular velocity of Earth, rad per second
+g = 9.80665  #  standard gravity
+a_earth = 6.371e6  #  mean radius of Earth, m
+
+def geo_gradient(lat, interval, distance, radius, pressure = False, anomalous = False):
+    '''Calulates geostrophic and gradient wind speeds (m/s).
+    Input is latitude (deg), contour interval, distance (km), and radius (km),
+    as scalars or arrays.
+    Set pressure = True for pressure.  Default is height.
+    Set anomalous = True to return both normal and anomalous values.  Default is normal only.
+    Pressure in hPa, distances in kilometers.
+    The anticyclonic winds are NaN where they do not exist.'''
+    lat = np.asarray(lat, dtype=float)
+    f = 2*omega*np.sin(np.deg2rad(lat)) # Coriolis parameter
+    distance = np.asarray(distance, dtype=float)*1000.0  #  Convert to meters
+    radius = np.asarray(radius, dtype=float)*1000.0    #  Convert to meters
+    if pressure:
+        v_geo = np.asarray(interval, dtype=float)*100.0/1.23/f/distance
+    else:
+        v_geo = g*np.asarray(interval, dtype=float)/f/distance
+
+    fr = f*radius
+    fr2 = fr**2
+    four_fr_vgeo = 4*fr*v_geo
+
+    # Calculate anticyclonic gradient wind (NaN where it does not exist)
+    term = fr2 - four_fr_vgeo
+    no_anti = term < 0
+    term = np.sqrt(np.where(no_anti, 0.0, term))
+    v_grad_anti = np.where(no_anti, np.nan, (fr - term)/2.0)
+    if anomalous:
+        v_grad_anti_anom = np.where(no_anti, np.nan, (fr + term)/2.0)
+
+    # Calculate cyclonic gradient wind
+    term = np.sqrt(fr2 + four_fr_vgeo)
+    v_grad_cyc = (-fr + term)/2.0
+
+    if anomalous:
+        v_grad_cyc_anom = (fr + term)/2.0
+        results = (v_geo, v_grad_cyc, v_grad_anti, v_grad_cyc_anom, v_grad_anti_anom)
+    else:
+        results = (v_geo, v_grad_cyc, v_grad_anti)
+    # Return NumPy scalars (rather than 0-d arrays) for scalar input
+    return tuple([np.asarray(r)[()] for r in results])
+
+def _d_dlon(field, lon, periodic):
+    '''Derivative along the last (longitude) axis, lon in radians.
+    With periodic=True, the first and last columns use the columns on
+    the other side of the wraparound (no padded copy of the field).'''
+    if not periodic:
+        return np.gradient(field, lon, axis=-1)
+    dlon = 2*(lon[1] - lon[0])
+    out = np.empty(field.shape)
+    np.subtract(field[..., 2:], field[..., :-2], out=out[..., 1:-1])
+    np.subtract(field[..., 1], field[..., -1], out=out[..., 0])
+    np.subtract(field[..., 0], field[..., -2], out=out[..., -1])
+    out /= dlon
+    return out
+
+def _lon_layout(lon):
+    '''Returns (periodic, redundant) for a longitude axis in degrees.
+    redundant is True when the last longitude repeats the first one
+    (e.g. what you get with the 'oo' option of cdms2).'''
+    lon = np.asarray(lon, dtype=float)
+    if lon.size < 3:
+        return False, False
+    span = abs(lon[-1] - lon[0])
+    dlon = abs(lon[1] - lon[0])
+    tol = 1e-3*dlon
+    if abs(span - 360.0) < tol:
+        return True, True
+    if abs(span + dlon - 360.0) < tol:
+        return True, False
+    return False, False
+
+def _stencil_mask(mask, periodic):
+    '''Spreads a boolean mask to the points whose finite differences use
+    a masked value (the point itself and its 4 neighbours, with the
+    longitude wraparound when periodic is True).'''
+    out = mask.copy()
+    out[..., 1:] |= mask[..., :-1]
+    out[..., :-1] |= mask[..., 1:]
+    if periodic:
+        out[..., 0] |= mask[..., -1]
+        out[..., -1] |= mask[..., 0]
+    out[..., 1:, :] |= mask[..., :-1, :]
+    out[..., :-1, :] |= mask[..., 1:, :]
+    return out
+
+def grid_gradient(field, lats, lons):
+    '''Computes the gradient magnitude (field units per meter) and the
+    curvature (1/m) of the contour lines of a gridded field.
+    field is a 2-D (lat, lon) array, or an array with extra leading
+    dimensions (e.g. time, level).  lats and lons are the 1-D axes in
+    degrees.  The longitude wraparound is used when the axis covers
+    the globe.  The curvature is positive when the contours are curved
+    around a minimum (low), i.e. for cyclonic flow.
+    Both are NaN on the pole rows, where the gradient is not defined,
+    and where the finite differences use a masked value.
+    The differences are computed on the data of field, without copying
+    it (the mask of a masked array is handled separately).  Only an
+    integer field (or a list) has to be copied, to a float array.'''
+    mask = None
+    if np.ma.getmask(field) is not np.ma.nomask:
+        mask = np.ma.getmaskarray(field)
+    field = np.ma.getdata(field)
+    if not np.issubdtype(field.dtype, np.floating):
+        field = np.asarray(field, dtype=float)
+    lat = np.deg2rad(np.asarray(lats, dtype=float))
+    lon = np.deg2rad(np.asarray(lons, dtype=float))
+    periodic, redundant = _lon_layout(lons)
+    if redundant:
+        # Work on a view without the redundant longitude, and copy the
+        # results of the first column to the last one at the end
+        field = field[..., :-1]
+        lon = lon[:-1]
+        if mask is not None:
+            mask = mask[..., :-1]
+
+    coslat = np.cos(lat)[:, np.newaxis]
+    at_pole = np.abs(coslat) < 1e-6
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        inv_acos = np.where(at_pole, np.nan, 1.0/(a_earth*coslat))
+
+        # Gradient components in the local east/north directions
+        grad_x = _d_dlon(field, lon, periodic)
+        grad_x *= inv_acos
+        grad_y = np.gradient(field, lat, axis=-2)
+        grad_y /= a_earth
+        grad = np.hypot(grad_x, grad_y)
+        if mask is not None:
+            # NaN where the differences use a masked value (the NaN then
+            # spreads to the curvature)
+            grad[_stencil_mask(mask, periodic)] = np.nan
+
+        # Curvature of the contours = divergence of the unit normal
+        grad_x /= grad
+        grad_y /= grad
+        grad_y *= coslat
+        curv = _d_dlon(grad_x, lon, periodic)
+        curv += np.gradient(grad_y, lat, axis=-2)
+        curv *= inv_acos
+
+    if redundant:
+        grad = np.concatenate((grad, grad[..., :1]), axis=-1)
+        curv = np.concatenate((curv, curv[..., :1]), axis=-1)
+    return grad, curv
+
+def grid_gradient_wind(field, lats=None, lons=None, pressure = False, min_lat = 5.0):
+    '''Calculates geostrophic and gradient wind speeds (m/s) from a gridded
+    geopotential height (gpm) or, with pressure = True, sea-level pressure
+    (hPa) field.
+    field can be a cdms2 variable, in which case lats and lons default to
+    its latitude and longitude axes, or an array with the lat/lon axes as
+    the last two dimensions.
+    Returns a dictionary of arrays with the same shape as field:
+        v_geo: geostrophic wind
+        v_grad: gradient wind, using the cyclonic or the anticyclonic
+                solution depending on the curvature of the contours
+                (NaN where the anticyclonic solution does not exist)
+        v_grad_cyc, v_grad_anti: both gradient wind solutions
+        spacing: contour spacing (km) for a unit contour interval
+        radius: curvature radius (km), inf for straight contours
+        cyclonic: True where the contours are cyclonically curved
+    The winds are NaN within min_lat degrees of the equator, where the
+    geostrophic approximation does not hold, and on the pole rows.'''
+    if lats is None:
+        lats = field.getLatitude()[:]
+    if lons is None:
+        lons = field.getLongitude()[:]
+    grad, curv = grid_gradient(field, lats, lons)
+
+    lat = np.asarray(lats, dtype=float)[:, np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        spacing = 1.0/(grad*1000.0)  # km, for an interval of 1 gpm or 1 hPa
+        radius = 1.0/(np.abs(curv)*1000.0)  # km
+        # geo_gradient uses the lat sign for the sign of f, but we only
+        # want wind speeds here
+        abs_lat = np.where(np.abs(lat) < min_lat, np.nan, np.abs(lat))
+        v_geo, v_grad_cyc, v_grad_anti = geo_gradient(abs_lat, 1.0, spacing, radius,
+                                                      pressure=pressure)
+    # Straight contours: the gradient wind is the geostrophic wind
+    straight = np.isinf(radius)
+    v_grad_cyc = np.where(straight, v_geo, v_grad_cyc)
+    v_grad_anti = np.where(straight, v_geo, v_grad_anti)
+    cyclonic = curv > 0
+    v_grad = np.where(cyclonic, v_grad_cyc, v_grad_anti)
+    return {'v_geo':v_geo, 'v_grad':v_grad, 'v_grad_cyc':v_grad_cyc,
+            'v_grad_anti':v_grad_anti, 'spacing':spacing, 'radius':radius,
+            'cyclonic':cyclonic}
+
+# The end
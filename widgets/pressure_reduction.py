@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# File: pressure_reduction.py
+
+'''Reduction of pressure between sea level and the ground, for whole
+grids of altitude, temperature and pressure (e.g. an orography field
+and the matching analysis fields).
+
+This is the calculation of ThermoCalc.pressure_reduction (ThermoCalc_Tk.pyw)
+extended to arrays, in both directions:
+    to_station: sea-level pressure -> station (ground) pressure
+    to_sea_level: station pressure -> sea-level pressure
+
+By default the air column is isothermal, with the scale height Rd*T/g,
+exactly as in the widget.  Optionally:
+    * RH (%) is used to replace T by the virtual temperature
+    * lapse_rate (K/m, scalar or array) gives a column whose temperature
+      decreases with height (T is then the temperature at the station,
+      and T + lapse_rate*z the temperature at sea level)
+
+Large grids are processed in blocks of about block_size points along
+the first axis, so that the temporary arrays stay in the processor
+caches, and the blocks are computed by a pool of threads (the NumPy
+functions release the GIL, so the threads really run in parallel).
+
+Example:
+    >>> import numpy as np
+    >>> from pressure_reduction import reduce_pressure
+    >>> p = reduce_pressure(101325., np.array([0., 1500.]), 288.,
+    ...                     'to_station')
+    >>> p
+    array([101325.        ,  84811.31374463])
+    >>> reduce_pressure(p, np.array([0., 1500.]), 288., 'to_sea_level')
+    array([101325., 101325.])
+'''
+
+# Created from the ThermoCalc widget written by Alex DeCaria
+
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from thermo_formulas import g, Rd, Rv, _prepare, _result, _sat_vapor
+
+directions = ('to_station', 'to_sea_level')
+
+def virtual_temperature(p, T, RH):
+    '''Virtual temperature (K) for pressure p (Pa), temperature T (K)
+    and relative humidity RH (%), computed from the specific humidity
+    exactly as in ThermoCalc and thermo_formulas.thermo_calc.'''
+    vapor = _sat_vapor(T)*RH/100.0
+    mix_ratio = (Rd/Rv)*vapor/(p - vapor)
+    spec_hum = mix_ratio/(1 + mix_ratio)
+    return T*(1 + 0.61*spec_hum)
+
+def _station_ratio(z, T, lapse_rate):
+    '''Ratio of the station pressure to the sea-level pressure, for
+    altitude z (m) and station (virtual) temperature T (K).'''
+    if lapse_rate is None:
+        return np.exp(-g*z/(Rd*T))
+    isothermal = lapse_rate == 0
+    safe_rate = np.where(isothermal, 1.0, lapse_rate)
+    ratio = (T/(T + safe_rate*z))**(g/(Rd*safe_rate))
+    if np.any(isothermal):
+        ratio = np.where(isothermal, np.exp(-g*z/(Rd*T)), ratio)
+    return ratio
+
+def _reduce_block(p, z, T, RH, lapse_rate, direction):
+    '''Pressure reduction of one block of the grid.'''
+    if RH is not None:
+        # The virtual temperature depends on the station pressure: in
+        # the to_station direction, the station pressure is first
+        # estimated with the dry temperature, and then corrected twice
+        # (the correction is much smaller than 1 Pa after that)
+        if direction == 'to_station':
+            Tv = T
+            for i in range(3):
+                p_station = p*_station_ratio(z, Tv, lapse_rate)
+                Tv = virtual_temperature(p_station, T, RH)
+        else:
+            Tv = virtual_temperature(p, T, RH)
+        T = Tv
+    ratio = _station_ratio(z, T, lapse_rate)
+    if direction == 'to_station':
+        return p*ratio
+    return p/ratio
+
+def _blocks(shape, block_size):
+    '''Slices of the first axis, each with about block_size points.'''
+    if len(shape) == 0:
+        return [()]
+    row_size = max(1, int(np.prod(shape[1:])))
+    rows = max(1, block_size//row_size)
+    return [slice(i, min(i + rows, shape[0])) for i in range(0, shape[0], rows)]
+
+def reduce_pressure(p, z, T, direction='to_station', RH=None, lapse_rate=None,
+                    block_size=65536, nb_threads=None):
+    '''Reduces pressure p (Pa) between sea level and the altitude z (m).
+    Input is pressure, altitude and temperature T (K), as scalars or
+    arrays, which are broadcast against each other (e.g. a 2-D
+    orography with 3-D (time, lat, lon) pressure and temperature).
+    direction is 'to_station' (p is the sea-level pressure) or
+    'to_sea_level' (p is the station pressure).
+    Set RH (%) to use the virtual temperature, and lapse_rate (K/m, e.g.
+    0.0065) for a column with a lapse rate instead of an isothermal one.
+    nb_threads is the number of threads (default: number of processors,
+    1 to compute everything in the calling thread).
+    Returns the reduced pressure (Pa), masked where an input is masked.'''
+    if direction not in directions:
+        raise ValueError('direction must be one of %s' % (', '.join(directions),))
+    args = [p, z, T]
+    if RH is not None:
+        args.append(RH)
+    if lapse_rate is not None:
+        args.append(lapse_rate)
+    arrays, mask = _prepare(*args)
+    arrays = np.broadcast_arrays(*arrays)
+    p, z, T = arrays[:3]
+    RH = arrays[3] if RH is not None else None
+    lapse_rate = arrays[-1] if lapse_rate is not None else None
+
+    out = np.empty(p.shape)
+    def compute(block):
+        out[block] = _reduce_block(p[block], z[block], T[block],
+                                   None if RH is None else RH[block],
+                                   None if lapse_rate is None else lapse_rate[block],
+                                   direction)
+    blocks = _blocks(p.shape, block_size)
+    if nb_threads is None:
+        nb_threads = cpu_count()
+    nb_threads = min(nb_threads, len(blocks))
+    if nb_threads <= 1:
+        for block in blocks:
+            compute(block)
+    else:
+        pool = ThreadPool(nb_threads)
+        try:
+            pool.map(compute, blocks)
+        finally:
+            pool.close()
+            pool.join()
+    return _result(out, mask)
+
+def to_station(p_msl, z, T, **options):
+    '''Station pressure (Pa) from the sea-level pressure p_msl (Pa).
+    See reduce_pressure for the arguments.'''
+    return reduce_pressure(p_msl, z, T, 'to_station', **options)
+
+def to_sea_level(p_station, z, T, **options):
+    '''Sea-level pressure (Pa) from the station pressure p_station (Pa).
+    See reduce_pressure for the arguments.'''
+    return reduce_pressure(p_station, z, T, 'to_sea_level', **options)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# File: stream_calc.py
+
+'''Applies the ThermoCalc and GeoGradient formulas (thermo_formulas.py and
+gradient_wind.py) to NetCDF time series that can be much larger than
+the available memory.
+
+The input file is read with cdms2, one chunk of time steps at a time,
+and the results are appended to the output file after each chunk.  The
+peak memory use thus depends on the chunk size, and not on the length
+of the file.  Everything is done with generators, so the steps can be
+combined freely:
+
+    f = cdms2.open('tas_mo.nc')
+    chunks = thermo_chunks(f, T='tas', p=101320., RH=50., chunk_size=12)
+    write_chunks('tas_mo_thermo.nc', chunks)
+    f.close()
+
+Execute this module as a script to process the 'tas_mo.nc' file of the
+CDAT 'sample_data' directory.'''
+
+import sys
+from os import path
+if sys.version_info[0] != 3:
+    from itertools import izip as zip    # if Python 2.X, do not read everything at once
+
+import cdms2
+
+from thermo_formulas import thermo_calc
+from gradient_wind import grid_gradient_wind
+
+# Units of the quantities computed by thermo_calc and grid_gradient_wind
+units = {'sat_vapor':'Pa', 'vapor':'Pa', 'Td':'K', 'abs_hum':'kg m-3',
+         'mix_ratio':'kg kg-1', 'spec_hum':'kg kg-1', 'Tv':'K',
+         'rho':'kg m-3', 'theta':'K', 'v_geo':'m s-1', 'v_grad':'m s-1',
+         'v_grad_cyc':'m s-1', 'v_grad_anti':'m s-1', 'spacing':'km',
+         'radius':'km', 'cyclonic':'1'}
+
+def time_chunks(f, var_name, chunk_size=12, **selectors):
+    '''Generator returning successive chunks of chunk_size time steps
+    of the var_name variable of the f cdms2 file (the last chunk may be
+    smaller).  Extra keyword arguments (e.g. latitude=(-90, 90)) are
+    passed to the cdms2 read call.'''
+    nb_times = len(f[var_name].getTime())
+    for start in range(0, nb_times, chunk_size):
+        stop = min(start + chunk_size, nb_times)
+        yield f(var_name, time=slice(start, stop), **selectors)
+
+def _input_chunks(f, value, chunk_size, selectors):
+    '''Chunks of a variable if value is a variable name, or the
+    (constant) value itself, repeated forever.'''
+    if isinstance(value, str):
+        for chunk in time_chunks(f, value, chunk_size, **selectors):
+            yield chunk
+    else:
+        while True:
+            yield value
+
+def _to_variables(results, names, template):
+    '''Converts the requested arrays of a results dictionary to cdms2
+    variables, with the axes of the template variable.'''
+    chunk = {}
+    for name in names:
+        chunk[name] = cdms2.createVariable(results[name],
+                                           axes=template.getAxisList(),
+                                           id=name,
+                                           attributes={'units':units.get(name, '')})
+    return chunk
+
+def thermo_chunks(f, T='tas', p='ps', RH='hurs', chunk_size=12,
+                  quantities=('Td', 'mix_ratio', 'Tv', 'rho', 'theta'),
+                  **selectors):
+    '''Generator returning, for each chunk of time steps, a dictionary of
+    cdms2 variables with the requested thermo_calc quantities.
+    T, p and RH are either the names of the temperature (K), pressure
+    (Pa) and relative humidity (%) variables in the f cdms2 file, or
+    constant values.  T has to be a variable name, and its axes are used
+    for the results.'''
+    inputs = zip(time_chunks(f, T, chunk_size, **selectors),
+                 _input_chunks(f, p, chunk_size, selectors),
+                 _input_chunks(f, RH, chunk_size, selectors))
+    for T_chunk, p_chunk, RH_chunk in inputs:
+        results = thermo_calc(p_chunk, T_chunk, RH_chunk)
+        yield _to_variables(results, quantities, T_chunk)
+
+def gradient_wind_chunks(f, var_name='zg', pressure=False, chunk_size=12,
+                         quantities=('v_geo', 'v_grad'), **selectors):
+    '''Generator returning, for each chunk of time steps, a dictionary of
+    cdms2 variables with the requested grid_gradient_wind quantities.
+    var_name is a geopotential height (gpm) variable, or a sea-level
+    pressure variable if pressure = True (in Pa or hPa, depending on its
+    'units' attribute).'''
+    for chunk in time_chunks(f, var_name, chunk_size, **selectors):
+        field = chunk
+        if pressure and getattr(chunk, 'units', 'Pa') == 'Pa':
+            field = chunk*0.01 # Pa -> hPa
+        results = grid_gradient_wind(field,
+                                     chunk.getLatitude()[:],
+                                     chunk.getLongitude()[:],
+                                     pressure=pressure)
+        yield _to_variables(results, quantities, chunk)
+
+def write_chunks(out_file, chunks):
+    '''Writes the chunks returned by one of the generators above to the
+    out_file NetCDF file, appending each chunk along the time axis as
+    soon as it is computed.  Returns the number of time steps written.'''
+    out = cdms2.open(out_file, 'w')
+    nb_times = 0
+    try:
+        for chunk in chunks:
+            chunk_length = 0
+            for name, var in chunk.items():
+                out.write(var, id=name, extend=1, index=nb_times)
+                chunk_length = len(var.getTime())
+            nb_times += chunk_length
+    finally:
+        out.close()
+    return nb_times
+
+# Test the module by running it as a script
+if __name__ == '__main__':
+
+    # Some data from the 'sample_data' directory supplied with CDAT
+    # (or any local NetCDF file given on the command line)
+    if len(sys.argv) > 1:
+        data_file = sys.argv[1]
+    else:
+        data_file = path.join(sys.prefix, 'sample_data', 'tas_mo.nc')
+    out_file = path.splitext(path.basename(data_file))[0] + '_thermo.nc'
+
+    f = cdms2.open(data_file)
+    # There is only temperature in the sample file: use a constant
+    # pressure and relative humidity
+    chunks = thermo_chunks(f, T='tas', p=101320., RH=50., chunk_size=12)
+    nb_times = write_chunks(out_file, chunks)
+    f.close()
+    print('%i time steps written to %s' % (nb_times, out_file))
+
+# The end
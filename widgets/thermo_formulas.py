@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# File: thermo_formulas.py
+
+'''Thermodynamic formulas of the ThermoCalc widget (ThermoCalc_Tk.pyw),
+without the GUI.
+
+The functions accept scalars, NumPy arrays or masked arrays (numpy.ma)
+of pressure (Pa), temperature (K) and relative humidity (%), and give
+exactly the same numbers as the widget.  Masked input points stay
+masked in the results.
+
+Example:
+    >>> import numpy as np
+    >>> from thermo_formulas import thermo_calc
+    >>> res = thermo_calc(np.array([101320., 85000.]),
+    ...                   np.array([288., 275.]),
+    ...                   np.array([50., 0.]))
+    >>> res['Td']   # the 'dry' case (RH = 0) is -inf
+    array([277.76410625,         -inf])
+'''
+
+# Created from the ThermoCalc widget written by Alex DeCaria
+
+import numpy as np
+from numpy import ma
+
+# Some physical constants as global variables
+g = 9.80665  #  gravity m/s
+Rd = 287.1 # Specific gas contant for dry air, J kg-1 K-1
+Rv = 461.5 # Specific gas constant for water vapor, J kg-1 K-1
+Lv = 2.5e6 # Latent heat of vaporization, J kg-1
+cp = 1007.0 # Specific heat at constant pressure, J kg-1 K-1
+
+# Names of the quantities returned by thermo_calc
+quantities = ('sat_vapor', 'vapor', 'Td', 'abs_hum', 'mix_ratio',
+              'spec_hum', 'Tv', 'rho', 'theta')
+
+def _prepare(*args):
+    '''Converts the inputs to float arrays and returns them, together
+    with the combined mask of the masked inputs (or None).'''
+    mask = None
+    arrays = []
+    for a in args:
+        if isinstance(a, ma.MaskedArray):
+            m = ma.getmaskarray(a)
+            mask = m if mask is None else (mask | m)
+            a = a.filled(1.0) # dummy value, result will be masked anyway
+        arrays.append(np.asarray(a, dtype=float))
+    return arrays, mask
+
+def _result(a, mask):
+    '''Returns a masked array if there was a mask on the input,
+    a NumPy scalar for scalar input and an array otherwise.'''
+    if mask is not None:
+        return ma.masked_array(a, mask=np.broadcast_to(mask, a.shape).copy())
+    return a[()]
+
+def _sat_vapor(T):
+    term = Lv/Rv
+    return 611.0*np.exp(term*(1.0/273.15 - 1.0/T))
+
+def _dew_point(T, vapor, sat_vapor):
+    term = Lv/Rv
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Td_recip = 1.0/T - np.log(vapor/sat_vapor)/term
+        Td = np.where(vapor == 0, -np.inf, 1.0/Td_recip)
+    return Td
+
+def sat_vapor_pressure(T):
+    '''Saturation vapor pressure (Pa) for temperature T (K).'''
+    (T,), mask = _prepare(T)
+    return _result(_sat_vapor(T), mask)
+
+def dew_point(T, RH):
+    '''Dew point (K) for temperature T (K) and relative humidity RH (%).
+    The dew point is -inf where RH is 0 (the widget displays 'dry').'''
+    (T, RH), mask = _prepare(T, RH)
+    sat_vapor = _sat_vapor(T)
+    vapor = sat_vapor*RH/100.0
+    return _result(_dew_point(T, vapor, sat_vapor), mask)
+
+def thermo_calc(p, T, RH):
+    '''Calculates all the thermodynamic variables of ThermoCalc in one pass.
+    Input is pressure (Pa), temperature (K) and relative humidity (%).
+    The inputs are broadcast against each other.
+    Returns a dictionary of arrays, with the keys listed in 'quantities':
+        sat_vapor, vapor: saturation and actual vapor pressure (Pa)
+        Td: dew point (K), -inf where the air is dry
+        abs_hum: absolute humidity (kg/m^3)
+        mix_ratio, spec_hum: mixing ratio and specific humidity (kg/kg)
+        Tv: virtual temperature (K)
+        rho: density (kg/m^3)
+        theta: potential temperature (K)'''
+    (p, T, RH), mask = _prepare(p, T, RH)
+    p, T, RH = np.broadcast_arrays(p, T, RH)
+    RH = RH/100.0
+    sat_vapor = _sat_vapor(T)
+    vapor = sat_vapor*RH
+    Td = _dew_point(T, vapor, sat_vapor)
+    abs_hum = vapor/Rv/T
+    mix_ratio = (Rd/Rv)*vapor/(p-vapor)
+    spec_hum = mix_ratio/(1 + mix_ratio)
+    Tv = T*(1 + 0.61*spec_hum)
+    rho = p/Rd/Tv
+    theta = T*(100000.0/p)**(Rd/cp)
+
+    results = {'sat_vapor':sat_vapor, 'vapor':vapor, 'Td':Td,
+               'abs_hum':abs_hum, 'mix_ratio':mix_ratio,
+               'spec_hum':spec_hum, 'Tv':Tv, 'rho':rho, 'theta':theta}
+    for name in quantities:
+        results[name] = _result(results[name], mask)
+    return results
+
+# The end